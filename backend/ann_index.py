@@ -0,0 +1,143 @@
+import numpy as np
+from typing import List, Optional
+
+class IVFFlatIndex:
+    """
+    Inverted-file (IVF-flat) approximate nearest-neighbour index
+    Rows are bucketed by their nearest k-means centroid and a query only
+    scores the rows in the `nprobe` buckets closest to it. The vectors
+    themselves stay in the caller's matrix; this index only stores row ids.
+    """
+
+    def __init__(self, dim: int, nlist: Optional[int] = None, nprobe: int = 8,
+                 min_train_rows: int = 4096, seed: int = 0):
+        """
+        Args:
+            dim: Embedding dimension
+            nlist: Number of buckets (default: sqrt of the row count at training time)
+            nprobe: Buckets scanned per query; higher means better recall, slower search
+            min_train_rows: Rows needed before the index is trained
+            seed: Random seed for k-means initialisation
+        """
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_rows = min_train_rows
+        self.seed = seed
+        self.centroids = None
+        # Rows the centroids were learned from; callers retrain once the
+        # index has grown well past it
+        self.trained_rows = 0
+        self._lists: List[np.ndarray] = []
+        self._assignment = np.empty(0, dtype=np.int32)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def num_buckets(self) -> int:
+        return len(self._lists)
+
+    def train(self, vectors: np.ndarray, iterations: int = 10):
+        """
+        Learn bucket centroids with spherical k-means and assign every row
+
+        Args:
+            vectors: L2-normalized rows; row i of the caller's matrix is vectors[i]
+            iterations: k-means iterations
+        """
+        n = len(vectors)
+        nlist = self.nlist or int(np.clip(np.sqrt(n), 16, 1024))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+
+        # Train on a sample, as faiss does; ~32 points per centroid is plenty
+        sample_size = min(n, nlist * 32)
+        sample = np.asarray(vectors[rng.choice(n, sample_size, replace=False)], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            # Reseed empty buckets with random sample points
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = sums / norms
+
+        self.centroids = centroids.astype(np.float32)
+        self.trained_rows = n
+        self._lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self._assignment = np.empty(0, dtype=np.int32)
+        self.add(np.arange(n), vectors)
+        print(f"🧭 IVF index trained: {n} rows in {nlist} buckets (nprobe={self.nprobe})")
+
+    def _assign(self, vectors: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+        """Nearest centroid of each row, computed in batches to bound memory"""
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), batch_size):
+            batch = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+            labels[start:start + batch_size] = np.argmax(batch @ self.centroids.T, axis=1)
+        return labels
+
+    def add(self, row_ids: np.ndarray, vectors: np.ndarray):
+        """
+        Insert rows into their nearest buckets without retraining
+
+        Args:
+            row_ids: Row ids in the caller's matrix (must extend the current range)
+            vectors: L2-normalized rows, aligned with row_ids
+        """
+        if not self.is_trained or len(row_ids) == 0:
+            return
+        labels = self._assign(vectors)
+        self._assignment = np.concatenate([self._assignment, labels])
+        order = np.argsort(labels, kind='stable')
+        touched, starts = np.unique(labels[order], return_index=True)
+        bounds = list(starts[1:]) + [len(order)]
+        for bucket, start, end in zip(touched, starts, bounds):
+            self._lists[bucket] = np.concatenate([self._lists[bucket], np.asarray(row_ids)[order[start:end]]])
+
+    def remap(self, keep: np.ndarray):
+        """
+        Follow a compaction of the caller's matrix without retraining
+        Rows where `keep` is False are dropped and the rest renumbered
+
+        Args:
+            keep: Boolean mask over the old rows
+        """
+        if not self.is_trained:
+            return
+        new_ids = np.cumsum(keep) - 1
+        # Build a new bucket list rather than editing it in place, so a
+        # shallow copy of this index made beforehand keeps the old numbering
+        self._lists = [new_ids[ids[keep[ids]]] for ids in self._lists]
+        self._assignment = self._assignment[keep]
+
+    def reset(self):
+        """Forget centroids and buckets (index must be retrained)"""
+        self.centroids = None
+        self.trained_rows = 0
+        self._lists = []
+        self._assignment = np.empty(0, dtype=np.int32)
+
+    def candidates(self, query_embeddings: np.ndarray, nprobe: Optional[int] = None) -> List[np.ndarray]:
+        """
+        Row ids worth scoring for each query
+
+        Args:
+            query_embeddings: L2-normalized queries, one per row
+            nprobe: Buckets to scan (defaults to self.nprobe)
+
+        Returns:
+            One array of candidate row ids per query
+        """
+        nprobe = min(nprobe or self.nprobe, len(self._lists))
+        centroid_scores = query_embeddings @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        return [np.concatenate([self._lists[bucket] for bucket in row]) for row in probes]
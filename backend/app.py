@@ -4,23 +4,32 @@ import firebase_admin
 from firebase_admin import credentials, auth, db
 from datetime import datetime
 import traceback
+import atexit
 import base64
 import os
 from io import BytesIO
 import google.generativeai as genai
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import PyPDF2
-import docx
-import io as io_module
+import httplib2
 import json
+import hashlib
+import threading
+import time
 from collections import defaultdict
-from simple_rag import rag_system
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+from simple_rag import rag_system
+from job_queue import JobQueue
+from text_extraction import ExtractionEngine
+import data_access
+from blob_store import create_blob_store
+from ttl_cache import TTLCache
+
 app = Flask(__name__)
 # In production, the frontend will be hosted on Firebase.
 CORS(app, resources={r"/api/*": {"origins": [
@@ -42,6 +51,8 @@ except Exception as e:
 
 # Initialize Gemini AI
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+# Seconds a single Gemini request may take before it is abandoned
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '60'))
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
     gemini_model = genai.GenerativeModel('gemini-2.0-flash-exp')
@@ -52,51 +63,128 @@ else:
 
 # Initialize YouTube API
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
+# Socket timeout of YouTube API requests, so a hung call cannot hold a worker
+YOUTUBE_HTTP_TIMEOUT = float(os.getenv('YOUTUBE_HTTP_TIMEOUT', '10'))
 youtube_service = None
 if YOUTUBE_API_KEY:
     try:
-        youtube_service = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
+        youtube_service = build(
+            'youtube', 'v3', developerKey=YOUTUBE_API_KEY, http=httplib2.Http(timeout=YOUTUBE_HTTP_TIMEOUT)
+        )
         print("✅ YouTube API initialized")
     except Exception as e:
         print(f"⚠️  YouTube API initialization failed: {e}")
 else:
     print("⚠️  YouTube API key not found")
 
-# ============ Helper Functions ============
+# The client's httplib2 connection is not thread-safe, so threads other than
+# the one that built youtube_service get their own client
+_youtube_local = threading.local()
 
-def extract_text_from_pdf(file_content):
-    """Extract text from PDF file content"""
-    try:
-        pdf_reader = PyPDF2.PdfReader(io_module.BytesIO(file_content))
-        return "".join(page.extract_text() + "\n" for page in pdf_reader.pages)
-    except Exception as e:
-        print(f"Error extracting PDF: {e}")
+def get_youtube_service():
+    """YouTube API client for the calling thread (None if the API is not configured)"""
+    if not youtube_service:
         return None
+    if not hasattr(_youtube_local, 'service'):
+        _youtube_local.service = build(
+            'youtube', 'v3', developerKey=YOUTUBE_API_KEY, cache_discovery=False,
+            http=httplib2.Http(timeout=YOUTUBE_HTTP_TIMEOUT)
+        )
+    return _youtube_local.service
+
+# ============ Helper Functions ============
 
-def extract_text_from_docx(file_content):
-    """Extract text from DOCX file content"""
+# Parsing PDFs/DOCX is CPU-bound, so it runs in a process pool
+extraction_engine = ExtractionEngine(
+    workers=int(os.getenv('EXTRACTION_WORKERS', '0')) or None,
+    timeout=float(os.getenv('EXTRACTION_TIMEOUT', '120'))
+)
+
+# Uploaded files live in the blob store; material records keep their contentKey
+blob_store = create_blob_store()
+
+def read_material_content(material_id, material):
+    """Raw file bytes of a material record (or indexing job) from the blob store, or its base64 copy"""
+    if 'fileContent' in material:
+        # Legacy record that has not been migrated yet
+        return base64.b64decode(material['fileContent'])
     try:
-        doc = docx.Document(io_module.BytesIO(file_content))
-        return "\n".join(para.text for para in doc.paragraphs)
-    except Exception as e:
-        print(f"Error extracting DOCX: {e}")
-        return None
+        return blob_store.get(material['contentKey'])
+    except KeyError:
+        # The blob lived in a non-durable store that has since been lost
+        file_content = data_access.get_material_file(material_id)
+        if file_content is None:
+            raise
+        return base64.b64decode(file_content)
+
+def read_material_source(material_id, material):
+    """Path of a material's file when the blob store keeps it on disk, else its raw bytes"""
+    path = blob_store.local_path(material['contentKey']) if material.get('contentKey') else None
+    if path and os.path.exists(path):
+        return path
+    return read_material_content(material_id, material)
 
 # ============ YouTube Search Function ============
 
+# Search results per topic are reused for days; videos rarely disappear and
+# every search.list call costs 100 quota units
+YOUTUBE_CACHE_DAYS = float(os.getenv('YOUTUBE_CACHE_DAYS', '7'))
+youtube_search_cache = TTLCache(
+    'youtube-search',
+    max_entries=int(os.getenv('YOUTUBE_CACHE_SIZE', '2000')),
+    ttl=YOUTUBE_CACHE_DAYS * 86400,
+    path=os.getenv('YOUTUBE_CACHE_PATH') or None
+)
+
+# Generated class insights are reused until the class data behind them changes
+class_insights_cache = TTLCache(
+    'class-insights',
+    max_entries=int(os.getenv('INSIGHTS_CACHE_SIZE', '512')),
+    ttl=float(os.getenv('INSIGHTS_CACHE_TTL', str(6 * 3600))),
+    path=os.getenv('INSIGHTS_CACHE_PATH') or None
+)
+
+# Quota units per call, from the YouTube Data API v3 quota table
+YOUTUBE_QUOTA_COST = {'search': 100, 'videos': 1}
+youtube_usage = {'searchCalls': 0, 'videosCalls': 0, 'quotaUnits': 0, 'errors': 0}
+youtube_usage_lock = threading.Lock()
+
+def record_youtube_usage(call=None, error=False):
+    """Count a YouTube API call (and its quota cost) or a failed search"""
+    with youtube_usage_lock:
+        if call:
+            youtube_usage[f'{call}Calls'] += 1
+            youtube_usage['quotaUnits'] += YOUTUBE_QUOTA_COST[call]
+        if error:
+            youtube_usage['errors'] += 1
+
+def get_youtube_stats():
+    """YouTube API usage since startup plus search cache counters"""
+    with youtube_usage_lock:
+        stats = dict(youtube_usage)
+    stats['cache'] = youtube_search_cache.get_stats()
+    return stats
+
 def search_youtube_videos(topic, max_results=2):
-    """Search for real educational YouTube videos using YouTube Data API"""
+    """Search for real educational YouTube videos using YouTube Data API (API errors are raised)"""
     if not youtube_service:
         print("⚠️  YouTube API not available")
         return []
     
+    cache_key = f"{' '.join(topic.lower().split())}:{max_results}"
+    cached = youtube_search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
         # Enhanced search query for educational content
         search_query = f"{topic} tutorial explanation education"
         
         print(f"🔍 Searching YouTube for: {search_query}")
         
-        search_response = youtube_service.search().list(
+        service = get_youtube_service()
+        record_youtube_usage('search')
+        search_response = service.search().list(
             q=search_query,
             type='video',
             part='id,snippet',
@@ -107,58 +195,68 @@ def search_youtube_videos(topic, max_results=2):
             order='relevance',
             videoEmbeddable='true'
         ).execute()
+        
+        items = [item for item in search_response.get('items', []) if item.get('id', {}).get('videoId')]
+        
+        # Get statistics for all hits in one call (the API takes up to 50 ids)
+        view_counts = {}
+        if items:
+            record_youtube_usage('videos')
+            video_stats_response = service.videos().list(
+                part='statistics',
+                id=','.join(item['id']['videoId'] for item in items[:50])
+            ).execute()
+            for stats_item in video_stats_response.get('items', []):
+                view_counts[stats_item['id']] = int(stats_item.get('statistics', {}).get('viewCount', 0))
 
         videos = []
-        for item in search_response.get('items', []):
+        for item in items:
             try:
                 video_id = item['id']['videoId']
                 snippet = item['snippet']
                 
-                # Get video statistics for quality filtering
-                video_stats_response = youtube_service.videos().list(
-                    part='statistics,contentDetails',
-                    id=video_id
-                ).execute()
+                if video_id not in view_counts:
+                    continue
+                view_count = view_counts[video_id]
                 
-                if video_stats_response['items']:
-                    stats = video_stats_response['items'][0]['statistics']
-                    view_count = int(stats.get('viewCount', 0))
-                    
-                    # Filter out low-quality videos
-                    if view_count < 1000:
-                        continue
-                    
-                    video_data = {
-                        'title': snippet['title'],
-                        'link': f'https://www.youtube.com/watch?v={video_id}',
-                        'description': snippet['description'][:200] + '...' if len(snippet['description']) > 200 else snippet['description'],
-                        'thumbnail': snippet['thumbnails']['medium']['url'],
-                        'channelTitle': snippet['channelTitle'],
-                        'publishedAt': snippet['publishedAt'],
-                        'viewCount': view_count,
-                        'type': 'youtube'
-                    }
-                    videos.append(video_data)
-                    
-                    if len(videos) >= max_results:
-                        break
+                # Filter out low-quality videos
+                if view_count < 1000:
+                    continue
+                
+                video_data = {
+                    'title': snippet['title'],
+                    'link': f'https://www.youtube.com/watch?v={video_id}',
+                    'description': snippet['description'][:200] + '...' if len(snippet['description']) > 200 else snippet['description'],
+                    'thumbnail': snippet['thumbnails']['medium']['url'],
+                    'channelTitle': snippet['channelTitle'],
+                    'publishedAt': snippet['publishedAt'],
+                    'viewCount': view_count,
+                    'type': 'youtube'
+                }
+                videos.append(video_data)
+                
+                if len(videos) >= max_results:
+                    break
                         
             except Exception as e:
                 print(f"Error processing video: {e}")
                 continue
         
         print(f"✅ Found {len(videos)} YouTube videos for '{topic}'")
+        youtube_search_cache.set(cache_key, videos[:max_results])
         return videos[:max_results]
         
     except HttpError as e:
         print(f"❌ YouTube API HTTP Error: {e}")
-        return []
+        record_youtube_usage(error=True)
+        raise
     except Exception as e:
         print(f"❌ YouTube search error: {e}")
-        return []
+        record_youtube_usage(error=True)
+        raise
 
 def search_online_resources_with_ai(topics, max_results=3):
-    """Generate AI-curated online resource recommendations"""
+    """Generate AI-curated online resource recommendations (Gemini errors are raised)"""
     if not gemini_model:
         return []
         
@@ -197,7 +295,7 @@ Format as JSON array:
 Respond ONLY with the JSON array.
 """
         
-        response = gemini_model.generate_content(prompt)
+        response = gemini_model.generate_content(prompt, request_options={'timeout': RECOMMENDATION_TIMEOUT})
         response_text = response.text.strip().replace('```json', '').replace('```', '').strip()
         resources = json.loads(response_text)
         
@@ -211,10 +309,92 @@ Respond ONLY with the JSON array.
         
     except Exception as e:
         print(f"❌ Error generating online resources: {e}")
-        return []
+        raise
+
+# Recommendation lookups are I/O-bound, so they share one bounded thread pool
+RECOMMENDATION_WORKERS = int(os.getenv('RECOMMENDATION_WORKERS', '8'))
+RECOMMENDATION_TIMEOUT = float(os.getenv('RECOMMENDATION_TIMEOUT', '20'))
+recommendation_executor = ThreadPoolExecutor(
+    max_workers=RECOMMENDATION_WORKERS,
+    thread_name_prefix='recommendations'
+)
+
+def find_rag_study_materials(weak_topics):
+    """Find the best matching study material for each weak topic using RAG"""
+    study_materials = []
+    try:
+        for rag_results in rag_system.search_many(weak_topics, top_k=1, min_similarity=0.3):
+            if rag_results:
+                material = {
+                    "title": rag_results[0]['metadata']['docName'],
+                    "description": f"Relevant content: \"{rag_results[0]['content'][:100]}...\"",
+                    "id": rag_results[0]['metadata']['docId'],
+                    "type": "studyMaterial"
+                }
+                if not any(m['id'] == material['id'] for m in study_materials):
+                    study_materials.append(material)
+    except Exception as e:
+        print(f"Error searching RAG: {e}")
+    return study_materials
+
+def find_related_material(questions):
+    """Top study-material snippets for each question, from one batched RAG search"""
+    results = rag_system.search_many(
+        [question.get('question', '') for question in questions], top_k=2, min_similarity=0.4
+    )
+    return [
+        [
+            {'docId': r['metadata']['docId'], 'docName': r['metadata']['docName'], 'content': r['content'][:200]}
+            for r in rag_results
+        ]
+        for rag_results in results
+    ]
+
+def get_related_material(quiz_id, questions):
+    """
+    Related-material snippets of a quiz's questions: stored ones while the
+    RAG index is unchanged, otherwise recomputed and stored again
+
+    Returns:
+        Snippets by question index (questions without matches are omitted)
+    """
+    index_version = rag_system.index_version
+    stored = data_access.get_quiz_related_material(quiz_id)
+    if stored and stored[0] == index_version:
+        return stored[1]
+    
+    snippets = find_related_material(questions)
+    data_access.save_quiz_related_material(quiz_id, index_version, snippets)
+    return {i: question_snippets for i, question_snippets in enumerate(snippets) if question_snippets}
 
-def generate_resource_recommendations(weak_topics):
-    """Generate comprehensive resource recommendations with real YouTube videos"""
+def wait_for_result(future, deadline, label, default, failures=None):
+    """Result of a recommendation lookup, or `default` if it failed or missed the deadline (its label is then added to `failures`)"""
+    try:
+        return future.result(timeout=max(0, deadline - time.monotonic()))
+    except FutureTimeoutError:
+        # A lookup still queued behind busy workers is dropped; a running one
+        # is bounded by its own request timeout
+        future.cancel()
+        print(f"⚠️  {label} timed out after {RECOMMENDATION_TIMEOUT}s - continuing without it")
+    except Exception as e:
+        print(f"⚠️  {label} failed: {e}")
+    if failures is not None:
+        failures.append(label)
+    return default
+
+def generate_resource_recommendations(weak_topics, raise_on_failure=False):
+    """
+    Generate comprehensive resource recommendations with real YouTube videos
+
+    Args:
+        weak_topics: Topics to find resources for
+        raise_on_failure: Raise instead of returning partial results when
+            every external lookup (YouTube, Gemini) failed, so a queued job
+            is retried rather than stored empty
+
+    Returns:
+        Dict of onlineResources, youtubeVideos and studyMaterials
+    """
     if not weak_topics:
         return {
             'onlineResources': [],
@@ -224,43 +404,50 @@ def generate_resource_recommendations(weak_topics):
 
     print(f"🔍 Generating recommendations for topics: {weak_topics[:3]}")
 
+    # The RAG search, YouTube searches and Gemini prompt are independent,
+    # so they run concurrently and share one deadline
+    deadline = time.monotonic() + RECOMMENDATION_TIMEOUT
+
     # 1. Find relevant study materials using RAG
-    study_materials = []
-    for topic in weak_topics:
-        try:
-            rag_results = rag_system.search(topic, top_k=1, min_similarity=0.3)
-            if rag_results:
-                material = {
-                    "title": rag_results[0]['metadata']['docName'],
-                    "description": f"Relevant content: \"{rag_results[0]['content'][:100]}...\"",
-                    "id": rag_results[0]['metadata']['docId'],
-                    "type": "studyMaterial"
-                }
-                if not any(m['id'] == material['id'] for m in study_materials):
-                    study_materials.append(material)
-        except Exception as e:
-            print(f"Error searching RAG: {e}")
+    materials_future = recommendation_executor.submit(find_rag_study_materials, weak_topics)
 
-    # 2. Get REAL YouTube videos using YouTube Data API
-    youtube_videos = []
+    # 2. Get REAL YouTube videos using YouTube Data API (top 2 topics)
+    video_futures = []
     if youtube_service:
-        for topic in weak_topics[:2]:  # Search for top 2 topics
-            videos = search_youtube_videos(topic, max_results=2)
-            youtube_videos.extend(videos)
-        
-        # Remove duplicates
-        seen_links = set()
-        unique_videos = []
-        for video in youtube_videos:
-            if video['link'] not in seen_links:
-                seen_links.add(video['link'])
-                unique_videos.append(video)
-        youtube_videos = unique_videos[:3]  # Limit to 3 videos
+        video_futures = [
+            (topic, recommendation_executor.submit(search_youtube_videos, topic, 2))
+            for topic in weak_topics[:2]
+        ]
     else:
         print("⚠️  YouTube API not available - skipping video recommendations")
-    
+
     # 3. Get AI-curated online resources
-    online_resources = search_online_resources_with_ai(weak_topics, max_results=3)
+    online_future = recommendation_executor.submit(search_online_resources_with_ai, weak_topics, 3)
+
+    study_materials = wait_for_result(materials_future, deadline, 'RAG material search', [])
+
+    external_failures = []
+    youtube_videos = []
+    for topic, future in video_futures:
+        youtube_videos.extend(
+            wait_for_result(future, deadline, f"YouTube search for '{topic}'", [], external_failures)
+        )
+
+    # Remove duplicates
+    seen_links = set()
+    unique_videos = []
+    for video in youtube_videos:
+        if video['link'] not in seen_links:
+            seen_links.add(video['link'])
+            unique_videos.append(video)
+    youtube_videos = unique_videos[:3]  # Limit to 3 videos
+
+    online_resources = wait_for_result(online_future, deadline, 'Online resource generation', [], external_failures)
+
+    # Without Gemini the online lookup returns nothing rather than failing
+    external_lookups = len(video_futures) + (1 if gemini_model else 0)
+    if raise_on_failure and external_lookups and len(external_failures) == external_lookups:
+        raise RuntimeError(f"All recommendation sources failed: {', '.join(external_failures)}")
 
     result = {
         'onlineResources': online_resources[:3],
@@ -272,11 +459,66 @@ def generate_resource_recommendations(weak_topics):
     
     return result
 
-def generate_benchmark_times(questions, toughness, grade):
-    """Generate AI-powered benchmark times for each question"""
+# In 'deferred' mode submit_quiz returns the score at once and recommendations
+# are generated by recommendation_queue, tracked by the attempt's recommendationsStatus
+RECOMMENDATIONS_MODE = os.getenv('RECOMMENDATIONS_MODE', 'sync')
+
+def generate_recommendations_batch(jobs):
+    """Recommendation queue handler: generate and store recommendations for each saved attempt"""
+    results = []
+    for job in jobs:
+        try:
+            recommendations = generate_resource_recommendations(job['weakTopics'], raise_on_failure=True)
+            total_resources = data_access.save_attempt_recommendations(job['attemptId'], job, recommendations)
+            print(f"✅ Recommendations ready for attempt {job['attemptId']}")
+            results.append({'totalResources': total_resources})
+        except Exception as e:
+            print(f"⚠️  Error generating recommendations for attempt {job.get('attemptId')}: {e}")
+            results.append(e)
+    return results
+
+# Queued recommendation jobs are kept in SQLite so they survive a restart.
+# The file belongs under DATA_DIR, a persistent volume, not on the
+# container disk (wiped on every Cloud Run restart)
+DATA_DIR = os.getenv('DATA_DIR')
+RECOMMENDATION_QUEUE_PATH = os.getenv('RECOMMENDATION_QUEUE_PATH') or (
+    os.path.join(DATA_DIR, 'recommendation_queue.db') if DATA_DIR else None
+)
+if RECOMMENDATION_QUEUE_PATH:
+    os.makedirs(os.path.dirname(os.path.abspath(RECOMMENDATION_QUEUE_PATH)), exist_ok=True)
+elif RECOMMENDATIONS_MODE == 'deferred':
+    raise RuntimeError(
+        "RECOMMENDATIONS_MODE=deferred needs a persistent queue: set DATA_DIR "
+        "(or RECOMMENDATION_QUEUE_PATH) to a path on a mounted volume"
+    )
+else:
+    print("⚠️  DATA_DIR is not set; deferred recommendation jobs are kept in memory and lost on restart")
+
+def mark_recommendations_failed(job, error):
+    """Recommendation queue callback for a job that used up its retries"""
+    data_access.set_recommendations_status(job['attemptId'], 'failed')
+
+recommendation_queue = JobQueue(
+    'recommendations',
+    generate_recommendations_batch,
+    workers=int(os.getenv('RECOMMENDATION_QUEUE_WORKERS', '2')),
+    db_path=RECOMMENDATION_QUEUE_PATH,
+    max_attempts=int(os.getenv('RECOMMENDATION_MAX_ATTEMPTS', '3')),
+    retry_delay=float(os.getenv('RECOMMENDATION_RETRY_DELAY', '10')),
+    on_failed=mark_recommendations_failed,
+    # Recovered jobs search the RAG index, so they wait until it is loaded
+    start=False
+)
+
+def default_benchmark_times(questions, toughness):
+    """Fixed per-question benchmark times for a difficulty level"""
+    base_time = {'Easy': 30, 'Medium': 45, 'Hard': 60}.get(toughness, 45)
+    return [base_time] * len(questions)
+
+def generate_benchmark_times(questions, toughness, grade, fallback=True):
+    """Generate AI-powered benchmark times for each question (None on failure if fallback is False)"""
     if not gemini_model:
-        base_time = {'Easy': 30, 'Medium': 45, 'Hard': 60}.get(toughness, 45)
-        return [base_time] * len(questions)
+        return default_benchmark_times(questions, toughness) if fallback else None
         
     try:
         question_summaries = []
@@ -295,7 +537,7 @@ Format as JSON array of numbers: [30, 45, 60, ...]
 Respond ONLY with the JSON array of {len(questions)} numbers.
 """
         
-        response = gemini_model.generate_content(prompt)
+        response = gemini_model.generate_content(prompt, request_options={'timeout': GEMINI_TIMEOUT})
         response_text = response.text.strip().replace('```json', '').replace('```', '').strip()
         
         benchmark_times = json.loads(response_text)
@@ -308,8 +550,46 @@ Respond ONLY with the JSON array of {len(questions)} numbers.
         
     except Exception as e:
         print(f"Error generating benchmark times: {e}")
-        base_time = {'Easy': 30, 'Medium': 45, 'Hard': 60}.get(toughness, 45)
-        return [base_time] * len(questions)
+        return default_benchmark_times(questions, toughness) if fallback else None
+
+# Benchmark times never change once stored on a quiz, so they are memoized per quiz id
+benchmark_times_memo = TTLCache(
+    'benchmark-times',
+    max_entries=int(os.getenv('BENCHMARK_MEMO_SIZE', '2048')),
+    ttl=float(os.getenv('BENCHMARK_MEMO_TTL', str(24 * 3600)))
+)
+
+def get_benchmark_times(quiz_id, quiz_data):
+    """
+    Get a quiz's benchmark times: memoized, else stored on the quiz, else
+    generated once and stored (fixed defaults are used but not stored if
+    generation fails)
+
+    Args:
+        quiz_id: Quiz id
+        quiz_data: Quiz record including 'questions'
+
+    Returns:
+        Benchmark time in seconds for each question
+    """
+    questions = quiz_data.get('questions', [])
+    benchmark_times = benchmark_times_memo.get(quiz_id)
+    if benchmark_times and len(benchmark_times) == len(questions):
+        return benchmark_times
+    benchmark_times = quiz_data.get('benchmarkTimes')
+    if benchmark_times and len(benchmark_times) == len(questions):
+        benchmark_times_memo.set(quiz_id, benchmark_times)
+        return benchmark_times
+
+    toughness = quiz_data.get('toughness', 'Medium')
+    benchmark_times = generate_benchmark_times(
+        questions, toughness, quiz_data.get('targetGrade', 'Grade 10'), fallback=False
+    )
+    if not benchmark_times:
+        return default_benchmark_times(questions, toughness)
+    data_access.set_quiz_benchmark_times(quiz_id, benchmark_times)
+    benchmark_times_memo.set(quiz_id, benchmark_times)
+    return benchmark_times
 
 def generate_rag_recommendations(weak_topics, weak_areas, grade):
     """Generate personalized recommendations using RAG and AI"""
@@ -325,8 +605,7 @@ def generate_rag_recommendations(weak_topics, weak_areas, grade):
             return ["Great job! Keep practicing to maintain your performance."]
 
         relevant_materials = []
-        for topic in weak_topics[:3]:
-            results = rag_system.search(topic, top_k=2, min_similarity=0.3)
+        for results in rag_system.search_many(weak_topics[:3], top_k=2, min_similarity=0.3):
             for result in results:
                 if result['metadata']['docName'] not in relevant_materials:
                     relevant_materials.append(result['metadata']['docName'])
@@ -356,7 +635,7 @@ Format as JSON array: ["recommendation 1", "recommendation 2", ...]
 Respond ONLY with the JSON array.
 """
         
-        response = gemini_model.generate_content(prompt)
+        response = gemini_model.generate_content(prompt, request_options={'timeout': GEMINI_TIMEOUT})
         response_text = response.text.strip().replace('```json', '').replace('```', '').strip()
 
         recommendations = json.loads(response_text)
@@ -371,7 +650,7 @@ Respond ONLY with the JSON array.
         ]
 
 def calculate_improvement_trend(attempts):
-    """Calculate if student is improving over time"""
+    """Calculate if student is improving over time (fed the recent attempts kept in student_stats)"""
     if len(attempts) < 2:
         return "insufficient_data"
     
@@ -388,18 +667,10 @@ def calculate_improvement_trend(attempts):
     else:
         return "stable"
 
-def calculate_performance_by_difficulty(attempts):
-    """Calculate average performance grouped by difficulty"""
-    difficulty_stats = defaultdict(lambda: {'total': 0, 'correct': 0, 'count': 0})
-    
-    for attempt in attempts:
-        difficulty = attempt.get('toughness', 'Medium')
-        difficulty_stats[difficulty]['total'] += attempt['totalQuestions']
-        difficulty_stats[difficulty]['correct'] += attempt['score']
-        difficulty_stats[difficulty]['count'] += 1
-    
+def calculate_performance_by_difficulty(student_stats):
+    """Calculate average performance grouped by difficulty from the student_stats buckets"""
     result = {}
-    for difficulty, stats in difficulty_stats.items():
+    for difficulty, stats in (student_stats.get('byDifficulty') or {}).items():
         if stats['total'] > 0:
             result[difficulty] = {
                 'averageScore': round((stats['correct'] / stats['total']) * 100, 2),
@@ -408,62 +679,196 @@ def calculate_performance_by_difficulty(attempts):
     
     return result
 
-def calculate_time_stats(attempts):
-    """Calculate time-related statistics"""
-    times = [a.get('timeTaken', 0) for a in attempts if a.get('timeTaken')]
+def calculate_time_stats(student_stats):
+    """Calculate time-related statistics from the student_stats running totals"""
+    time_count = student_stats.get('timeCount', 0)
     
-    if not times:
+    if not time_count:
         return {'averageTime': 0, 'fastestTime': 0, 'slowestTime': 0}
     
     return {
-        'averageTime': round(sum(times) / len(times), 2),
-        'fastestTime': min(times),
-        'slowestTime': max(times)
+        'averageTime': round(student_stats['timeSum'] / time_count, 2),
+        'fastestTime': student_stats['minTime'],
+        'slowestTime': student_stats['maxTime']
     }
 
 # ============ Initialize RAG ============
 
+RAG_SNAPSHOT_DIR = os.getenv('RAG_SNAPSHOT_DIR', 'rag_snapshot')
+# Seconds between snapshot saves while the index keeps changing (0 disables them)
+RAG_SNAPSHOT_INTERVAL = float(os.getenv('RAG_SNAPSHOT_INTERVAL', '600'))
+INITIAL_INDEX_BATCH_SIZE = int(os.getenv('INITIAL_INDEX_BATCH_SIZE', '32'))
+
 def initialize_rag_with_materials():
     """Load existing materials into RAG system on startup"""
     try:
         print("🔄 Loading existing materials into RAG...")
+        rag_system.load_snapshot(RAG_SNAPSHOT_DIR)
+        indexed_ids = rag_system.document_ids()
+        # Materials that yielded no text are recorded too, so they are not
+        # extracted again on every restart
+        known_ids = indexed_ids | rag_system.skipped_ids()
+
+        # Only list the material keys; full records are fetched just for
+        # materials the snapshot does not cover yet
         materials_ref = db.reference('study_materials')
-        materials_data = materials_ref.get()
-        
-        if materials_data:
-            count = 0
-            for material_id, material in materials_data.items():
+        material_ids = set((materials_ref.get(shallow=True) or {}).keys())
+
+        count = 0
+        missing_ids = sorted(material_ids - known_ids)
+        for start in range(0, len(missing_ids), INITIAL_INDEX_BATCH_SIZE):
+            names = {}
+            files = []
+            for material_id in missing_ids[start:start + INITIAL_INDEX_BATCH_SIZE]:
                 try:
-                    file_content = base64.b64decode(material.get('fileContent', ''))
+                    material = db.reference(f'study_materials/{material_id}').get()
+                    if not material:
+                        continue
                     file_name = material.get('fileName', '')
-                    file_ext = file_name.rsplit('.', 1)[1].lower() if '.' in file_name else ''
-                    
-                    text = ""
-                    if file_ext == 'pdf':
-                                            text = ""
-                    if file_ext == 'pdf':
-                        text = extract_text_from_pdf(file_content)
-                    elif file_ext in ['docx', 'doc']:
-                        text = extract_text_from_docx(file_content)
-                    
-                    if text and len(text.strip()) > 50:
-                        rag_system.add_document(
-                            doc_id=material_id,
-                            doc_name=material.get('name', file_name),
-                            text=text
-                        )
-                        count += 1
+                    names[material_id] = material.get('name', file_name)
+                    files.append((material_id, file_name, read_material_source(material_id, material)))
                 except Exception as e:
                     print(f"⚠️  Error loading material {material_id}: {e}")
-            
-            print(f"✅ Loaded {count} materials into RAG system")
-            stats = rag_system.get_stats()
-            print(f"📊 RAG Stats: {stats['totalChunks']} chunks from {stats['uniqueDocuments']} documents")
+
+            # Extract the whole batch in parallel, then embed it in one pass
+            texts = extraction_engine.extract_many(files)
+            documents = []
+            for material_id, text in texts.items():
+                if text and len(text.strip()) > 50:
+                    documents.append((material_id, names[material_id], text))
+                elif text is not None:
+                    rag_system.mark_skipped(material_id)
+            try:
+                rag_system.add_documents(documents)
+                count += len(documents)
+            except Exception as e:
+                print(f"⚠️  Error indexing materials: {e}")
+
+        # Drop materials deleted since the snapshot was written
+        stale_ids = known_ids - material_ids
+        for material_id in stale_ids:
+            rag_system.remove_document(material_id)
+
+        print(f"✅ Loaded {count} new materials into RAG system ({len(indexed_ids & material_ids)} from snapshot)")
+        stats = rag_system.get_stats()
+        print(f"📊 RAG Stats: {stats['totalChunks']} chunks from {stats['uniqueDocuments']} documents")
+
+        save_rag_snapshot()
     except Exception as e:
         print(f"❌ Error initializing RAG: {e}")
 
+def save_rag_snapshot():
+    """Save the RAG snapshot if the index changed since the last one"""
+    try:
+        rag_system.save_snapshot_if_changed(RAG_SNAPSHOT_DIR)
+    except Exception as e:
+        print(f"⚠️  Could not save RAG snapshot: {e}")
+
+def run_rag_snapshots():
+    """Snapshot thread: uploads and deletes reach the snapshot without waiting for a restart"""
+    while True:
+        time.sleep(RAG_SNAPSHOT_INTERVAL)
+        save_rag_snapshot()
+
 # Initialize RAG on startup
 initialize_rag_with_materials()
+recommendation_queue.start()
+if RAG_SNAPSHOT_INTERVAL > 0:
+    threading.Thread(target=run_rag_snapshots, name='rag-snapshots', daemon=True).start()
+# gunicorn exits workers normally on shutdown, so the last changes are saved too
+atexit.register(save_rag_snapshot)
+
+# ============ Background Indexing ============
+
+# Uploads at least this large are indexed with the streaming pipeline
+STREAMING_INDEX_MIN_BYTES = int(os.getenv('STREAMING_INDEX_MIN_BYTES', str(5 * 1024 * 1024)))
+
+def index_material_batch(jobs):
+    """Indexing queue handler: extract text for queued uploads and embed them in one batch"""
+    documents = []
+    results = [None] * len(jobs)
+    # Files are handed to the extraction workers by path where possible
+    sources = [None] * len(jobs)
+    for i, job in enumerate(jobs):
+        try:
+            sources[i] = read_material_source(job['materialId'], job)
+        except Exception as e:
+            print(f"⚠️  Could not read file of material {job.get('materialId')}: {e}")
+            results[i] = e
+
+    # Large files are streamed page range by page range out of the
+    # extraction pool, so their full text never sits in memory and parsing
+    # stays off this process's GIL; the rest are extracted together
+    small = []
+    for i, (job, source) in enumerate(zip(jobs, sources)):
+        if source is None:
+            continue
+        size = os.path.getsize(source) if isinstance(source, str) else len(source)
+        if size < STREAMING_INDEX_MIN_BYTES:
+            small.append(i)
+            continue
+        try:
+            if not data_access.material_exists(job['materialId']):
+                results[i] = {'indexed': False, 'reason': 'Material was deleted'}
+                continue
+            chunk_count = rag_system.add_document_stream(
+                job['materialId'], job['materialName'], extraction_engine.iter_text(job['fileName'], source)
+            )
+            if chunk_count and not data_access.material_exists(job['materialId']):
+                # Deleted while it was being indexed
+                rag_system.remove_document(job['materialId'])
+                results[i] = {'indexed': False, 'reason': 'Material was deleted'}
+            elif chunk_count:
+                results[i] = {'indexed': True, 'chunks': chunk_count}
+            else:
+                rag_system.mark_skipped(job['materialId'])
+                results[i] = {'indexed': False, 'reason': 'Could not extract sufficient text'}
+        except Exception as e:
+            print(f"⚠️  Error streaming material {job.get('materialId')} into RAG: {e}")
+            results[i] = e
+
+    texts = extraction_engine.extract_many([(i, jobs[i]['fileName'], sources[i]) for i in small])
+    pending = set()
+    for i in small:
+        job = jobs[i]
+        try:
+            text = texts[i]
+            if not text or len(text.strip()) <= 50:
+                if text is not None:
+                    # Extraction worked; the file just has no usable text
+                    rag_system.mark_skipped(job['materialId'])
+                results[i] = {'indexed': False, 'reason': 'Could not extract sufficient text'}
+            elif not data_access.material_exists(job['materialId']):
+                results[i] = {'indexed': False, 'reason': 'Material was deleted'}
+            else:
+                documents.append((job['materialId'], job['materialName'], text))
+                pending.add(i)
+        except Exception as e:
+            print(f"⚠️  Error preparing material {job.get('materialId')} for indexing: {e}")
+            results[i] = e
+
+    added = rag_system.add_documents(documents)
+    for i in pending:
+        material_id = jobs[i]['materialId']
+        try:
+            # If the material was deleted while it was being embedded, its
+            # RAG removal may have run before the add; undo the add here
+            if not data_access.material_exists(material_id):
+                rag_system.remove_document(material_id)
+                results[i] = {'indexed': False, 'reason': 'Material was deleted'}
+                continue
+        except Exception as e:
+            print(f"⚠️  Could not re-check material {material_id} after indexing: {e}")
+        results[i] = {'indexed': True, 'chunks': added.get(material_id, 0)}
+    return results
+
+indexing_queue = JobQueue(
+    'rag-indexing',
+    index_material_batch,
+    workers=int(os.getenv('INDEXING_WORKERS', '2')),
+    batch_size=int(os.getenv('INDEXING_BATCH_SIZE', '8')),
+    db_path=os.getenv('INDEXING_QUEUE_PATH') or None
+)
 
 # ============ Authentication Routes ============
 
@@ -551,7 +956,7 @@ def get_materials():
 
 @app.route('/api/materials/upload', methods=['POST'])
 def upload_material():
-    """Upload a new study material and add to RAG system"""
+    """Upload a new study material and queue it for RAG indexing"""
     try:
         material_name = request.form.get('materialName')
         material_type = request.form.get('materialType')
@@ -566,13 +971,7 @@ def upload_material():
             return jsonify({'success': False, 'error': 'File too large. Maximum size is 10MB'}), 400
         
         file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-        text = ""
-        if file_ext == 'pdf':
-            text = extract_text_from_pdf(file_content)
-        elif file_ext in ['docx', 'doc']:
-            text = extract_text_from_docx(file_content)
-        
-        file_base64 = base64.b64encode(file_content).decode('utf-8')
+        content_key = blob_store.put(file_content)
         
         materials_ref = db.reference('study_materials')
         new_material_ref = materials_ref.push()
@@ -580,44 +979,78 @@ def upload_material():
             'name': material_name, 
             'type': material_type, 
             'fileName': file.filename,
-            'fileContent': file_base64, 
+            'contentKey': content_key,
+            'contentHash': blob_store.content_hash(file_content),
+            'fileSize': len(file_content),
             'teacherId': teacher_id,
             'uploadDate': datetime.utcnow().isoformat()
         }
+        if not blob_store.durable:
+            # The blob would not survive a restart of this instance, so a
+            # copy is kept in the database as the primary one
+            data_access.save_material_file(new_material_ref.key, file_content)
         new_material_ref.set(material_data)
         
-        if text and len(text.strip()) > 50:
-            try:
-                rag_system.add_document(
-                    doc_id=new_material_ref.key,
-                    doc_name=material_name,
-                    text=text
-                )
-                print(f"✅ Material added to RAG: {material_name}")
-            except Exception as rag_error:
-                print(f"⚠️  RAG indexing failed: {rag_error}")
+        # Text extraction and embedding happen on the indexing queue
+        job_id = None
+        if file_ext in ['pdf', 'docx', 'doc']:
+            job_id = indexing_queue.submit({
+                'materialId': new_material_ref.key,
+                'materialName': material_name,
+                'fileName': file.filename,
+                'contentKey': content_key
+            })
+            print(f"📥 Queued RAG indexing job {job_id} for: {material_name}")
         
-        return jsonify({'success': True, 'message': 'Material uploaded successfully', 'materialId': new_material_ref.key}), 201
+        return jsonify({
+            'success': True,
+            'message': 'Material uploaded successfully',
+            'materialId': new_material_ref.key,
+            'indexingJobId': job_id
+        }), 201
     except Exception as e:
         print(f"❌ Upload error:\n{traceback.format_exc()}")
         return jsonify({'success': False, 'error': str(e)}), 400
 
+# Seconds browsers and CDNs may cache a downloaded material
+MATERIAL_DOWNLOAD_MAX_AGE = int(os.getenv('MATERIAL_DOWNLOAD_MAX_AGE', '86400'))
+
 @app.route('/api/materials/<material_id>/download', methods=['GET'])
 def download_material(material_id):
     """Download a study material"""
     try:
-        material_ref = db.reference(f'study_materials/{material_id}')
-        material_data = material_ref.get()
+        material_data = data_access.get_material(material_id)
         if not material_data:
             return jsonify({'success': False, 'error': 'Material not found'}), 404
 
-        file_content = base64.b64decode(material_data['fileContent'])
-        return send_file(
-            BytesIO(file_content),
+        content_key = material_data.get('contentKey')
+        content_hash = material_data.get('contentHash')
+        if content_key and blob_store.exists(content_key):
+            # Stream from the blob store rather than loading the file
+            source = blob_store.local_path(content_key) or blob_store.open(content_key)
+        else:
+            file_content = read_material_content(material_id, material_data)
+            content_hash = content_hash or blob_store.content_hash(file_content)
+            source = BytesIO(file_content)
+
+        # A material's content never changes, so its hash is a strong ETag;
+        # send_file answers Range, If-Range and If-None-Match (304) from it
+        response = send_file(
+            source,
             mimetype='application/octet-stream',
             as_attachment=True,
-            download_name=material_data['fileName']
+            download_name=material_data['fileName'],
+            conditional=True,
+            etag=content_hash,
+            max_age=MATERIAL_DOWNLOAD_MAX_AGE
         )
+        # Werkzeug only sends this on 206 responses; advertise it up front so
+        # interrupted downloads can be resumed
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+    except (KeyError, FileNotFoundError):
+        print(f"❌ Material file missing from blob store: {material_id}")
+        return jsonify({'success': False, 'error': 'Material file not found'}), 404
     except Exception as e:
         print(f"❌ Download error:\n{traceback.format_exc()}")
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -627,16 +1060,26 @@ def delete_material(material_id):
     """Delete a study material and remove from RAG"""
     try:
         material_ref = db.reference(f'study_materials/{material_id}')
-        if not material_ref.get():
+        material_data = material_ref.get()
+        if not material_data:
             return jsonify({'success': False, 'error': 'Material not found'}), 404
         
+        # The record goes first: the indexer re-checks it after adding a
+        # material, so an add racing with this delete is undone either there
+        # or by the RAG removal below
+        material_ref.delete()
+        data_access.delete_material_file(material_id)
+
         try:
             rag_system.remove_document(material_id)
             print(f"✅ Material removed from RAG: {material_id}")
         except Exception as rag_error:
             print(f"⚠️  RAG removal failed: {rag_error}")
-        
-        material_ref.delete()
+
+        # Identical uploads share a blob, so only drop it once nothing points at it
+        content_key = material_data.get('contentKey')
+        if content_key and not data_access.content_in_use(content_key):
+            blob_store.delete(content_key)
         return jsonify({'success': True, 'message': 'Material deleted successfully'}), 200
     except Exception as e:
         print(f"❌ Delete error:\n{traceback.format_exc()}")
@@ -662,13 +1105,9 @@ def generate_quiz():
         file_content = file.read()
         file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
 
-        text = ""
-        if file_ext == 'pdf':
-            text = extract_text_from_pdf(file_content)
-        elif file_ext in ['docx', 'doc']:
-            text = extract_text_from_docx(file_content)
-        else:
+        if file_ext not in ['pdf', 'docx', 'doc']:
             return jsonify({'success': False, 'error': 'Unsupported file type.'}), 400
+        text = extraction_engine.extract(file.filename, file_content)
 
         if not text or len(text.strip()) < 50:
             return jsonify({'success': False, 'error': 'Could not extract sufficient text.'}), 400
@@ -717,7 +1156,7 @@ Format the response as a valid JSON array with this EXACT structure:
 Respond ONLY with the JSON array, no additional text or markdown.
 """
         
-        response = gemini_model.generate_content(prompt)
+        response = gemini_model.generate_content(prompt, request_options={'timeout': GEMINI_TIMEOUT})
         response_text = response.text.strip().replace('```json', '').replace('```', '').strip()
 
         try:
@@ -728,8 +1167,6 @@ Respond ONLY with the JSON array, no additional text or markdown.
             print(f"❌ JSON parsing error. Response: {response_text[:500]}")
             return jsonify({'success': False, 'error': 'Failed to parse AI response'}), 500
 
-        quizzes_ref = db.reference('quizzes')
-        new_quiz_ref = quizzes_ref.push()
         quiz_data = {
             'title': f"Quiz: {file.filename.rsplit('.', 1)[0]}",
             'toughness': toughness,
@@ -739,10 +1176,18 @@ Respond ONLY with the JSON array, no additional text or markdown.
             'numQuestions': len(questions),
             'createdAt': datetime.utcnow().isoformat()
         }
-        new_quiz_ref.set(quiz_data)
+        quiz_id = data_access.save_quiz(quiz_data)
+        data_access.adjust_teacher_quiz_count(teacher_id, 1)
         
-        print(f"✅ Quiz generated with RAG enhancement: {new_quiz_ref.key}")
-        return jsonify({'success': True, 'message': 'Quiz generated successfully', 'quizId': new_quiz_ref.key}), 201
+        # Precompute related material so submissions only look it up
+        try:
+            index_version = rag_system.index_version
+            data_access.save_quiz_related_material(quiz_id, index_version, find_related_material(questions))
+        except Exception as rag_error:
+            print(f"⚠️  Related material precompute failed (computed on first submission): {rag_error}")
+        
+        print(f"✅ Quiz generated with RAG enhancement: {quiz_id}")
+        return jsonify({'success': True, 'message': 'Quiz generated successfully', 'quizId': quiz_id}), 201
 
     except Exception as e:
         print(f"❌ Quiz generation error:\n{traceback.format_exc()}")
@@ -758,15 +1203,10 @@ def get_quizzes():
         if not teacher_id:
             return jsonify({'success': False, 'error': 'Teacher ID required'}), 400
 
-        quizzes_ref = db.reference('quizzes')
-        all_quizzes = quizzes_ref.get() or {}
-        
         quizzes = []
-        for quiz_id, quiz_data in all_quizzes.items():
-            if quiz_data.get('teacherId') == teacher_id:
-                quiz_data['id'] = quiz_id
-                quiz_data.pop('questions', None)
-                quizzes.append(quiz_data)
+        for quiz_id, quiz_data in data_access.get_teacher_quizzes(teacher_id).items():
+            quiz_data['id'] = quiz_id
+            quizzes.append(quiz_data)
         
         quizzes.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
         return jsonify({'success': True, 'quizzes': quizzes}), 200
@@ -778,8 +1218,7 @@ def get_quizzes():
 def get_quiz(quiz_id):
     """Get a specific quiz with all questions"""
     try:
-        quiz_ref = db.reference(f'quizzes/{quiz_id}')
-        quiz_data = quiz_ref.get()
+        quiz_data = data_access.get_quiz(quiz_id)
         if not quiz_data:
             return jsonify({'success': False, 'error': 'Quiz not found'}), 404
         quiz_data['id'] = quiz_id
@@ -792,10 +1231,11 @@ def get_quiz(quiz_id):
 def delete_quiz(quiz_id):
     """Delete a quiz"""
     try:
-        quiz_ref = db.reference(f'quizzes/{quiz_id}')
-        if not quiz_ref.get():
+        quiz_data = data_access.get_quiz(quiz_id, with_questions=False)
+        if not quiz_data:
             return jsonify({'success': False, 'error': 'Quiz not found'}), 404
-        quiz_ref.delete()
+        data_access.delete_quiz(quiz_id)
+        data_access.remove_quiz_from_rollup(quiz_data.get('teacherId'), quiz_id)
         return jsonify({'success': True, 'message': 'Quiz deleted successfully'}), 200
     except Exception as e:
         print(f"❌ Delete quiz error:\n{traceback.format_exc()}")
@@ -816,18 +1256,10 @@ def get_quizzes_for_student(student_id):
         if not student_grade:
             return jsonify({'success': False, 'error': 'Student grade not found'}), 400
 
-        quizzes_ref = db.reference('quizzes')
-        all_quizzes = quizzes_ref.get() or {}
-
         quizzes = []
-        for quiz_id, quiz_data in all_quizzes.items():
-            student_grade_num_str = ''.join(filter(str.isdigit, str(student_grade)))
-            quiz_target_grade_str = ''.join(filter(str.isdigit, str(quiz_data.get('targetGrade'))))
-
-            if student_grade_num_str and quiz_target_grade_str and student_grade_num_str == quiz_target_grade_str:
-                quiz_data['id'] = quiz_id
-                quiz_data.pop('questions', None)
-                quizzes.append(quiz_data)
+        for quiz_id, quiz_data in data_access.get_grade_quizzes(student_grade).items():
+            quiz_data['id'] = quiz_id
+            quizzes.append(quiz_data)
         
         quizzes.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
         return jsonify({'success': True, 'quizzes': quizzes}), 200
@@ -848,8 +1280,7 @@ def submit_quiz():
         if not all([student_id, quiz_id]):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
 
-        quiz_ref = db.reference(f'quizzes/{quiz_id}')
-        quiz_data = quiz_ref.get()
+        quiz_data = data_access.get_quiz(quiz_id)
         if not quiz_data:
             return jsonify({'success': False, 'error': 'Quiz not found'}), 404
 
@@ -861,6 +1292,18 @@ def submit_quiz():
         detailed_results = []
         weak_topics = []
         
+        # Related material is precomputed per question; wrong answers only look it up
+        related_material = {}
+        has_wrong_answers = any(
+            user_answer != question['correctAnswer'] and user_answer != -1
+            for question, user_answer in zip(questions, answers)
+        )
+        if has_wrong_answers:
+            try:
+                related_material = get_related_material(quiz_id, questions)
+            except Exception as rag_error:
+                print(f"RAG enhancement error: {rag_error}")
+        
         for i, (question, user_answer) in enumerate(zip(questions, answers)):
             is_correct = user_answer == question['correctAnswer']
             if is_correct:
@@ -869,15 +1312,11 @@ def submit_quiz():
                 weak_topics.append(question['question'])
             
             enhanced_explanation = question.get('explanation', '')
-            if not is_correct and user_answer != -1:
-                try:
-                    rag_results = rag_system.search(question['question'], top_k=2, min_similarity=0.4)
-                    if rag_results:
-                        enhanced_explanation += "\n\n📚 Related study material:\n"
-                        for result in rag_results[:1]:
-                            enhanced_explanation += f"From '{result['metadata']['docName']}': {result['content'][:200]}..."
-                except Exception as rag_error:
-                    print(f"RAG enhancement error: {rag_error}")
+            snippets = related_material.get(i) if not is_correct and user_answer != -1 else None
+            if snippets:
+                enhanced_explanation += "\n\n📚 Related study material:\n"
+                for snippet in snippets[:1]:
+                    enhanced_explanation += f"From '{snippet['docName']}': {snippet['content']}..."
             
             detailed_results.append({
                 'questionIndex': i,
@@ -889,8 +1328,6 @@ def submit_quiz():
                 'explanation': enhanced_explanation
             })
 
-        attempts_ref = db.reference('quiz_attempts')
-        new_attempt_ref = attempts_ref.push()
         attempt_data = {
             'studentId': student_id,
             'quizId': quiz_id,
@@ -906,30 +1343,57 @@ def submit_quiz():
             'timeTaken': time_taken,
             'completedAt': datetime.utcnow().isoformat(),
             'toughness': quiz_data.get('toughness'),
-            'targetGrade': quiz_data.get('targetGrade')
+            'targetGrade': quiz_data.get('targetGrade'),
+            'teacherId': quiz_data.get('teacherId')
         }
         
-        # Generate resource recommendations with REAL YouTube videos
+        # Generate resource recommendations with REAL YouTube videos,
+        # now or (in deferred mode) in the background once the attempt is saved
+        defer_recommendations = bool(data.get('deferRecommendations', RECOMMENDATIONS_MODE == 'deferred'))
         resource_recommendations = {}
-        if weak_topics:
+        recommendations_status = 'ready'
+        if weak_topics and defer_recommendations:
+            recommendations_status = 'pending'
+        elif weak_topics:
             print(f"🎬 Generating YouTube recommendations for weak topics...")
             resource_recommendations = generate_resource_recommendations(weak_topics[:3])
         
         attempt_data['resourceRecommendations'] = resource_recommendations
-        new_attempt_ref.set(attempt_data)
+        attempt_data['recommendationsStatus'] = recommendations_status
+        attempt_id = data_access.save_quiz_attempt(attempt_data)
+        if recommendations_status == 'pending':
+            recommendation_queue.submit({
+                'attemptId': attempt_id,
+                'studentId': student_id,
+                'quizId': quiz_id,
+                'teacherId': attempt_data['teacherId'],
+                'weakTopics': weak_topics[:3]
+            })
+        # Each aggregate can be rebuilt from the attempt index, so a failed
+        # update is logged and never fails the submit
+        try:
+            data_access.record_student_stats(attempt_id, attempt_data)
+        except Exception as stats_error:
+            print(f"⚠️  Student stats update failed (run `flask rebuild-student-stats`): {stats_error}")
+        try:
+            data_access.record_teacher_rollup(attempt_id, attempt_data)
+        except Exception as rollup_error:
+            print(f"⚠️  Teacher rollup update failed: {rollup_error}")
+            data_access.mark_teacher_rollup_stale(attempt_data.get('teacherId'))
 
-        print(f"✅ Quiz attempt saved: {new_attempt_ref.key} - Score: {score}/{len(questions)}")
+        print(f"✅ Quiz attempt saved: {attempt_id} - Score: {score}/{len(questions)}")
         print(f"   YouTube videos generated: {len(resource_recommendations.get('youtubeVideos', []))}")
         
         return jsonify({
             'success': True,
             'message': 'Quiz submitted successfully',
-            'attemptId': new_attempt_ref.key,
+            'attemptId': attempt_id,
             'score': score,
             'totalQuestions': len(questions),
             'percentage': attempt_data['percentage'],
             'detailedResults': detailed_results,
-            'resourceRecommendations': resource_recommendations
+            'resourceRecommendations': resource_recommendations,
+            'recommendationsStatus': recommendations_status
         }), 201
 
     except Exception as e:
@@ -940,16 +1404,11 @@ def submit_quiz():
 def get_student_quiz_attempts(student_id):
     """Get all quiz attempts for a student"""
     try:
-        attempts_ref = db.reference('quiz_attempts')
-        all_attempts = attempts_ref.get() or {}
-        
         student_attempts = []
-        for attempt_id, attempt_data in all_attempts.items():
-            if attempt_data.get('studentId') == student_id:
-                attempt_data['id'] = attempt_id
-                attempt_data['attemptId'] = attempt_id
-                attempt_data.pop('detailedResults', None)
-                student_attempts.append(attempt_data)
+        for attempt_id, attempt_data in data_access.get_student_attempts(student_id).items():
+            attempt_data['id'] = attempt_id
+            attempt_data['attemptId'] = attempt_id
+            student_attempts.append(attempt_data)
         
         student_attempts.sort(key=lambda x: x.get('completedAt', ''), reverse=True)
         return jsonify({'success': True, 'attempts': student_attempts}), 200
@@ -972,6 +1431,23 @@ def get_quiz_results(attempt_id):
         print(f"❌ Get quiz results error:\n{traceback.format_exc()}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/quiz-results/attempt/<attempt_id>/recommendations', methods=['GET'])
+def get_attempt_recommendations(attempt_id):
+    """Poll the resource recommendations of an attempt (status is 'pending' while they are generated)"""
+    try:
+        attempt_ref = db.reference(f'quiz_attempts/{attempt_id}')
+        if not attempt_ref.get(shallow=True):
+            return jsonify({'success': False, 'error': 'Attempt not found'}), 404
+        
+        return jsonify({
+            'success': True,
+            'recommendationsStatus': attempt_ref.child('recommendationsStatus').get() or 'ready',
+            'resourceRecommendations': attempt_ref.child('resourceRecommendations').get() or {}
+        }), 200
+    except Exception as e:
+        print(f"❌ Get attempt recommendations error:\n{traceback.format_exc()}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # ============ Analytics Routes ============
 
 @app.route('/api/quiz-results/attempt/<attempt_id>/detailed-analytics', methods=['GET'])
@@ -984,8 +1460,7 @@ def get_detailed_analytics(attempt_id):
             return jsonify({'success': False, 'error': 'Attempt not found'}), 404
 
         quiz_id = attempt_data.get('quizId')
-        quiz_ref = db.reference(f'quizzes/{quiz_id}')
-        quiz_data = quiz_ref.get()
+        quiz_data = data_access.get_quiz(quiz_id)
         
         if not quiz_data:
             return jsonify({'success': False, 'error': 'Quiz not found'}), 404
@@ -1006,11 +1481,7 @@ def get_detailed_analytics(attempt_id):
             else:
                 incorrect_count += 1
         
-        benchmark_times = generate_benchmark_times(
-            questions, 
-            quiz_data.get('toughness', 'Medium'),
-            quiz_data.get('targetGrade', 'Grade 10')
-        )
+        benchmark_times = get_benchmark_times(quiz_id, quiz_data)
         
         avg_time_per_question = total_time / len(questions) if len(questions) > 0 else 0
         
@@ -1075,8 +1546,8 @@ def get_attempt_analysis(attempt_id):
         all_materials = materials_ref.get() or {}
         
         topic_specific_materials = []
-        for topic in list(set(weak_topics))[:5]:
-            rag_results = rag_system.search(topic, top_k=3, min_similarity=0.25)
+        unique_topics = list(set(weak_topics))[:5]
+        for topic, rag_results in zip(unique_topics, rag_system.search_many(unique_topics, top_k=3, min_similarity=0.25)):
             
             if rag_results:
                 materials_for_topic = []
@@ -1113,8 +1584,7 @@ def get_attempt_analysis(attempt_id):
         try:
             quiz_id = attempt_data.get('quizId')
             if quiz_id:
-                quiz_ref = db.reference(f'quizzes/{quiz_id}')
-                quiz_data = quiz_ref.get()
+                quiz_data = data_access.get_quiz(quiz_id, with_questions=False)
                 if quiz_data:
                     teacher_id = quiz_data.get('teacherId')
                     if teacher_id:
@@ -1153,14 +1623,10 @@ def get_skill_gap_analysis(student_id):
         if not student_data:
             return jsonify({'success': False, 'error': 'Student not found'}), 404
 
-        attempts_ref = db.reference('quiz_attempts')
-        all_attempts = attempts_ref.get() or {}
-        
         student_attempts = []
-        for attempt_id, attempt_data in all_attempts.items():
-            if attempt_data.get('studentId') == student_id:
-                attempt_data['id'] = attempt_id
-                student_attempts.append(attempt_data)
+        for attempt_id, attempt_data in data_access.get_student_attempts(student_id).items():
+            attempt_data['id'] = attempt_id
+            student_attempts.append(attempt_data)
 
         if not student_attempts:
             return jsonify({
@@ -1174,9 +1640,10 @@ def get_skill_gap_analysis(student_id):
                 }
             }), 200
 
-        total_attempts = len(student_attempts)
-        total_score = sum(a['score'] for a in student_attempts)
-        total_questions = sum(a['totalQuestions'] for a in student_attempts)
+        student_stats = data_access.get_student_stats(student_id) or {}
+        total_attempts = student_stats.get('attemptCount', len(student_attempts))
+        total_score = student_stats.get('totalScore', 0)
+        total_questions = student_stats.get('totalQuestions', 0)
         average_score = (total_score / total_questions * 100) if total_questions > 0 else 0
 
         weak_areas = []
@@ -1222,7 +1689,7 @@ def get_skill_gap_analysis(student_id):
             'recommendations': recommendations,
             'resourceRecommendations': resource_recommendations,
             'topicErrorAnalysis': topic_error_analysis[:5],
-            'improvementTrend': calculate_improvement_trend(student_attempts)
+            'improvementTrend': calculate_improvement_trend(student_stats.get('recentAttempts') or [])
         }
 
         return jsonify({'success': True, 'analysis': analysis}), 200
@@ -1237,16 +1704,9 @@ def get_skill_gap_analysis(student_id):
 def get_performance_stats(student_id):
     """Get detailed performance statistics"""
     try:
-        attempts_ref = db.reference('quiz_attempts')
-        all_attempts = attempts_ref.get() or {}
-        
-        student_attempts = []
-        for attempt_id, attempt_data in all_attempts.items():
-            if attempt_data.get('studentId') == student_id:
-                attempt_data['id'] = attempt_id
-                student_attempts.append(attempt_data)
+        student_stats = data_access.get_student_stats(student_id)
 
-        if not student_attempts:
+        if not student_stats:
             return jsonify({
                 'success': True,
                 'stats': {
@@ -1260,20 +1720,16 @@ def get_performance_stats(student_id):
                 }
             }), 200
 
-        total_correct = sum(a['score'] for a in student_attempts)
-        total_questions = sum(a['totalQuestions'] for a in student_attempts)
-        percentages = [a['percentage'] for a in student_attempts]
-        
         stats = {
-            'totalQuizzes': len(student_attempts),
-            'totalQuestions': total_questions,
-            'correctAnswers': total_correct,
-            'averageScore': round(sum(percentages) / len(percentages), 2),
-            'highestScore': round(max(percentages), 2),
-            'lowestScore': round(min(percentages), 2),
-            'recentAttempts': sorted(student_attempts, key=lambda x: x.get('completedAt', ''), reverse=True)[:5],
-            'performanceByDifficulty': calculate_performance_by_difficulty(student_attempts),
-            'timeStats': calculate_time_stats(student_attempts)
+            'totalQuizzes': student_stats['attemptCount'],
+            'totalQuestions': student_stats['totalQuestions'],
+            'correctAnswers': student_stats['totalScore'],
+            'averageScore': round(student_stats['percentageSum'] / student_stats['attemptCount'], 2),
+            'highestScore': round(student_stats['maxPercentage'], 2),
+            'lowestScore': round(student_stats['minPercentage'], 2),
+            'recentAttempts': list(reversed(student_stats.get('recentAttempts') or []))[:5],
+            'performanceByDifficulty': calculate_performance_by_difficulty(student_stats),
+            'timeStats': calculate_time_stats(student_stats)
         }
 
         return jsonify({'success': True, 'stats': stats}), 200
@@ -1286,14 +1742,10 @@ def get_performance_stats(student_id):
 def get_recommended_materials(student_id):
     """Get recommended study materials using RAG based on weak areas"""
     try:
-        attempts_ref = db.reference('quiz_attempts')
-        all_attempts = attempts_ref.get() or {}
-        
         weak_topics = []
-        for attempt_id, attempt_data in all_attempts.items():
-            if attempt_data.get('studentId') == student_id:
-                if attempt_data.get('percentage', 100) < 70:
-                    weak_topics.extend(attempt_data.get('weakTopics', []))
+        for attempt_data in data_access.get_student_attempts(student_id).values():
+            if attempt_data.get('percentage', 100) < 70:
+                weak_topics.extend(attempt_data.get('weakTopics', []))
 
         materials_ref = db.reference('study_materials')
         all_materials = materials_ref.get() or {}
@@ -1302,8 +1754,7 @@ def get_recommended_materials(student_id):
         relevance_scores = {}
         
         if weak_topics:
-            for topic in weak_topics[:5]:
-                results = rag_system.search(topic, top_k=3, min_similarity=0.25)
+            for results in rag_system.search_many(weak_topics[:5], top_k=3, min_similarity=0.25):
                 for result in results:
                     doc_id = result['metadata']['docId']
                     similarity = result['similarity']
@@ -1343,14 +1794,10 @@ def get_recommended_materials(student_id):
 def get_topic_specific_materials(student_id):
     """Get study materials specifically matched to student's weak topics using RAG"""
     try:
-        attempts_ref = db.reference('quiz_attempts')
-        all_attempts = attempts_ref.get() or {}
-        
         weak_topics = []
-        for attempt_id, attempt_data in all_attempts.items():
-            if attempt_data.get('studentId') == student_id:
-                if attempt_data.get('percentage', 100) < 70:
-                    weak_topics.extend(attempt_data.get('weakTopics', []))
+        for attempt_data in data_access.get_student_attempts(student_id).values():
+            if attempt_data.get('percentage', 100) < 70:
+                weak_topics.extend(attempt_data.get('weakTopics', []))
         
         if not weak_topics:
             return jsonify({
@@ -1362,8 +1809,8 @@ def get_topic_specific_materials(student_id):
         unique_weak_topics = list(set(weak_topics))
         topic_materials = []
         
-        for topic in unique_weak_topics[:10]:
-            rag_results = rag_system.search(topic, top_k=3, min_similarity=0.3)
+        search_topics = unique_weak_topics[:10]
+        for topic, rag_results in zip(search_topics, rag_system.search_many(search_topics, top_k=3, min_similarity=0.3)):
             
             if rag_results:
                 materials_for_topic = []
@@ -1441,6 +1888,7 @@ def mark_resource_complete(attempt_id):
         
         progress_ref = db.reference(f'resource_progress/{attempt_id}')
         progress_data = progress_ref.get()
+        previously_completed = data_access.count_completed_resources(progress_data)
         
         if not progress_data:
             progress_data = {
@@ -1477,22 +1925,22 @@ def mark_resource_complete(attempt_id):
         attempt_data = attempt_ref.get()
         
         if attempt_data:
-            resource_recommendations = attempt_data.get('resourceRecommendations', {})
-            total_resources = (
-                len(resource_recommendations.get('onlineResources', [])) +
-                len(resource_recommendations.get('youtubeVideos', [])) +
-                (1 if resource_recommendations else 0)
-            )
+            total_resources = data_access.count_resources(attempt_data.get('resourceRecommendations'))
             
-            completed_count = (
-                len(progress_data.get('onlineResources', [])) +
-                len(progress_data.get('youtubeVideos', [])) +
-                (1 if progress_data.get('analysisViewed') else 0)
-            )
+            completed_count = data_access.count_completed_resources(progress_data)
             
             completion_percentage = round((completed_count / total_resources) * 100, 2) if total_resources > 0 else 0
             progress_data['completionPercentage'] = completion_percentage
             progress_ref.update({'completionPercentage': completion_percentage})
+            
+            if total_resources > 0:
+                teacher_id = attempt_data.get('teacherId')
+                if not teacher_id:
+                    quiz_summary = data_access.get_quiz(attempt_data.get('quizId'), with_questions=False) or {}
+                    teacher_id = quiz_summary.get('teacherId')
+                data_access.record_completed_resources(
+                    teacher_id, attempt_data.get('studentId'), completed_count - previously_completed
+                )
         
         print(f"✅ Resource marked complete: {resource_type} for attempt {attempt_id}")
         return jsonify({'success': True, 'progress': progress_data}), 200
@@ -1505,13 +1953,10 @@ def mark_resource_complete(attempt_id):
 def get_overall_progress(student_id):
     """Get overall resource completion progress for a student"""
     try:
-        attempts_ref = db.reference('quiz_attempts')
-        all_attempts = attempts_ref.get() or {}
-        
-        student_attempts = []
-        for attempt_id, attempt_data in all_attempts.items():
-            if attempt_data.get('studentId') == student_id:
-                student_attempts.append({'id': attempt_id, **attempt_data})
+        student_attempts = [
+            {'id': attempt_id, **attempt_data}
+            for attempt_id, attempt_data in data_access.get_student_attempts(student_id).items()
+        ]
         
         if not student_attempts:
             return jsonify({
@@ -1529,29 +1974,18 @@ def get_overall_progress(student_id):
         completed_resources = 0
         attempts_with_resources = 0
         
+        progress_by_attempt = data_access.get_resource_progress_many(
+            attempt['id'] for attempt in student_attempts if attempt.get('totalResources', 0) > 0
+        )
+        
         for attempt in student_attempts:
             attempt_id = attempt['id']
-            resource_recommendations = attempt.get('resourceRecommendations', {})
-            
-            attempt_total = (
-                len(resource_recommendations.get('onlineResources', [])) +
-                len(resource_recommendations.get('youtubeVideos', [])) +
-                (1 if resource_recommendations else 0)
-            )
+            attempt_total = attempt.get('totalResources', 0)
             
             if attempt_total > 0:
                 attempts_with_resources += 1
                 total_resources += attempt_total
-                
-                progress_ref = db.reference(f'resource_progress/{attempt_id}')
-                progress_data = progress_ref.get()
-                
-                if progress_data:
-                    completed_resources += (
-                        len(progress_data.get('onlineResources', [])) +
-                        len(progress_data.get('youtubeVideos', [])) +
-                        (1 if progress_data.get('analysisViewed') else 0)
-                    )
+                completed_resources += data_access.count_completed_resources(progress_by_attempt.get(attempt_id))
         
         completion_percentage = round((completed_resources / total_resources) * 100, 2) if total_resources > 0 else 0
         
@@ -1576,103 +2010,48 @@ def get_overall_progress(student_id):
 def get_students_overview(teacher_id):
     """Get overview of all students who have attempted quizzes from this teacher"""
     try:
-        # Get all quizzes by this teacher
-        quizzes_ref = db.reference('quizzes')
-        all_quizzes = quizzes_ref.get() or {}
-        
-        teacher_quiz_ids = []
-        for quiz_id, quiz_data in all_quizzes.items():
-            # FIX 1: Add a check to ensure quiz_data is a dictionary
-            if isinstance(quiz_data, dict) and quiz_data.get('teacherId') == teacher_id:
-                teacher_quiz_ids.append(quiz_id)
+        # Per-student totals are kept in the teacher's rollup
+        rollup = data_access.get_or_build_teacher_rollup(teacher_id)
         
-        if not teacher_quiz_ids:
+        if not rollup.get('quizCount'):
             return jsonify({
                 'success': True,
                 'students': [],
                 'message': 'No quizzes created yet'
             }), 200
         
-        # Get all quiz attempts for teacher's quizzes
-        attempts_ref = db.reference('quiz_attempts')
-        all_attempts = attempts_ref.get() or {}
-        
-        # Get all students
-        students_ref = db.reference('students')
-        all_students = students_ref.get() or {}
-        
-        # Organize attempts by student
-        student_attempts = defaultdict(list)
-        for attempt_id, attempt_data in all_attempts.items():
-            # FIX 2: Add a check to ensure attempt_data is a dictionary before processing
-            if isinstance(attempt_data, dict) and attempt_data.get('quizId') in teacher_quiz_ids:
-                student_id = attempt_data.get('studentId')
-                attempt_data['id'] = attempt_id
-                student_attempts[student_id].append(attempt_data)
+        student_summaries = rollup.get('students') or {}
+        all_students = data_access.get_students(student_summaries)
         
         # Calculate metrics for each student
         students_overview = []
         
-        for student_id, attempts in student_attempts.items():
+        for student_id, summary in student_summaries.items():
             student_data = all_students.get(student_id, {})
             
             if not student_data:
                 continue
-            
-            # Filter out any non-dictionary items from attempts to be safe
-            valid_attempts = [a for a in attempts if isinstance(a, dict)]
-            if not valid_attempts:
-                continue
 
             # Calculate average score
-            total_score = sum(a.get('score', 0) for a in valid_attempts)
-            total_questions = sum(a.get('totalQuestions', 0) for a in valid_attempts)
-            average_score = (total_score / total_questions * 100) if total_questions > 0 else 0
+            total_questions = summary.get('totalQuestions', 0)
+            average_score = (summary.get('totalScore', 0) / total_questions * 100) if total_questions > 0 else 0
             
             # Calculate skill gap completion
-            total_resources = 0
-            completed_resources = 0
-            
-            for attempt in valid_attempts:
-                attempt_id = attempt['id']
-                resource_recommendations = attempt.get('resourceRecommendations', {})
-                
-                attempt_total = (
-                    len(resource_recommendations.get('onlineResources', [])) +
-                    len(resource_recommendations.get('youtubeVideos', [])) +
-                    (1 if resource_recommendations else 0)
-                )
-                
-                if attempt_total > 0:
-                    total_resources += attempt_total
-                    
-                    progress_ref = db.reference(f'resource_progress/{attempt_id}')
-                    progress_data = progress_ref.get()
-                    
-                    if isinstance(progress_data, dict): # Check if progress data exists and is valid
-                        completed_resources += (
-                            len(progress_data.get('onlineResources', [])) +
-                            len(progress_data.get('youtubeVideos', [])) +
-                            (1 if progress_data.get('analysisViewed') else 0)
-                        )
-            
+            total_resources = summary.get('totalResources', 0)
+            completed_resources = summary.get('completedResources', 0)
             skill_gap_completion = (completed_resources / total_resources * 100) if total_resources > 0 else 0
             
-            # FIX 3: Correctly find the last activity by sorting attempts by date
-            sorted_attempts = sorted(valid_attempts, key=lambda x: x.get('completedAt', ''))
-            last_activity = sorted_attempts[-1].get('completedAt', '') if sorted_attempts else ''
-
             student_overview = {
                 'studentId': student_id,
                 'studentName': student_data.get('fullName', 'Unknown'),
                 'studentEmail': student_data.get('email', 'N/A'),
                 'currentGrade': student_data.get('currentGrade', 'N/A'),
-                'quizzesTaken': len(valid_attempts),
+                'quizzesTaken': summary.get('attemptCount', 0),
                 'averageScore': round(average_score, 2),
                 'skillGapCompletion': round(skill_gap_completion, 2),
                 'totalResources': total_resources,
                 'completedResources': completed_resources,
-                'lastActivity': last_activity # Use the correctly sorted last activity
+                'lastActivity': summary.get('lastActivity', '')
             }
             
             students_overview.append(student_overview)
@@ -1700,10 +2079,32 @@ def get_rag_stats():
     """Get RAG system statistics"""
     try:
         stats = rag_system.get_stats()
+        stats['indexingQueue'] = indexing_queue.get_stats()
+        stats['recommendationQueue'] = recommendation_queue.get_stats()
+        stats['classInsightsCache'] = class_insights_cache.get_stats()
         return jsonify({'success': True, 'stats': stats}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/youtube/stats', methods=['GET'])
+def get_youtube_usage_stats():
+    """Get YouTube API quota usage and search cache statistics"""
+    try:
+        return jsonify({'success': True, 'stats': get_youtube_stats()}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/rag/jobs/<job_id>', methods=['GET'])
+def get_indexing_job(job_id):
+    """Get the status of a background indexing job"""
+    try:
+        job = indexing_queue.get(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/rag/search', methods=['POST'])
 def search_rag():
     """Search RAG system directly"""
@@ -1767,28 +2168,13 @@ def home():
 def get_class_insights(teacher_id):
     """Get AI-powered insights for the entire class"""
     try:
-        # Get all quizzes by this teacher
-        quizzes_ref = db.reference('quizzes')
-        teacher_quizzes = quizzes_ref.get() or {}
-        
-        # FIX 1: Ensure we only process quizzes that are valid dictionaries
-        teacher_quiz_ids = [
-            quiz_id for quiz_id, quiz in teacher_quizzes.items() 
-            if isinstance(quiz, dict) and quiz.get('teacherId') == teacher_id
-        ]
-        
-        # Get all attempts for these quizzes
-        attempts_ref = db.reference('quiz_attempts')
-        all_attempts = attempts_ref.get() or {}
-
-        # FIX 2: Ensure we only process attempts that are valid dictionaries
-        class_attempts = [
-            attempt for attempt in all_attempts.values() 
-            if isinstance(attempt, dict) and attempt.get('quizId') in teacher_quiz_ids
-        ]
+        # Class-wide totals are kept up to date in the teacher's rollup
+        rollup = data_access.get_or_build_teacher_rollup(teacher_id)
+        totals = rollup.get('totals') or {}
+        total_quizzes_taken = totals.get('attemptCount', 0)
         
         # If no attempts, return empty
-        if not class_attempts:
+        if not total_quizzes_taken:
             return jsonify({
                 'success': True,
                 'insights': "No quiz data available to generate class insights.",
@@ -1796,70 +2182,48 @@ def get_class_insights(teacher_id):
             }), 200
         
         # Gather data for the AI
-        total_quizzes_taken = len(class_attempts)
-        total_students = len(set(attempt.get('studentId') for attempt in class_attempts))
-        average_score = sum(attempt.get('percentage', 0) for attempt in class_attempts) / total_quizzes_taken
-        average_score = round(average_score, 2)
+        total_students = len(rollup.get('students') or {})
+        average_score = round(totals.get('percentageSum', 0) / total_quizzes_taken, 2)
         
         # === Prepare Chart Data ===
         
         # 1. Score Distribution
-        score_ranges = {'0-20': 0, '21-40': 0, '41-60': 0, '61-80': 0, '81-100': 0}
-        for attempt in class_attempts:
-            score = attempt.get('percentage', 0)
-            if score <= 20: score_ranges['0-20'] += 1
-            elif score <= 40: score_ranges['21-40'] += 1
-            elif score <= 60: score_ranges['41-60'] += 1
-            elif score <= 80: score_ranges['61-80'] += 1
-            else: score_ranges['81-100'] += 1
-        
-        distribution_data = [{'range': k, 'students': v} for k, v in score_ranges.items()]
+        histogram = rollup.get('histogram') or {}
+        distribution_data = [
+            {'range': bucket, 'students': histogram.get(bucket, 0)}
+            for bucket in data_access.SCORE_BUCKETS
+        ]
         
         # 2. Topic Performance (Weak Topics)
-        weak_topics = defaultdict(int)
-        for attempt in class_attempts:
-            for topic in attempt.get('weakTopics', []):
-                weak_topics[topic] += 1
+        weak_topics = (rollup.get('weakTopics') or {}).values()
         
         topic_performance = []
-        for topic, weakness_count in sorted(weak_topics.items(), key=lambda x: x[1], reverse=True)[:5]:
+        for counter in sorted(weak_topics, key=lambda x: x.get('count', 0), reverse=True)[:5]:
+            weakness_count = counter.get('count', 0)
             score = max(0, 100 - (weakness_count / total_quizzes_taken * 100))
             topic_performance.append({
-                'topic': topic,
+                'topic': counter.get('topic'),
                 'score': round(score, 1),
                 'weaknessCount': weakness_count
             })
         
         common_weak_topics = [topic['topic'] for topic in topic_performance]
         
-        # 3. Performance Trends (Group by date)
-        attempts_by_date = defaultdict(list)
-        for attempt in class_attempts:
-            # FIX 3: Safely get the timestamp and parse it
-            completed_at_str = attempt.get('completedAt')
-            if completed_at_str:
-                try:
-                    # Assuming ISO format like '2025-10-16T10:05:30.123Z'
-                    date_obj = datetime.fromisoformat(completed_at_str.replace('Z', '+00:00'))
-                    date_str = date_obj.strftime('%Y-%m-%d')
-                    attempts_by_date[date_str].append(attempt.get('percentage', 0))
-                except (ValueError, TypeError):
-                    # Skip if the date format is wrong
-                    continue
-        
+        # 3. Performance Trends (per-day totals)
+        days = rollup.get('days') or {}
         trend_data = []
-        for date in sorted(attempts_by_date.keys())[-10:]:
-            scores = attempts_by_date[date]
-            avg_score = sum(scores) / len(scores) if scores else 0
+        for date in sorted(days.keys())[-10:]:
+            totals = days[date]
+            avg_score = totals['sum'] / totals['count'] if totals.get('count') else 0
             trend_data.append({
                 'date': datetime.strptime(date, '%Y-%m-%d').strftime('%b %d'),
                 'avgScore': round(avg_score, 1),
-                'attempts': len(scores)
+                'attempts': totals.get('count', 0)
             })
         
         # 4. Completion Statistics
         completion_stats = {
-            'totalQuizzes': len(teacher_quiz_ids),
+            'totalQuizzes': rollup.get('quizCount', 0),
             'totalAttempts': total_quizzes_taken,
             'activeStudents': total_students,
             'classAverage': round(average_score, 1)
@@ -1872,6 +2236,22 @@ def get_class_insights(teacher_id):
             'completionStats': completion_stats
         }
         
+        # The narrative only depends on the figures in the prompt
+        fingerprint = hashlib.sha1(json.dumps(
+            [total_students, total_quizzes_taken, average_score, common_weak_topics]
+        ).encode('utf-8')).hexdigest()
+        cache_key = f"{teacher_id}:{fingerprint}"
+        refresh = request.args.get('refresh', '').lower() == 'true'
+        
+        insights = None if refresh else class_insights_cache.get(cache_key)
+        if insights is not None:
+            return jsonify({
+                'success': True,
+                'insights': insights,
+                'chartData': chart_data,
+                'cached': True
+            }), 200
+        
         context = f"""
         Teacher Class Performance Analysis Report:
         - Total Students with attempts: {total_students}
@@ -1899,13 +2279,15 @@ def get_class_insights(teacher_id):
         - Provide 3-4 specific, practical recommendations for the teacher.
         """
         
-        response = gemini_model.generate_content(prompt)
+        response = gemini_model.generate_content(prompt, request_options={'timeout': GEMINI_TIMEOUT})
         insights = response.text
+        class_insights_cache.set(cache_key, insights)
         
         return jsonify({
             'success': True,
             'insights': insights,
-            'chartData': chart_data
+            'chartData': chart_data,
+            'cached': False
         }), 200
         
     except Exception as e:
@@ -1915,6 +2297,61 @@ def get_class_insights(teacher_id):
             'error': str(e)
         }), 500
         
+# ============ Maintenance Commands ============
+
+@app.cli.command('backfill-attempt-indexes')
+def backfill_attempt_indexes_command():
+    """Build attempts_by_student / attempts_by_quiz for existing attempts"""
+    print("🔄 Backfilling quiz attempt indexes...")
+    count = data_access.backfill_attempt_indexes()
+    print(f"✅ Indexed {count} quiz attempts")
+
+@app.cli.command('migrate-quiz-storage')
+def migrate_quiz_storage_command():
+    """Add gradeKey to existing quizzes and move their questions to quiz_questions"""
+    print("🔄 Migrating quiz storage...")
+    count = data_access.migrate_quiz_storage()
+    print(f"✅ Migrated {count} quizzes")
+
+@app.cli.command('rebuild-student-stats')
+def rebuild_student_stats_command():
+    """Recompute student_stats for every student from attempts_by_student"""
+    print("🔄 Rebuilding student stats...")
+    count = data_access.rebuild_student_stats()
+    print(f"✅ Rebuilt stats for {count} students")
+
+@app.cli.command('migrate-material-blobs')
+def migrate_material_blobs_command():
+    """Copy inline fileContent of existing materials into the blob store (kept in material_files unless the store is durable)"""
+    print("🔄 Migrating study material files to the blob store...")
+    count = data_access.migrate_material_blobs(blob_store)
+    print(f"✅ Migrated {count} materials to the blob store")
+
+@app.cli.command('rebuild-teacher-rollups')
+def rebuild_teacher_rollups_command():
+    """Recompute teacher_rollups for every teacher from their quizzes and attempts"""
+    print("🔄 Rebuilding teacher rollups...")
+    count = data_access.rebuild_teacher_rollups()
+    print(f"✅ Rebuilt rollups for {count} teachers")
+
+@app.cli.command('backfill-benchmark-times')
+def backfill_benchmark_times_command():
+    """Generate and store benchmarkTimes for quizzes that do not have them"""
+    print("🔄 Backfilling quiz benchmark times...")
+    stored = 0
+    failed = 0
+    for quiz_id, quiz in data_access.iter_quizzes_without_benchmark_times():
+        questions = data_access.get_quiz_questions(quiz_id, quiz)
+        benchmark_times = generate_benchmark_times(
+            questions, quiz.get('toughness', 'Medium'), quiz.get('targetGrade', 'Grade 10'), fallback=False
+        ) if questions else None
+        if benchmark_times:
+            data_access.set_quiz_benchmark_times(quiz_id, benchmark_times)
+            stored += 1
+        else:
+            failed += 1
+    print(f"✅ Stored benchmark times for {stored} quizzes ({failed} skipped)")
+
 # ============ Error Handlers ============
 
 
@@ -0,0 +1,80 @@
+"""
+Benchmark ExtractionEngine.extract_many against serial extraction
+
+Builds a synthetic corpus of text PDFs (200 by default, 1-60 pages each)
+and extracts it with extract_text_from_file one file at a time (the old
+startup path) and with the process pool, cold (including worker start-up)
+and warm. A pool only pays off with more than one CPU. Run from backend/:
+
+    python benchmarks/bench_extraction.py [--files 200] [--workers N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text_extraction import ExtractionEngine, available_cpus, extract_text_from_file
+
+LINES_PER_PAGE = 40
+
+def make_pdf(pages, rng):
+    """Minimal text PDF with LINES_PER_PAGE lines of pseudo-random words per page"""
+    words = ['photosynthesis', 'equation', 'velocity', 'molecule', 'theorem', 'history', 'energy', 'cell']
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for page in range(pages):
+        lines = [' '.join(rng.choice(words) for _ in range(10)) for _ in range(LINES_PER_PAGE)]
+        stream = 'BT /F1 10 Tf 12 TL 50 760 Td ' + ' '.join(f'({line}) Tj T*' for line in lines) + ' ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>')
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    out += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('latin-1')
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--max-pages', type=int, default=60)
+    parser.add_argument('--workers', type=int, default=None, help='default: available CPUs')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    files = [(f'doc{i}', f'doc{i}.pdf', make_pdf(rng.randint(1, args.max_pages), rng)) for i in range(args.files)]
+    pages = sum(content.count(b'/Type /Page ') for _, _, content in files)
+    workers = args.workers or available_cpus()
+    print(f"{args.files} PDFs, {pages} pages, {workers} workers ({available_cpus()} CPUs available)")
+
+    start = time.perf_counter()
+    serial = {key: extract_text_from_file(name, content) for key, name, content in files}
+    serial_s = time.perf_counter() - start
+    print(f"  serial:           {serial_s:7.2f} s")
+
+    engine = ExtractionEngine(workers=workers)
+    try:
+        # With one worker the engine extracts inline, like the serial path
+        labels = ('pool (cold start)', 'pool (warm)') if workers > 1 else ('engine (inline)',)
+        for label in labels:
+            start = time.perf_counter()
+            texts = engine.extract_many(files)
+            elapsed = time.perf_counter() - start
+            assert texts == serial, "pool extraction differs from serial"
+            print(f"  {label + ':':<18}{elapsed:7.2f} s  ({serial_s / elapsed:.1f}x)")
+    finally:
+        if engine._pool is not None:
+            engine._discard_pool(engine._pool)
+
+if __name__ == '__main__':
+    main()
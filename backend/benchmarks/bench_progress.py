@@ -0,0 +1,88 @@
+"""
+Benchmark get_resource_progress_many against one read per attempt
+
+data_access talks to an in-memory fake of firebase_admin.db that sleeps
+for a round-trip latency on every read, plus a per-record transfer time,
+so a read of the whole progress tree pays for every record in it. The
+firebase-admin package must be installed (nothing is sent to Firebase).
+Run from backend/:
+
+    python benchmarks/bench_progress.py [--attempts 100 500 2000] [--latency-ms 20]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import data_access
+
+class FakeReference:
+    def __init__(self, database, path):
+        self.database = database
+        self.path = path
+
+    def get(self, shallow=False):
+        return self.database.read(self.path)
+
+class FakeDatabase:
+    """Read-only stand-in for firebase_admin.db with simulated network time"""
+
+    def __init__(self, tree, latency, per_record):
+        self.tree = tree
+        self.latency = latency
+        self.per_record = per_record
+        self.reads = 0
+        self.lock = threading.Lock()
+
+    def reference(self, path=''):
+        return FakeReference(self, path)
+
+    def read(self, path):
+        node = self.tree
+        for key in filter(None, path.split('/')):
+            node = node.get(key) if isinstance(node, dict) else None
+        records = len(node) if path == data_access.RESOURCE_PROGRESS_PATH and node else 1
+        with self.lock:
+            self.reads += 1
+        time.sleep(self.latency + records * self.per_record)
+        return node
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--attempts', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--per-record-us', type=float, default=20,
+                        help='transfer time of one progress record in a tree read')
+    parser.add_argument('--tree-factor', type=int, default=4,
+                        help='progress records stored per attempt requested (other teachers)')
+    args = parser.parse_args()
+
+    print(f"{'attempts':>8}  {'per-attempt s':>13}  {'bulk s':>7}  {'bulk reads':>10}  {'speedup':>8}")
+    for count in args.attempts:
+        progress = {f'a{i}': {'onlineResources': [0], 'analysisViewed': True} for i in range(count * args.tree_factor)}
+        database = FakeDatabase(
+            {data_access.RESOURCE_PROGRESS_PATH: progress}, args.latency_ms / 1000, args.per_record_us / 1e6
+        )
+        data_access.db = database
+        attempt_ids = [f'a{i}' for i in range(0, count * args.tree_factor, args.tree_factor)]
+
+        # The endpoints used to read each attempt's node in turn
+        start = time.perf_counter()
+        expected = {}
+        for attempt_id in attempt_ids:
+            node = database.reference(f'{data_access.RESOURCE_PROGRESS_PATH}/{attempt_id}').get()
+            if node:
+                expected[attempt_id] = node
+        loop_s = time.perf_counter() - start
+
+        database.reads = 0
+        start = time.perf_counter()
+        loaded = data_access.get_resource_progress_many(attempt_ids)
+        bulk_s = time.perf_counter() - start
+        assert loaded == expected, "bulk progress differs from per-attempt reads"
+        print(f"{count:>8}  {loop_s:>13.2f}  {bulk_s:>7.2f}  {database.reads:>10}  {loop_s / bulk_s:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark SimpleRAG.search against the per-chunk loop it replaced
+
+The embedding model is swapped for a table of fixed random vectors, so
+only the search itself is timed (no model download is needed). Run from
+backend/:
+
+    python benchmarks/bench_search.py [--sizes 1000 10000 100000] [--queries 50]
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+import types
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIM = 384
+
+class FixedVectorModel:
+    """Embedding model stand-in: each text embeds to the vector registered for it"""
+    vectors = {}
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, show_progress_bar=False, **kwargs):
+        return np.stack([self.vectors[text] for text in texts])
+
+# Installed before simple_rag is imported, which builds its global instance
+sys.modules['sentence_transformers'] = types.SimpleNamespace(SentenceTransformer=FixedVectorModel)
+from simple_rag import SimpleRAG
+
+def loop_search(chunks, embeddings, query_embedding, top_k, min_similarity):
+    """The search loop SimpleRAG used before the embedding matrix (one dot product and two norms per chunk)"""
+    similarities = []
+    for emb in embeddings:
+        similarity = np.dot(query_embedding, emb) / (np.linalg.norm(query_embedding) * np.linalg.norm(emb))
+        similarities.append(float(similarity))
+    top_indices = np.argsort(similarities)[-top_k:][::-1]
+    return [chunks[idx] for idx in top_indices if similarities[idx] >= min_similarity]
+
+def time_per_call(fn, queries):
+    start = time.perf_counter()
+    results = [fn(query) for query in queries]
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    devnull = open(os.devnull, 'w')
+    print(f"{'chunks':>8}  {'loop ms':>9}  {'matrix ms':>9}  {'speedup':>8}")
+    for size in args.sizes:
+        vectors = rng.standard_normal((size, DIM)).astype(np.float32)
+        texts = [f'chunk {i}' for i in range(size)]
+        FixedVectorModel.vectors = dict(zip(texts, vectors))
+        queries = [f'query {i}' for i in range(args.queries)]
+        # Queries close to stored chunks, so results clear min_similarity
+        query_vectors = vectors[rng.integers(0, size, args.queries)] + 0.5 * rng.standard_normal((args.queries, DIM))
+        FixedVectorModel.vectors.update(zip(queries, query_vectors.astype(np.float32)))
+
+        # The index logs every add and search; keep the table readable
+        quiet = contextlib.redirect_stdout(devnull)
+        with quiet:
+            rag = SimpleRAG(cache_size=0, query_cache_size=0)
+            for start in range(0, size, 5000):
+                rag.add_documents([(text, text, text) for text in texts[start:start + 5000]])
+
+        # The old index kept the raw (unnormalized) embeddings in a list
+        embeddings = list(vectors)
+        loop_ms, expected = time_per_call(
+            lambda query: loop_search(texts, embeddings, FixedVectorModel.vectors[query], args.top_k, 0.3), queries
+        )
+        with quiet:
+            matrix_ms, results = time_per_call(
+                lambda query: [result['content'] for result in rag.search(query, top_k=args.top_k, min_similarity=0.3)],
+                queries
+            )
+        assert results == expected, "search results differ from the loop"
+        print(f"{size:>8}  {loop_ms:>9.2f}  {matrix_ms:>9.2f}  {loop_ms / matrix_ms:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
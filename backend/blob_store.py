@@ -0,0 +1,153 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+import tempfile
+from typing import BinaryIO, Dict, Optional, Type
+
+class BlobStore(ABC):
+    """
+    Content-addressed store for uploaded files
+    Blobs are keyed by the SHA-256 of their bytes, so identical uploads are
+    stored once and a key always names the same content. Backends implement
+    _write/open/exists/delete for one storage medium.
+    """
+
+    # Whether blobs outlive the process's host; callers only drop other
+    # copies of a file (e.g. inline fileContent) once it is in a durable store
+    durable = True
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        """SHA-256 hex digest of a blob"""
+        return hashlib.sha256(data).hexdigest()
+
+    def put(self, data: bytes) -> str:
+        """
+        Store a blob (no-op if the same content is already stored)
+
+        Args:
+            data: Blob bytes
+
+        Returns:
+            Content key of the blob
+        """
+        key = self.content_hash(data)
+        if not self.exists(key):
+            self._write(key, data)
+        return key
+
+    def get(self, key: str) -> bytes:
+        """Read a whole blob; raises KeyError if it does not exist"""
+        with self.open(key) as blob:
+            return blob.read()
+
+    @abstractmethod
+    def _write(self, key: str, data: bytes):
+        """Store a blob under its key"""
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Open a blob for reading; raises KeyError if it does not exist"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether a blob is stored"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Delete a blob if it exists"""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of a blob, for backends that have one (else None)"""
+        return None
+
+class LocalBlobStore(BlobStore):
+    """Blob store on the local filesystem, sharded as <root>/<ab>/<abcdef...>"""
+
+    def __init__(self, root: str, durable: bool = False):
+        """
+        Args:
+            root: Directory holding the blobs (created if missing)
+            durable: Whether root is on persistent storage (e.g. a mounted
+                volume) rather than the container's ephemeral filesystem
+        """
+        self.root = root
+        self.durable = durable
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if len(key) != 64 or not all(c in '0123456789abcdef' for c in key):
+            raise KeyError(key)
+        return os.path.join(self.root, key[:2], key)
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename, so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            return open(self._path(key), 'rb')
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def exists(self, key: str) -> bool:
+        try:
+            return os.path.exists(self._path(key))
+        except KeyError:
+            return False
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except (FileNotFoundError, KeyError):
+            pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self._path(key)
+
+# Register new backends (e.g. an object store) here
+BACKENDS: Dict[str, Type[BlobStore]] = {
+    'local': LocalBlobStore
+}
+
+def create_blob_store(backend: Optional[str] = None, location: Optional[str] = None) -> BlobStore:
+    """
+    Create the configured blob store
+
+    Args:
+        backend: Backend name (default: BLOB_STORE_BACKEND or 'local')
+        location: Backend location, a directory for 'local'
+            (default: BLOB_STORE_DIR, which must be set for 'local')
+
+    Returns:
+        Blob store instance
+
+    Raises:
+        RuntimeError: If the local backend has no explicitly configured directory
+    """
+    backend = backend or os.getenv('BLOB_STORE_BACKEND', 'local')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown blob store backend '{backend}', expected one of {tuple(BACKENDS)}")
+    location = location or os.getenv('BLOB_STORE_DIR')
+    if backend == 'local':
+        # A default directory inside the container would silently lose every
+        # upload on restart (e.g. on Cloud Run), so it must be chosen explicitly
+        if not location:
+            raise RuntimeError(
+                "BLOB_STORE_DIR is not set. Set it to a directory for uploaded files "
+                "(a mounted volume in production) or set BLOB_STORE_BACKEND to a durable backend"
+            )
+        store = LocalBlobStore(location, durable=os.getenv('BLOB_STORE_DURABLE', 'false').lower() == 'true')
+    else:
+        store = BACKENDS[backend](location)
+    print(f"✅ Blob store: {backend} ({location}{'' if store.durable else ', not durable'})")
+    return store
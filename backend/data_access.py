@@ -0,0 +1,1004 @@
+import base64
+import copy
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from firebase_admin import db
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Attempts are stored in full under quiz_attempts/<attemptId>. Two fan-out
+# indexes hold a small summary of each attempt so per-student and per-quiz
+# queries never download the bulky detailedResults/resourceRecommendations:
+#   attempts_by_student/<studentId>/<attemptId>
+#   attempts_by_quiz/<quizId>/<attemptId>
+ATTEMPTS_PATH = 'quiz_attempts'
+ATTEMPTS_BY_STUDENT_PATH = 'attempts_by_student'
+ATTEMPTS_BY_QUIZ_PATH = 'attempts_by_quiz'
+
+# Quiz summaries live under quizzes/<quizId> (indexed on teacherId and
+# gradeKey, see database.rules.json); their questions are stored apart
+# under quiz_questions/<quizId> so list queries never transfer them
+QUIZZES_PATH = 'quizzes'
+QUIZ_QUESTIONS_PATH = 'quiz_questions'
+# Study-material snippets related to each question, tagged with the RAG
+# index version they were computed against:
+#   quiz_related_material/<quizId> = {indexVersion, questions: [[snippet, ...], ...]}
+QUIZ_RELATED_MATERIAL_PATH = 'quiz_related_material'
+
+# Running per-student aggregates, updated transactionally on every submit
+STUDENT_STATS_PATH = 'student_stats'
+RECENT_ATTEMPTS_KEPT = 20
+RECENT_ATTEMPT_FIELDS = ('quizId', 'quizTitle', 'score', 'totalQuestions', 'percentage', 'completedAt')
+
+# Per-teacher class analytics. Each submit updates small sub-nodes in
+# separate transactions, so concurrent submits rarely contend:
+#   teacher_rollups/<teacherId>/totals             {attemptCount, percentageSum}
+#   teacher_rollups/<teacherId>/histogram/<bucket>
+#   teacher_rollups/<teacherId>/days/<YYYY-MM-DD>  {sum, count}
+#   teacher_rollups/<teacherId>/weakTopics/<key>   {topic, count}
+#   teacher_rollups/<teacherId>/students/<studentId>
+# `builtAt` marks a complete rollup; it is cleared when an update fails so
+# the next read rebuilds the rollup from the attempt index. Every attempt is
+# also saved as teacher_rollups/<teacherId>/pending/<attemptId> (its
+# summary), in the same update as the attempt itself. Whoever removes that
+# entry counts the attempt: the submit once the rollup is built, otherwise
+# the build, which stores the rollup in a transaction that folds in entries
+# of attempts saved after it read the index
+TEACHER_ROLLUPS_PATH = 'teacher_rollups'
+SCORE_BUCKETS = ('0-20', '21-40', '41-60', '61-80', '81-100')
+ROLLUP_DAYS_KEPT = 60
+# Most frequent weak topics kept per teacher; the list is pruned back to
+# this size once it has doubled, so counts of rarely missed topics are
+# approximate until the next rebuild
+WEAK_TOPICS_KEPT = int(os.getenv('WEAK_TOPICS_KEPT', '50'))
+WEAK_TOPIC_TEXT_CHARS = 200
+
+# Per-attempt resource completion lives under resource_progress/<attemptId>
+RESOURCE_PROGRESS_PATH = 'resource_progress'
+# Above this many attempts one read of the whole progress tree beats
+# fetching each attempt's node
+PROGRESS_TREE_READ_MIN = int(os.getenv('PROGRESS_TREE_READ_MIN', '1000'))
+PROGRESS_READ_WORKERS = int(os.getenv('PROGRESS_READ_WORKERS', '16'))
+
+# Material records hold metadata plus the contentKey/contentHash of the
+# file in the blob store; older records still carry base64 fileContent
+STUDY_MATERIALS_PATH = 'study_materials'
+# While the blob store is not durable, the base64 file of each material is
+# kept under material_files/<materialId>, outside the record, so listing
+# materials does not download every file
+MATERIAL_FILES_PATH = 'material_files'
+
+SUMMARY_FIELDS = (
+    'studentId', 'quizId', 'quizTitle', 'score', 'totalQuestions', 'percentage',
+    'completedAt', 'timeTaken', 'toughness', 'targetGrade', 'weakTopics'
+)
+
+def _iter_pages(path: str, page_size: int) -> Iterator[Dict[str, Dict]]:
+    """Read the children of `path` in key order, one page per round trip"""
+    ref = db.reference(path)
+    last_key = None
+    while True:
+        query = ref.order_by_key()
+        if last_key is not None:
+            query = query.start_at(last_key)
+        page = query.limit_to_first(page_size + (last_key is not None)).get() or {}
+        page.pop(last_key, None)
+        if not page:
+            return
+        yield page
+        last_key = next(reversed(page))
+
+def _get_children(path: str, keys: List[str]) -> Dict[str, Dict]:
+    """Read path/<key> for each key concurrently; missing children are omitted"""
+    if not keys:
+        return {}
+
+    def fetch(key):
+        return db.reference(f'{path}/{key}').get()
+
+    with ThreadPoolExecutor(max_workers=min(PROGRESS_READ_WORKERS, len(keys))) as pool:
+        return {key: value for key, value in zip(keys, pool.map(fetch, keys)) if isinstance(value, dict)}
+
+def get_students(student_ids: Iterable[str]) -> Dict[str, Dict]:
+    """Student profiles keyed by id, fetched concurrently"""
+    return _get_children('students', list(dict.fromkeys(student_ids)))
+
+# ============ Quiz Attempts ============
+
+def count_resources(resource_recommendations: Optional[Dict]) -> int:
+    """Number of trackable resources for an attempt (resources plus the analysis)"""
+    if not resource_recommendations:
+        return 0
+    return (
+        len(resource_recommendations.get('onlineResources', [])) +
+        len(resource_recommendations.get('youtubeVideos', [])) +
+        1
+    )
+
+def attempt_summary(attempt: Dict) -> Dict:
+    """
+    Build the index entry for an attempt
+
+    Args:
+        attempt: Full attempt record
+
+    Returns:
+        Summary with the fields list and analytics endpoints need
+    """
+    summary = {field: attempt[field] for field in SUMMARY_FIELDS if attempt.get(field) is not None}
+    summary['totalResources'] = count_resources(attempt.get('resourceRecommendations'))
+    return summary
+
+def _index_updates(attempt_id: str, attempt: Dict) -> Dict:
+    """Root-relative paths that write an attempt's index entries"""
+    summary = attempt_summary(attempt)
+    return {
+        f"{ATTEMPTS_BY_STUDENT_PATH}/{attempt['studentId']}/{attempt_id}": summary,
+        f"{ATTEMPTS_BY_QUIZ_PATH}/{attempt['quizId']}/{attempt_id}": summary
+    }
+
+def save_quiz_attempt(attempt: Dict) -> str:
+    """
+    Store a new attempt together with its index entries (and pending
+    teacher rollup entry) in one atomic multi-path update
+
+    Args:
+        attempt: Full attempt record (must contain studentId and quizId)
+
+    Returns:
+        The new attempt id
+    """
+    attempt_id = db.reference(ATTEMPTS_PATH).push().key
+    updates = _index_updates(attempt_id, attempt)
+    updates[f'{ATTEMPTS_PATH}/{attempt_id}'] = attempt
+    if attempt.get('teacherId'):
+        updates[f"{TEACHER_ROLLUPS_PATH}/{attempt['teacherId']}/pending/{attempt_id}"] = attempt_summary(attempt)
+    db.reference().update(updates)
+    return attempt_id
+
+def get_student_attempts(student_id: str) -> Dict[str, Dict]:
+    """
+    Get attempt summaries for one student
+
+    Returns:
+        Summaries keyed by attempt id
+    """
+    return db.reference(f'{ATTEMPTS_BY_STUDENT_PATH}/{student_id}').get() or {}
+
+def get_quiz_attempts(quiz_ids: Iterable[str]) -> Dict[str, Dict]:
+    """
+    Get attempt summaries for a set of quizzes, reading the per-quiz
+    indexes concurrently
+
+    Returns:
+        Summaries keyed by attempt id
+    """
+    attempts = {}
+    for quiz_attempts in _get_children(ATTEMPTS_BY_QUIZ_PATH, list(dict.fromkeys(quiz_ids))).values():
+        attempts.update(quiz_attempts)
+    return attempts
+
+def backfill_attempt_indexes(page_size: int = 500) -> int:
+    """
+    Rebuild the index entries of every stored attempt
+    Attempts are read a page at a time in key order, so the whole
+    collection is never held in memory; rerunning it is harmless
+
+    Args:
+        page_size: Attempts read and indexed per round trip
+
+    Returns:
+        Number of attempts indexed
+    """
+    indexed = 0
+    for page in _iter_pages(ATTEMPTS_PATH, page_size):
+        updates = {}
+        for attempt_id, attempt in page.items():
+            if isinstance(attempt, dict) and attempt.get('studentId') and attempt.get('quizId'):
+                updates.update(_index_updates(attempt_id, attempt))
+                indexed += 1
+        if updates:
+            db.reference().update(updates)
+        print(f"   🔁 Indexed {indexed} attempts...")
+    return indexed
+
+def save_attempt_recommendations(attempt_id: str, attempt: Dict, recommendations: Dict) -> int:
+    """
+    Store recommendations generated after an attempt was saved, and bring
+    the resource totals of its index entries and teacher rollup up to date
+
+    Args:
+        attempt_id: Attempt id
+        attempt: Attempt record or summary (needs studentId and quizId)
+        recommendations: The attempt's resourceRecommendations
+
+    Returns:
+        Number of trackable resources added to the attempt
+    """
+    total_resources = count_resources(recommendations)
+    db.reference().update({
+        f'{ATTEMPTS_PATH}/{attempt_id}/resourceRecommendations': recommendations,
+        f'{ATTEMPTS_PATH}/{attempt_id}/recommendationsStatus': 'ready',
+        f"{ATTEMPTS_BY_STUDENT_PATH}/{attempt['studentId']}/{attempt_id}/totalResources": total_resources,
+        f"{ATTEMPTS_BY_QUIZ_PATH}/{attempt['quizId']}/{attempt_id}/totalResources": total_resources
+    })
+    if attempt.get('teacherId') and total_resources:
+        def update(student):
+            if student is None:
+                # Not in the rollup yet; it is built from the index, which is already updated
+                return None
+            student['totalResources'] = student.get('totalResources', 0) + total_resources
+            return student
+
+        db.reference(f"{TEACHER_ROLLUPS_PATH}/{attempt['teacherId']}/students/{attempt['studentId']}").transaction(update)
+    return total_resources
+
+def set_recommendations_status(attempt_id: str, status: str):
+    """Set the recommendationsStatus of an attempt ('pending', 'ready' or 'failed')"""
+    db.reference(f'{ATTEMPTS_PATH}/{attempt_id}/recommendationsStatus').set(status)
+
+# ============ Student Stats ============
+
+def _stats_key(label) -> str:
+    """Make a free-form label (e.g. a difficulty) safe to use as a database key"""
+    return ''.join('_' if c in '.$#[]/' else c for c in str(label)) or '_'
+
+def apply_attempt_to_stats(stats: Optional[Dict], attempt_id: str, attempt: Dict) -> Dict:
+    """
+    Fold one attempt into a student_stats aggregate in O(1)
+
+    Args:
+        stats: Current aggregate (None for a student without one)
+        attempt_id: Attempt id
+        attempt: Attempt record or summary
+
+    Returns:
+        The updated aggregate
+    """
+    stats = stats or {}
+    recent = list(stats.get('recentAttempts') or [])
+    if any(entry.get('id') == attempt_id for entry in recent):
+        # Already counted (e.g. the aggregate was just built from the index)
+        return stats
+    score = attempt.get('score', 0)
+    total_questions = attempt.get('totalQuestions', 0)
+    percentage = attempt.get('percentage', 0)
+
+    stats['attemptCount'] = stats.get('attemptCount', 0) + 1
+    stats['totalScore'] = stats.get('totalScore', 0) + score
+    stats['totalQuestions'] = stats.get('totalQuestions', 0) + total_questions
+    stats['percentageSum'] = stats.get('percentageSum', 0) + percentage
+    stats['minPercentage'] = min(stats.get('minPercentage', percentage), percentage)
+    stats['maxPercentage'] = max(stats.get('maxPercentage', percentage), percentage)
+
+    time_taken = attempt.get('timeTaken')
+    if time_taken:
+        stats['timeCount'] = stats.get('timeCount', 0) + 1
+        stats['timeSum'] = stats.get('timeSum', 0) + time_taken
+        stats['minTime'] = min(stats.get('minTime', time_taken), time_taken)
+        stats['maxTime'] = max(stats.get('maxTime', time_taken), time_taken)
+
+    by_difficulty = stats.get('byDifficulty') or {}
+    key = _stats_key(attempt.get('toughness') or 'Medium')
+    bucket = by_difficulty.get(key) or {'count': 0, 'correct': 0, 'total': 0}
+    bucket['count'] += 1
+    bucket['correct'] += score
+    bucket['total'] += total_questions
+    by_difficulty[key] = bucket
+    stats['byDifficulty'] = by_difficulty
+
+    recent.append({'id': attempt_id, **{field: attempt[field] for field in RECENT_ATTEMPT_FIELDS if field in attempt}})
+    recent.sort(key=lambda entry: entry.get('completedAt', ''))
+    stats['recentAttempts'] = recent[-RECENT_ATTEMPTS_KEPT:]
+    return stats
+
+def build_student_stats(attempts: Dict[str, Dict]) -> Optional[Dict]:
+    """Build a student_stats aggregate from attempt summaries keyed by id"""
+    stats = None
+    for attempt_id, attempt in sorted(attempts.items(), key=lambda item: item[1].get('completedAt', '')):
+        if isinstance(attempt, dict):
+            stats = apply_attempt_to_stats(stats, attempt_id, attempt)
+    return stats
+
+def record_student_stats(attempt_id: str, attempt: Dict) -> Dict:
+    """
+    Add a newly saved attempt to its student's aggregate in a transaction
+    A student without an aggregate yet gets one built from their indexed
+    attempts (which already include this one)
+
+    Returns:
+        The updated aggregate
+    """
+    student_id = attempt['studentId']
+
+    def update(stats):
+        if stats is None:
+            return build_student_stats(get_student_attempts(student_id))
+        return apply_attempt_to_stats(stats, attempt_id, attempt)
+
+    return db.reference(f'{STUDENT_STATS_PATH}/{student_id}').transaction(update)
+
+def get_student_stats(student_id: str) -> Optional[Dict]:
+    """
+    Get a student's aggregate, building it from their indexed attempts if
+    it does not exist yet
+
+    Returns:
+        Aggregate, or None if the student has no attempts
+    """
+    stats = db.reference(f'{STUDENT_STATS_PATH}/{student_id}').get()
+    if stats is None:
+        stats = build_student_stats(get_student_attempts(student_id))
+        if stats is not None:
+            db.reference(f'{STUDENT_STATS_PATH}/{student_id}').transaction(
+                lambda current: current if current is not None else stats
+            )
+    return stats
+
+def rebuild_student_stats() -> int:
+    """
+    Recompute every student's aggregate from attempts_by_student
+
+    Returns:
+        Number of students rebuilt
+    """
+    student_ids = list((db.reference(ATTEMPTS_BY_STUDENT_PATH).get(shallow=True) or {}).keys())
+    for student_id in student_ids:
+        stats = build_student_stats(get_student_attempts(student_id))
+        db.reference(f'{STUDENT_STATS_PATH}/{student_id}').set(stats)
+    return len(student_ids)
+
+# ============ Teacher Rollups ============
+
+def score_bucket(percentage: float) -> str:
+    """Histogram bucket of a percentage score"""
+    for bucket, upper in zip(SCORE_BUCKETS, (20, 40, 60, 80)):
+        if percentage <= upper:
+            return bucket
+    return SCORE_BUCKETS[-1]
+
+def attempt_day(completed_at) -> Optional[str]:
+    """YYYY-MM-DD day of an ISO timestamp, or None if it cannot be parsed"""
+    try:
+        return datetime.fromisoformat(completed_at.replace('Z', '+00:00')).strftime('%Y-%m-%d')
+    except (AttributeError, ValueError, TypeError):
+        return None
+
+def _topic_key(topic: str) -> str:
+    """Database key for a weak topic (topics are free text, often whole questions)"""
+    return hashlib.sha1(topic.encode('utf-8')).hexdigest()[:16]
+
+def _new_weak_topic(topic: str) -> Dict:
+    return {'topic': topic[:WEAK_TOPIC_TEXT_CHARS], 'count': 0}
+
+def _add_attempt_to_student(student: Optional[Dict], attempt: Dict, completed_resources: int = 0) -> Dict:
+    """Fold one attempt into a student's entry of a teacher rollup"""
+    student = student or {
+        'attemptCount': 0, 'totalScore': 0, 'totalQuestions': 0,
+        'totalResources': 0, 'completedResources': 0, 'lastActivity': ''
+    }
+    student['attemptCount'] = student.get('attemptCount', 0) + 1
+    student['totalScore'] = student.get('totalScore', 0) + attempt.get('score', 0)
+    student['totalQuestions'] = student.get('totalQuestions', 0) + attempt.get('totalQuestions', 0)
+    student['totalResources'] = student.get('totalResources', 0) + attempt.get(
+        'totalResources', count_resources(attempt.get('resourceRecommendations'))
+    )
+    student['completedResources'] = student.get('completedResources', 0) + completed_resources
+    student['lastActivity'] = max(student.get('lastActivity', ''), attempt.get('completedAt', ''))
+    return student
+
+def _add_to_day(totals: Optional[Dict], percentage: float) -> Dict:
+    totals = totals or {'sum': 0, 'count': 0}
+    totals['sum'] += percentage
+    totals['count'] += 1
+    return totals
+
+def _day_cutoff(day: str) -> str:
+    """Oldest day kept in a rollup whose latest attempt is on `day`"""
+    return (datetime.strptime(day, '%Y-%m-%d') - timedelta(days=ROLLUP_DAYS_KEPT - 1)).strftime('%Y-%m-%d')
+
+def _top_weak_topics(weak_topics: Dict[str, Dict]) -> Dict[str, Dict]:
+    """The WEAK_TOPICS_KEPT most frequent weak-topic counters"""
+    ranked = sorted(weak_topics.items(), key=lambda item: item[1].get('count', 0), reverse=True)
+    return dict(ranked[:WEAK_TOPICS_KEPT])
+
+def apply_attempt_to_rollup(rollup: Optional[Dict], attempt: Dict, completed_resources: int = 0) -> Dict:
+    """
+    Fold one attempt into a teacher_rollups aggregate held in memory
+    (used to build rollups; stored rollups are updated per sub-node)
+
+    Args:
+        rollup: Current rollup (None for a teacher without one)
+        attempt: Attempt record or summary
+        completed_resources: Resources of this attempt already marked complete
+
+    Returns:
+        The updated rollup
+    """
+    rollup = rollup or {}
+    percentage = attempt.get('percentage', 0)
+    totals = rollup.get('totals') or {'attemptCount': 0, 'percentageSum': 0}
+    totals['attemptCount'] += 1
+    totals['percentageSum'] += percentage
+    rollup['totals'] = totals
+
+    histogram = rollup.get('histogram') or {}
+    bucket = score_bucket(percentage)
+    histogram[bucket] = histogram.get(bucket, 0) + 1
+    rollup['histogram'] = histogram
+
+    day = attempt_day(attempt.get('completedAt'))
+    if day:
+        days = rollup.get('days') or {}
+        days[day] = _add_to_day(days.get(day), percentage)
+        # Only recent days feed the trend chart
+        cutoff = _day_cutoff(max(days))
+        rollup['days'] = {key: value for key, value in days.items() if key >= cutoff}
+
+    weak_topics = rollup.get('weakTopics') or {}
+    for topic in attempt.get('weakTopics') or []:
+        key = _topic_key(topic)
+        counter = weak_topics.get(key) or _new_weak_topic(topic)
+        counter['count'] += 1
+        weak_topics[key] = counter
+    rollup['weakTopics'] = weak_topics
+
+    students = rollup.get('students') or {}
+    students[attempt['studentId']] = _add_attempt_to_student(
+        students.get(attempt['studentId']), attempt, completed_resources
+    )
+    rollup['students'] = students
+    return rollup
+
+def _transact(path: str, update, label: str) -> bool:
+    """Run one rollup sub-node transaction; failures are logged and reported, not raised"""
+    try:
+        db.reference(path).transaction(update)
+        return True
+    except Exception as e:
+        print(f"⚠️  Rollup update failed ({label}): {e}")
+        return False
+
+def _prune_weak_topics(teacher_id: str):
+    """Drop all but the most frequent weak topics of a teacher's rollup"""
+    base = f'{TEACHER_ROLLUPS_PATH}/{teacher_id}'
+    weak_topics = db.reference(f'{base}/weakTopics').get() or {}
+    kept = _top_weak_topics(weak_topics)
+    updates = {f'{base}/weakTopics/{key}': None for key in weak_topics if key not in kept}
+    updates[f'{base}/weakTopicCount'] = len(kept)
+    db.reference().update(updates)
+
+def record_teacher_rollup(attempt_id: str, attempt: Dict) -> bool:
+    """
+    Add a newly saved attempt to its teacher's rollup
+    Every aggregate is its own small transaction. A rollup that has not
+    been built yet is left alone: its build counts the attempt, from the
+    attempt index or the attempt's pending entry. Otherwise the pending
+    entry is claimed first, so an attempt a concurrent build already
+    counted is not added twice. If any update fails the rollup is marked
+    for a rebuild rather than left to drift
+
+    Args:
+        attempt_id: Id returned by save_quiz_attempt
+        attempt: The saved attempt record
+
+    Returns:
+        True if the rollup is up to date
+    """
+    teacher_id = attempt.get('teacherId')
+    if not teacher_id:
+        return True
+    base = f'{TEACHER_ROLLUPS_PATH}/{teacher_id}'
+    if not db.reference(f'{base}/builtAt').get():
+        return True
+
+    claimed = [False]
+
+    def claim(entry):
+        claimed[0] = entry is not None
+        return None
+
+    if not _transact(f'{base}/pending/{attempt_id}', claim, 'pending'):
+        mark_teacher_rollup_stale(teacher_id)
+        return False
+    if not claimed[0]:
+        # The build that just stored this rollup counted the attempt
+        return True
+
+    percentage = attempt.get('percentage', 0)
+    ok = _transact(f'{base}/totals', lambda totals: {
+        'attemptCount': (totals or {}).get('attemptCount', 0) + 1,
+        'percentageSum': (totals or {}).get('percentageSum', 0) + percentage
+    }, 'totals')
+    ok &= _transact(f'{base}/histogram/{score_bucket(percentage)}', lambda count: (count or 0) + 1, 'histogram')
+
+    day = attempt_day(attempt.get('completedAt'))
+    if day:
+        new_day = [False]
+
+        def add_to_day(totals):
+            new_day[0] = totals is None
+            return _add_to_day(totals, percentage)
+
+        day_ok = _transact(f'{base}/days/{day}', add_to_day, 'days')
+        ok &= day_ok
+        if day_ok and new_day[0]:
+            # The first attempt of a day trims days that fell out of the window
+            cutoff = _day_cutoff(day)
+            try:
+                old_days = db.reference(f'{base}/days').order_by_key().end_at(cutoff).get() or {}
+                old_days.pop(cutoff, None)
+                if old_days:
+                    db.reference().update({f'{base}/days/{old_day}': None for old_day in old_days})
+            except Exception as e:
+                print(f"⚠️  Could not trim rollup days of teacher {teacher_id}: {e}")
+
+    new_topics = 0
+    for topic in attempt.get('weakTopics') or []:
+        created = [False]
+
+        def add_to_topic(counter, topic=topic, created=created):
+            created[0] = counter is None
+            counter = counter or _new_weak_topic(topic)
+            counter['count'] += 1
+            return counter
+
+        ok &= _transact(f'{base}/weakTopics/{_topic_key(topic)}', add_to_topic, 'weak topics')
+        new_topics += created[0]
+    if new_topics:
+        topic_count = [0]
+
+        def count_topics(count):
+            topic_count[0] = (count or 0) + new_topics
+            return topic_count[0]
+
+        if _transact(f'{base}/weakTopicCount', count_topics, 'weak topic count') and topic_count[0] > 2 * WEAK_TOPICS_KEPT:
+            try:
+                _prune_weak_topics(teacher_id)
+            except Exception as e:
+                print(f"⚠️  Could not prune weak topics of teacher {teacher_id}: {e}")
+
+    ok &= _transact(
+        f"{base}/students/{attempt['studentId']}",
+        lambda student: _add_attempt_to_student(student, attempt),
+        'students'
+    )
+
+    if not ok:
+        mark_teacher_rollup_stale(teacher_id)
+    return ok
+
+def mark_teacher_rollup_stale(teacher_id: str):
+    """Have a teacher's rollup rebuilt from the attempt index on its next read"""
+    if not teacher_id:
+        return
+    try:
+        db.reference(f'{TEACHER_ROLLUPS_PATH}/{teacher_id}/builtAt').delete()
+        print(f"⚠️  Rollup of teacher {teacher_id} will be rebuilt on its next read")
+    except Exception as e:
+        print(f"❌ Could not mark rollup of teacher {teacher_id} for a rebuild "
+              f"(run `flask rebuild-teacher-rollups`): {e}")
+
+def record_completed_resources(teacher_id: str, student_id: str, delta: int):
+    """Adjust a student's completed-resource count in a teacher's rollup"""
+    if not teacher_id or not delta:
+        return
+
+    def update(student):
+        if student is None:
+            # Not in the rollup yet; a rebuild will pick the progress up
+            return None
+        student['completedResources'] = student.get('completedResources', 0) + delta
+        return student
+
+    db.reference(f'{TEACHER_ROLLUPS_PATH}/{teacher_id}/students/{student_id}').transaction(update)
+
+def adjust_teacher_quiz_count(teacher_id: str, delta: int):
+    """Track how many quizzes a teacher has in their rollup (once it has been built)"""
+    if teacher_id:
+        db.reference(f'{TEACHER_ROLLUPS_PATH}/{teacher_id}/quizCount').transaction(
+            lambda count: None if count is None else max(0, count + delta)
+        )
+
+def remove_quiz_from_rollup(teacher_id: str, quiz_id: str):
+    """
+    Take a deleted quiz out of its teacher's rollup (call after delete_quiz)
+    Attempts cannot be subtracted exactly (last activity, pruned weak
+    topics), so a rollup that counted any of the quiz's attempts is rebuilt
+    on its next read, without them
+    """
+    if not teacher_id:
+        return
+    attempt_ids = list((db.reference(f'{ATTEMPTS_BY_QUIZ_PATH}/{quiz_id}').get(shallow=True) or {}).keys())
+    if not attempt_ids:
+        adjust_teacher_quiz_count(teacher_id, -1)
+        return
+    # Pending entries of these attempts must not be folded into the rebuild
+    db.reference().update({f'{TEACHER_ROLLUPS_PATH}/{teacher_id}/pending/{attempt_id}': None for attempt_id in attempt_ids})
+    mark_teacher_rollup_stale(teacher_id)
+
+def get_teacher_rollup(teacher_id: str) -> Optional[Dict]:
+    """Get a teacher's rollup, or None if it has not been built (or needs a rebuild)"""
+    rollup = db.reference(f'{TEACHER_ROLLUPS_PATH}/{teacher_id}').get()
+    return rollup if isinstance(rollup, dict) and rollup.get('builtAt') else None
+
+def build_teacher_rollup(teacher_id: str, counted: Optional[Set[str]] = None) -> Dict:
+    """
+    Compute a teacher's rollup from their quizzes, attempt index and progress
+
+    Args:
+        teacher_id: Teacher id
+        counted: Optional set that receives the ids of the attempts counted
+
+    Returns:
+        The rollup (not stored)
+    """
+    quiz_ids = list(get_teacher_quizzes(teacher_id))
+    attempts = get_quiz_attempts(quiz_ids)
+    if counted is not None:
+        counted.update(attempts)
+    progress = get_resource_progress_many(
+        attempt_id for attempt_id, attempt in attempts.items() if attempt.get('totalResources', 0) > 0
+    )
+    rollup = {'quizCount': len(quiz_ids)}
+    for attempt_id, attempt in sorted(attempts.items(), key=lambda item: item[1].get('completedAt', '')):
+        if isinstance(attempt, dict) and attempt.get('studentId'):
+            completed = count_completed_resources(progress.get(attempt_id)) if attempt.get('totalResources', 0) > 0 else 0
+            rollup = apply_attempt_to_rollup(rollup, attempt, completed)
+    rollup['weakTopics'] = _top_weak_topics(rollup.get('weakTopics') or {})
+    rollup['weakTopicCount'] = len(rollup['weakTopics'])
+    rollup['builtAt'] = datetime.utcnow().isoformat()
+    return rollup
+
+class _RollupAlreadyBuilt(Exception):
+    """Aborts a rollup store because another build stored one first"""
+
+def store_teacher_rollup(teacher_id: str, rollup: Dict, counted: Set[str], replace: bool = False) -> Dict:
+    """
+    Store a freshly built rollup in one transaction, adding the pending
+    entries of attempts saved after the build read the index
+
+    Args:
+        teacher_id: Teacher id
+        rollup: Result of build_teacher_rollup
+        counted: Attempt ids the build counted
+        replace: Overwrite a rollup that is already built
+
+    Returns:
+        The stored rollup (another build's, if it stored one first)
+    """
+    ref = db.reference(f'{TEACHER_ROLLUPS_PATH}/{teacher_id}')
+
+    def store(current):
+        current = current if isinstance(current, dict) else {}
+        if current.get('builtAt') and not replace:
+            raise _RollupAlreadyBuilt()
+        # The transaction may run again, so the built rollup is not modified
+        stored = copy.deepcopy(rollup)
+        for attempt_id, summary in (current.get('pending') or {}).items():
+            if attempt_id not in counted and isinstance(summary, dict) and summary.get('studentId'):
+                stored = apply_attempt_to_rollup(stored, summary)
+        stored['weakTopics'] = _top_weak_topics(stored.get('weakTopics') or {})
+        stored['weakTopicCount'] = len(stored['weakTopics'])
+        return stored
+
+    try:
+        return ref.transaction(store)
+    except _RollupAlreadyBuilt:
+        return get_teacher_rollup(teacher_id) or rollup
+
+def get_or_build_teacher_rollup(teacher_id: str) -> Dict:
+    """Get a teacher's rollup, building and storing it on first use or after a failed update"""
+    rollup = get_teacher_rollup(teacher_id)
+    if rollup is None:
+        counted = set()
+        rollup = store_teacher_rollup(teacher_id, build_teacher_rollup(teacher_id, counted), counted)
+    return rollup
+
+def rebuild_teacher_rollups() -> int:
+    """
+    Recompute the rollup of every teacher; the repair path for rollups
+    that drifted from the attempt index (`flask rebuild-teacher-rollups`)
+
+    Returns:
+        Number of teachers rebuilt
+    """
+    teacher_ids = list((db.reference('teachers').get(shallow=True) or {}).keys())
+    for teacher_id in teacher_ids:
+        counted = set()
+        store_teacher_rollup(teacher_id, build_teacher_rollup(teacher_id, counted), counted, replace=True)
+    return len(teacher_ids)
+
+# ============ Resource Progress ============
+
+def count_completed_resources(progress: Optional[Dict]) -> int:
+    """Number of resources marked complete in a progress record"""
+    if not isinstance(progress, dict):
+        return 0
+    return (
+        len(progress.get('onlineResources', [])) +
+        len(progress.get('youtubeVideos', [])) +
+        (1 if progress.get('analysisViewed') else 0)
+    )
+
+def get_resource_progress_many(attempt_ids: Iterable[str]) -> Dict[str, Dict]:
+    """
+    Load resource progress for many attempts without one sequential round
+    trip per attempt: small sets are fetched concurrently, large sets with
+    a single read of the whole progress tree
+
+    Args:
+        attempt_ids: Attempt ids
+
+    Returns:
+        Progress records keyed by attempt id (attempts without progress are omitted)
+    """
+    attempt_ids = list(dict.fromkeys(attempt_ids))
+    if not attempt_ids:
+        return {}
+
+    if len(attempt_ids) >= PROGRESS_TREE_READ_MIN:
+        all_progress = db.reference(RESOURCE_PROGRESS_PATH).get() or {}
+        return {
+            attempt_id: all_progress[attempt_id]
+            for attempt_id in attempt_ids
+            if isinstance(all_progress.get(attempt_id), dict)
+        }
+
+    return _get_children(RESOURCE_PROGRESS_PATH, attempt_ids)
+
+# ============ Quizzes ============
+
+def grade_key(grade) -> Optional[int]:
+    """Normalize a grade label such as 'Grade 10' to its number, or None"""
+    digits = ''.join(filter(str.isdigit, str(grade or '')))
+    return int(digits) if digits else None
+
+def save_quiz(quiz: Dict) -> str:
+    """
+    Store a new quiz: its summary under quizzes/ and its questions under
+    quiz_questions/, in one atomic multi-path update
+
+    Args:
+        quiz: Quiz record including 'questions'
+
+    Returns:
+        The new quiz id
+    """
+    quiz = dict(quiz)
+    questions = quiz.pop('questions', [])
+    quiz['gradeKey'] = grade_key(quiz.get('targetGrade'))
+    quiz_id = db.reference(QUIZZES_PATH).push().key
+    db.reference().update({
+        f'{QUIZZES_PATH}/{quiz_id}': quiz,
+        f'{QUIZ_QUESTIONS_PATH}/{quiz_id}': questions
+    })
+    return quiz_id
+
+def get_quiz_questions(quiz_id: str, quiz: Optional[Dict] = None) -> List[Dict]:
+    """
+    Get a quiz's questions, falling back to questions stored inline on
+    quizzes that predate the split
+
+    Args:
+        quiz_id: Quiz id
+        quiz: The quiz summary, if already loaded
+    """
+    questions = db.reference(f'{QUIZ_QUESTIONS_PATH}/{quiz_id}').get()
+    if questions is None and quiz is not None:
+        questions = quiz.get('questions')
+    return questions or []
+
+def get_quiz(quiz_id: str, with_questions: bool = True) -> Optional[Dict]:
+    """
+    Get one quiz
+
+    Args:
+        quiz_id: Quiz id
+        with_questions: Attach the quiz's questions under 'questions'
+
+    Returns:
+        Quiz record, or None if it does not exist
+    """
+    quiz = db.reference(f'{QUIZZES_PATH}/{quiz_id}').get()
+    if not isinstance(quiz, dict):
+        return None
+    if with_questions:
+        quiz['questions'] = get_quiz_questions(quiz_id, quiz)
+    else:
+        quiz.pop('questions', None)
+    return quiz
+
+def _query_quizzes(field: str, value) -> Dict[str, Dict]:
+    """Quiz summaries whose `field` equals `value`, filtered by the database"""
+    quizzes = db.reference(QUIZZES_PATH).order_by_child(field).equal_to(value).get() or {}
+    summaries = {}
+    for quiz_id, quiz in quizzes.items():
+        if isinstance(quiz, dict):
+            quiz.pop('questions', None)
+            summaries[quiz_id] = quiz
+    return summaries
+
+def get_teacher_quizzes(teacher_id: str) -> Dict[str, Dict]:
+    """Quiz summaries created by a teacher, keyed by quiz id"""
+    return _query_quizzes('teacherId', teacher_id)
+
+def get_grade_quizzes(grade) -> Dict[str, Dict]:
+    """Quiz summaries targeting a grade (any label with the same number), keyed by quiz id"""
+    key = grade_key(grade)
+    return _query_quizzes('gradeKey', key) if key is not None else {}
+
+def delete_quiz(quiz_id: str):
+    """Delete a quiz summary and its questions"""
+    db.reference().update({
+        f'{QUIZZES_PATH}/{quiz_id}': None,
+        f'{QUIZ_QUESTIONS_PATH}/{quiz_id}': None,
+        f'{QUIZ_RELATED_MATERIAL_PATH}/{quiz_id}': None
+    })
+
+def get_quiz_related_material(quiz_id: str) -> Optional[Tuple[str, Dict[int, List[Dict]]]]:
+    """
+    Get the stored related-material snippets of a quiz
+
+    Returns:
+        (index_version, snippets by question index), or None if none are stored
+    """
+    related = db.reference(f'{QUIZ_RELATED_MATERIAL_PATH}/{quiz_id}').get()
+    if not isinstance(related, dict) or not related.get('indexVersion'):
+        return None
+    # The database drops empty lists and may return a sparse list as a dict
+    questions = related.get('questions') or []
+    items = questions.items() if isinstance(questions, dict) else enumerate(questions)
+    return related['indexVersion'], {int(i): snippets for i, snippets in items if snippets}
+
+def save_quiz_related_material(quiz_id: str, index_version: str, snippets: List[List[Dict]]):
+    """Store the related-material snippets of each question of a quiz"""
+    db.reference(f'{QUIZ_RELATED_MATERIAL_PATH}/{quiz_id}').set({
+        'indexVersion': index_version,
+        'questions': snippets
+    })
+
+def set_quiz_benchmark_times(quiz_id: str, benchmark_times: List[float]):
+    """Store a quiz's per-question benchmark times on its summary (skipped if the quiz is gone)"""
+    db.reference(f'{QUIZZES_PATH}/{quiz_id}').transaction(
+        lambda quiz: quiz if not isinstance(quiz, dict) else {**quiz, 'benchmarkTimes': benchmark_times}
+    )
+
+def iter_quizzes_without_benchmark_times(page_size: int = 100) -> Iterator[Tuple[str, Dict]]:
+    """Yield (quiz_id, summary) for every quiz that has no benchmarkTimes yet, a page at a time"""
+    for page in _iter_pages(QUIZZES_PATH, page_size):
+        for quiz_id, quiz in page.items():
+            if isinstance(quiz, dict) and not quiz.get('benchmarkTimes'):
+                yield quiz_id, quiz
+
+def migrate_quiz_storage(page_size: int = 100) -> int:
+    """
+    Bring quizzes stored before the split up to date: set gradeKey and
+    move inline questions to quiz_questions/. Safe to rerun
+
+    Args:
+        page_size: Quizzes read and migrated per round trip
+
+    Returns:
+        Number of quizzes migrated
+    """
+    migrated = 0
+    for page in _iter_pages(QUIZZES_PATH, page_size):
+        updates = {}
+        for quiz_id, quiz in page.items():
+            if not isinstance(quiz, dict):
+                continue
+            if 'questions' in quiz:
+                updates[f'{QUIZ_QUESTIONS_PATH}/{quiz_id}'] = quiz['questions']
+                updates[f'{QUIZZES_PATH}/{quiz_id}/questions'] = None
+            key = grade_key(quiz.get('targetGrade'))
+            if quiz.get('gradeKey') != key:
+                updates[f'{QUIZZES_PATH}/{quiz_id}/gradeKey'] = key
+            if 'questions' in quiz or quiz.get('gradeKey') != key:
+                migrated += 1
+        if updates:
+            db.reference().update(updates)
+        print(f"   🔁 Checked quizzes up to {next(reversed(page))} ({migrated} migrated)...")
+    return migrated
+
+# ============ Study Materials ============
+
+def get_material(material_id: str) -> Optional[Dict]:
+    """Get one material record, or None if it does not exist"""
+    material = db.reference(f'{STUDY_MATERIALS_PATH}/{material_id}').get()
+    return material if isinstance(material, dict) else None
+
+def material_exists(material_id: str) -> bool:
+    """Whether a material record exists (a shallow read, so its content is not downloaded)"""
+    return bool(db.reference(f'{STUDY_MATERIALS_PATH}/{material_id}').get(shallow=True))
+
+def get_material_file(material_id: str) -> Optional[str]:
+    """Get the base64 copy of a material's file kept outside the blob store, if any"""
+    return db.reference(f'{MATERIAL_FILES_PATH}/{material_id}').get()
+
+def save_material_file(material_id: str, file_content: bytes):
+    """Keep a base64 copy of a material's file under material_files"""
+    db.reference(f'{MATERIAL_FILES_PATH}/{material_id}').set(
+        base64.b64encode(file_content).decode('utf-8')
+    )
+
+def delete_material_file(material_id: str):
+    """Remove the base64 copy of a material's file, if it has one"""
+    db.reference(f'{MATERIAL_FILES_PATH}/{material_id}').delete()
+
+def content_in_use(content_key: str, exclude_id: Optional[str] = None) -> bool:
+    """Whether any material (other than `exclude_id`) references a blob"""
+    query = db.reference(STUDY_MATERIALS_PATH).order_by_child('contentKey').equal_to(content_key)
+    return any(material_id != exclude_id for material_id in (query.get() or {}))
+
+def migrate_material_blobs(blob_store, page_size: int = 20) -> int:
+    """
+    Copy base64 fileContent of material records into the blob store and
+    record contentKey/contentHash/fileSize. Each blob is read back and
+    checked before its record points at it. When the store is not durable
+    the base64 copy moves to material_files instead of being dropped, so a
+    container-local store never holds the only copy of a file; those
+    materials are reported as kept inline, not migrated. Safe to rerun
+
+    Args:
+        blob_store: BlobStore receiving the files
+        page_size: Material records read per round trip (they may be large)
+
+    Returns:
+        Number of materials migrated (whose inline fileContent was removed)
+    """
+    if not blob_store.durable:
+        print("⚠️  Blob store is not durable; inline files move to material_files and stay the primary copy")
+    migrated = 0
+    kept_inline = 0
+
+    def store_blob(material_id, encoded, updates):
+        """Write and verify one blob, adding the record fields pointing at it"""
+        file_content = base64.b64decode(encoded)
+        content_hash = blob_store.content_hash(file_content)
+        content_key = blob_store.put(file_content)
+        if blob_store.content_hash(blob_store.get(content_key)) != content_hash:
+            print(f"❌ Blob of material {material_id} did not read back intact, leaving it inline")
+            return False
+        updates[f'{STUDY_MATERIALS_PATH}/{material_id}/contentKey'] = content_key
+        updates[f'{STUDY_MATERIALS_PATH}/{material_id}/contentHash'] = content_hash
+        updates[f'{STUDY_MATERIALS_PATH}/{material_id}/fileSize'] = len(file_content)
+        return True
+
+    for page in _iter_pages(STUDY_MATERIALS_PATH, page_size):
+        updates = {}
+        for material_id, material in page.items():
+            if not isinstance(material, dict) or 'fileContent' not in material:
+                continue
+            if not store_blob(material_id, material['fileContent'], updates):
+                continue
+            updates[f'{STUDY_MATERIALS_PATH}/{material_id}/fileContent'] = None
+            if blob_store.durable:
+                migrated += 1
+            else:
+                updates[f'{MATERIAL_FILES_PATH}/{material_id}'] = material['fileContent']
+                kept_inline += 1
+        # Blobs are written and verified before the records point at them
+        if updates:
+            db.reference().update(updates)
+        print(f"   🔁 Migrated {migrated} materials ({kept_inline} still inline)...")
+
+    if blob_store.durable:
+        # Files set aside by earlier runs (or uploads) against a non-durable store
+        for page in _iter_pages(MATERIAL_FILES_PATH, page_size):
+            updates = {}
+            for material_id, encoded in page.items():
+                # Copies left behind by deleted materials are just dropped
+                if material_exists(material_id):
+                    if not store_blob(material_id, encoded, updates):
+                        continue
+                    migrated += 1
+                updates[f'{MATERIAL_FILES_PATH}/{material_id}'] = None
+            if updates:
+                db.reference().update(updates)
+            print(f"   🔁 Migrated {migrated} materials...")
+    elif kept_inline:
+        print(f"⚠️  {kept_inline} materials were not migrated: their files stay in {MATERIAL_FILES_PATH} "
+              f"until the command is rerun with a durable blob store (BLOB_STORE_DURABLE=true)")
+    return migrated
@@ -0,0 +1,137 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Dict
+import numpy as np
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of chunk embeddings keyed by content hash
+    Optionally backed by a local SQLite file so entries survive restarts
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 50000, db_path: Optional[str] = None,
+                 max_disk_entries: Optional[int] = None):
+        """
+        Args:
+            model_name: Embedding model name, part of every cache key
+            max_entries: Maximum number of embeddings kept in memory
+            db_path: Optional SQLite file used as a second, persistent tier
+            max_disk_entries: Maximum rows kept in SQLite (default 10x max_entries)
+        """
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries or max_entries * 10
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+            self._db.commit()
+            print(f"✅ Embedding cache backed by {db_path}")
+
+    def key(self, text: str) -> str:
+        """Cache key for a chunk: SHA-256 of the model name and the chunk text"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up embeddings for several texts
+
+        Args:
+            texts: Chunk texts
+
+        Returns:
+            One embedding per text, or None where the text is not cached
+        """
+        keys = [self.key(text) for text in texts]
+        found = [None] * len(texts)
+        missing = []
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[i] = vector
+                else:
+                    missing.append(i)
+
+            if missing and self._db is not None:
+                now = time.time()
+                for i in missing:
+                    row = self._db.execute('SELECT vector FROM embeddings WHERE key = ?', (keys[i],)).fetchone()
+                    if row:
+                        vector = np.frombuffer(row[0], dtype=np.float32)
+                        self._remember(keys[i], vector)
+                        self._db.execute('UPDATE embeddings SET last_used = ? WHERE key = ?', (now, keys[i]))
+                        found[i] = vector
+                        self.disk_hits += 1
+                self._db.commit()
+
+            hit_count = sum(1 for vector in found if vector is not None)
+            self.hits += hit_count
+            self.misses += len(texts) - hit_count
+
+        return found
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """
+        Store embeddings for several texts
+
+        Args:
+            texts: Chunk texts
+            vectors: Embeddings, one row per text
+        """
+        keys = [self.key(text) for text in texts]
+        vectors = [np.array(vector, dtype=np.float32) for vector in vectors]
+
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector)
+
+            if self._db is not None:
+                now = time.time()
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)',
+                    [(key, vector.tobytes(), now) for key, vector in zip(keys, vectors)]
+                )
+                # Trim the least recently used rows once the file outgrows its bound
+                self._db.execute(
+                    'DELETE FROM embeddings WHERE key IN ('
+                    'SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_disk_entries,)
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """Insert into the in-memory LRU, evicting the oldest entries (lock held)"""
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        """Get hit/miss counters and size of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'diskHits': self.disk_hits,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0,
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'persistent': self._db is not None
+            }
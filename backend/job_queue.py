@@ -0,0 +1,248 @@
+import json
+import queue
+import sqlite3
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+class JobQueue:
+    """
+    In-process job queue served by a bounded pool of worker threads
+    Each worker takes up to `batch_size` queued jobs at a time and hands
+    their payloads to the handler together. Failed jobs can be retried with
+    exponential backoff, and jobs can optionally be kept in a local SQLite
+    file so queued work survives a restart.
+    """
+
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    def __init__(self, name: str, handler: Callable[[List[Dict]], List], workers: int = 2,
+                 batch_size: int = 1, db_path: Optional[str] = None, max_finished: int = 1000,
+                 max_attempts: int = 1, retry_delay: float = 5.0,
+                 on_failed: Optional[Callable[[Dict, str], None]] = None, start: bool = True):
+        """
+        Args:
+            name: Queue name, used for thread names and log lines
+            handler: Called with a list of payloads; returns one result per
+                payload, or an Exception instance for payloads that failed
+            workers: Number of worker threads
+            batch_size: Max jobs handed to the handler in one call
+            db_path: Optional SQLite file for durable jobs
+            max_finished: Finished jobs kept in memory for status lookups
+            max_attempts: Times a job is run before it is marked failed
+            retry_delay: Seconds before the first retry, doubled for each further one
+            on_failed: Called with the payload and error of a job that failed
+                its last attempt
+            start: Start the workers now; pass False to accept (and recover)
+                jobs but only run them once start() is called
+        """
+        self.name = name
+        self.handler = handler
+        self.batch_size = max(1, batch_size)
+        self.max_finished = max_finished
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.on_failed = on_failed
+        self.workers = max(1, workers)
+        self._started = False
+        self._jobs = OrderedDict()
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL, '
+                'result TEXT, error TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL, '
+                'attempts INTEGER NOT NULL DEFAULT 0)'
+            )
+            columns = [row[1] for row in self._db.execute('PRAGMA table_info(jobs)')]
+            if 'attempts' not in columns:
+                # Queue files created before retries were supported
+                self._db.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+            self._db.commit()
+            self._recover()
+
+        if start:
+            self.start()
+
+    def start(self):
+        """Start the worker threads (no-op if they are running)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f'{self.name}-worker-{i}', daemon=True).start()
+
+    def _recover(self):
+        """Requeue jobs that were queued or running when the process stopped"""
+        rows = self._db.execute(
+            'SELECT id, payload, created_at, attempts FROM jobs WHERE status IN (?, ?) ORDER BY created_at',
+            self.ACTIVE_STATUSES
+        ).fetchall()
+        for job_id, payload, created_at, attempts in rows:
+            job = self._new_job(job_id, json.loads(payload), created_at)
+            job['attempts'] = attempts
+            self._jobs[job_id] = job
+            self._pending.put(job_id)
+        if rows:
+            print(f"🔁 {self.name}: recovered {len(rows)} unfinished jobs")
+
+    @staticmethod
+    def _new_job(job_id: str, payload: Dict, created_at: str) -> Dict:
+        return {
+            'id': job_id,
+            'status': 'queued',
+            'payload': payload,
+            'result': None,
+            'error': None,
+            'attempts': 0,
+            'createdAt': created_at,
+            'updatedAt': created_at
+        }
+
+    def submit(self, payload: Dict) -> str:
+        """
+        Queue a job
+
+        Args:
+            payload: JSON-serializable job input
+
+        Returns:
+            Job id
+        """
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow().isoformat()
+        job = self._new_job(job_id, payload, now)
+        with self._lock:
+            self._jobs[job_id] = job
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT INTO jobs (id, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                    (job_id, json.dumps(payload), 'queued', now, now)
+                )
+                self._db.commit()
+        self._pending.put(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Get the status of a job (without its payload)
+
+        Returns:
+            Job status dict, or None if the job is unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None and self._db is not None:
+                row = self._db.execute(
+                    'SELECT status, result, error, created_at, updated_at, attempts FROM jobs WHERE id = ?', (job_id,)
+                ).fetchone()
+                if row:
+                    return {
+                        'id': job_id,
+                        'status': row[0],
+                        'result': json.loads(row[1]) if row[1] else None,
+                        'error': row[2],
+                        'attempts': row[5],
+                        'createdAt': row[3],
+                        'updatedAt': row[4]
+                    }
+            if job is None:
+                return None
+            return {key: value for key, value in job.items() if key != 'payload'}
+
+    def _set_status(self, job_id: str, status: str, result=None, error: Optional[str] = None):
+        """Record a status change in memory and, if durable, in SQLite"""
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update({'status': status, 'result': result, 'error': error, 'updatedAt': now})
+            if status not in self.ACTIVE_STATUSES:
+                # Finished jobs no longer need their (possibly large) payload
+                job['payload'] = None
+                self._trim_finished()
+            if self._db is not None:
+                self._db.execute(
+                    'UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, attempts = ? WHERE id = ?',
+                    (status, json.dumps(result) if result is not None else None, error, now, job['attempts'], job_id)
+                )
+                if status not in self.ACTIVE_STATUSES:
+                    self._db.execute('UPDATE jobs SET payload = ? WHERE id = ?', ('null', job_id))
+                self._db.commit()
+
+    def _trim_finished(self):
+        """Forget the oldest finished jobs beyond `max_finished` (lock held)"""
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] not in self.ACTIVE_STATUSES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _next_batch(self) -> List[str]:
+        """Block for one job, then take whatever else is already queued up to batch_size"""
+        batch = [self._pending.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        """Worker thread loop"""
+        while True:
+            job_ids = self._next_batch()
+            with self._lock:
+                jobs = [self._jobs[job_id] for job_id in job_ids if job_id in self._jobs]
+                for job in jobs:
+                    job['attempts'] += 1
+            for job in jobs:
+                self._set_status(job['id'], 'running')
+
+            try:
+                results = self.handler([job['payload'] for job in jobs])
+            except Exception as e:
+                print(f"❌ {self.name} batch failed:\n{traceback.format_exc()}")
+                results = [e] * len(jobs)
+
+            for job, result in zip(jobs, results):
+                if not isinstance(result, Exception):
+                    self._set_status(job['id'], 'done', result=result)
+                elif job['attempts'] < self.max_attempts:
+                    self._retry_later(job, str(result))
+                else:
+                    self._fail(job, str(result))
+
+    def _retry_later(self, job: Dict, error: str):
+        """Put a failed job back in the queue after its backoff delay"""
+        delay = self.retry_delay * (2 ** (job['attempts'] - 1))
+        print(f"🔁 {self.name}: job {job['id']} failed (attempt {job['attempts']}/{self.max_attempts}), "
+              f"retrying in {delay:g}s: {error}")
+        self._set_status(job['id'], 'queued', error=error)
+        timer = threading.Timer(delay, self._pending.put, args=(job['id'],))
+        timer.daemon = True
+        timer.start()
+
+    def _fail(self, job: Dict, error: str):
+        """Mark a job failed for good, after telling the on_failed callback"""
+        if self.on_failed is not None:
+            try:
+                self.on_failed(job['payload'], error)
+            except Exception:
+                print(f"❌ {self.name} on_failed callback failed:\n{traceback.format_exc()}")
+        self._set_status(job['id'], 'failed', error=error)
+
+    def get_stats(self) -> Dict:
+        """Get job counts by status"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'pending': self._pending.qsize(), 'jobs': counts, 'durable': self._db is not None}
@@ -1,28 +1,539 @@
 from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Set, Optional, Tuple, NamedTuple, Iterable, Iterator
+import copy
 import json
+from collections import OrderedDict
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+from embedding_cache import EmbeddingCache
+from ann_index import IVFFlatIndex
+
+# Tombstone stamp for rows that have never been removed
+NOT_REMOVED = np.iinfo(np.int64).max
+
+class _IndexState(NamedTuple):
+    """
+    Immutable view of the index that readers search against
+    Writers never change anything a published state can see: rows past
+    `size` may be filled in, and rows are tombstoned with a generation
+    newer than `generation`, so a reader's view stays consistent.
+    """
+    matrix: np.ndarray
+    size: int
+    chunks: List[str]
+    metadata: List[Dict]
+    removed_at: np.ndarray
+    tombstones: int
+    generation: int
+    ann: Optional[IVFFlatIndex]
+    version: str
+    scales: Optional[np.ndarray]
+    full: Optional[np.ndarray]
+
+    def alive(self) -> np.ndarray:
+        """Mask of rows that are live in this state"""
+        return self.removed_at[:self.size] > self.generation
+
+def _dequantize(rows: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    """Stored rows as float32 (int8 rows are multiplied by their per-row scale)"""
+    rows = np.asarray(rows, dtype=np.float32)
+    return rows if scales is None else rows * scales[:, None]
 
 class SimpleRAG:
     """
     Simple RAG (Retrieval-Augmented Generation) system
     Uses sentence transformers for semantic search
+
+    Thread safety: searches never lock. Each reader works on the last
+    published _IndexState; writers are serialized by `_write_lock` and
+    publish a new state when they finish.
     """
+
+    # Bump whenever the on-disk snapshot layout changes
+    SNAPSHOT_VERSION = 2
+    # Each snapshot writes its own embeddings file, named after its id; the
+    # index file, replaced last and atomically, says which one it goes with
+    SNAPSHOT_EMBEDDINGS_PREFIX = 'embeddings-'
+    SNAPSHOT_INDEX_FILE = 'index.json.gz'
+    
+    INDEX_TYPES = ('flat', 'ivf')
+
+    # Storage precision of the embedding matrix: float16 halves it, int8
+    # (with one float32 scale per row) quarters it
+    STORAGE_DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+    # Quantized rows are scored in blocks so no float32 copy of the whole
+    # matrix is ever made
+    SCAN_BLOCK_ROWS = 16384
+    # Quantized scores may be this far below the exact ones, so shortlists
+    # keep candidates slightly under min_similarity until they are rescored
+    RESCORE_MARGIN = 0.05
+    # Float32 rows backing quantized storage live in a memory-mapped file
+    # under rescore_dir; it grows by at least this many rows at a time
+    FULL_STORE_MIN_ROWS = 1024
+    # The ANN index is retrained in the background (with a new bucket count)
+    # once the index holds this many times the rows it was trained on
+    ANN_RETRAIN_GROWTH = 4
     
-    def __init__(self):
-        """Initialize embedding model"""
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2', cache_size: int = 50000,
+                 cache_path: Optional[str] = None, index_type: str = 'flat',
+                 ann_nlist: Optional[int] = None, ann_nprobe: int = 8, compact_ratio: float = 0.25,
+                 query_cache_size: int = 2048, result_cache_size: int = 0,
+                 precision: str = 'float32', rescore_factor: int = 4,
+                 rescore_dir: Optional[str] = None):
+        """
+        Initialize embedding model
+
+        Args:
+            model_name: Sentence-transformers model used for all embeddings
+            cache_size: Max chunk embeddings kept in the content-hash cache (0 disables it)
+            cache_path: Optional SQLite file that persists the embedding cache
+            index_type: 'flat' for exact search, 'ivf' for approximate IVF-flat search
+            ann_nlist: IVF bucket count (default: sqrt of the chunk count)
+            ann_nprobe: IVF buckets scanned per query (recall/latency knob)
+            compact_ratio: Fraction of removed rows that triggers a compaction
+            query_cache_size: Max query embeddings kept in an LRU keyed by the
+                whitespace-normalized query (0 disables it)
+            result_cache_size: Max search results kept in an LRU keyed by query,
+                top_k, min_similarity and index version (0 disables it)
+            precision: Embedding storage, 'float32', 'float16' or 'int8'
+            rescore_factor: With quantized storage, top_k * rescore_factor
+                candidates are rescored with their float32 rows
+            rescore_dir: Directory of the disk-backed float32 rows kept for
+                rescoring quantized storage; required unless precision is
+                'float32'. It must be on a real disk: in an in-memory temp
+                dir (as on Cloud Run) these rows cost more than float32 storage
+        """
+        if index_type not in self.INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {self.INDEX_TYPES}")
+        if precision not in self.STORAGE_DTYPES:
+            raise ValueError(f"Unknown precision '{precision}', expected one of {tuple(self.STORAGE_DTYPES)}")
+        if precision != 'float32' and not rescore_dir:
+            raise ValueError(f"Precision '{precision}' needs an on-disk rescore_dir (RAG_RESCORE_DIR)")
         print("🔄 Loading RAG embedding model...")
         try:
             # Using a lightweight but effective model
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
-            self.chunks = []  # Store all text chunks
-            self.embeddings = []  # Store chunk embeddings
-            self.metadata = []  # Store metadata (doc names, IDs, etc.)
+            self.model_name = model_name
+            self.model = SentenceTransformer(model_name)
+            self.dim = self.model.get_sentence_embedding_dimension()
+            self.embedding_cache = EmbeddingCache(model_name, cache_size, cache_path) if cache_size > 0 else None
+            self.query_cache = EmbeddingCache(model_name, query_cache_size) if query_cache_size > 0 else None
+            self.result_cache_size = result_cache_size
+            self._result_cache = OrderedDict()
+            self._result_lock = threading.Lock()
+            self._result_hits = 0
+            self._result_misses = 0
+            self.index_type = index_type
+            self.precision = precision
+            self.rescore_factor = max(1, rescore_factor)
+            self.rescore_dir = rescore_dir
+            self.compact_ratio = compact_ratio
+            self._write_lock = threading.RLock()
+            self._compacting = False
+            self._retraining = False
+            self._snapshot_lock = threading.Lock()
+            self._changes = 0
+            # Bumped whenever row numbers change (compaction, reload, clear),
+            # so a background retrain started before then is discarded
+            self._layout_epoch = 0
+            # Optional ANN index; until it has enough rows to train, search stays exact
+            self.ann = IVFFlatIndex(self.dim, ann_nlist, ann_nprobe) if index_type == 'ivf' else None
+            self._reset_storage()
             print("✅ RAG system initialized successfully")
         except Exception as e:
             print(f"❌ RAG initialization error: {e}")
             raise
     
+    def _reset_storage(self):
+        """Empty the writer-side storage and publish it (write lock held or during init)"""
+        self.chunks = []  # Store all text chunks
+        self.metadata = []  # Store metadata (doc names, IDs, etc.)
+        # Chunk embeddings live in one preallocated, L2-normalized matrix of
+        # the storage precision; only the first `self._size` rows are in use.
+        # int8 rows keep a per-row scale in `self._scales`. Quantized storage
+        # also keeps every row in float32 in `self._full`, a memory-mapped
+        # temp file that is only paged in for rescoring and snapshots.
+        self._matrix = np.empty((0, self.dim), dtype=self.STORAGE_DTYPES[self.precision])
+        self._scales = np.empty(0, dtype=np.float32) if self.precision == 'int8' else None
+        self._full = self._new_full_store(0) if self.precision != 'float32' else None
+        self._size = 0
+        # Removed rows are tombstoned with the generation that removed them and
+        # skipped by search until compaction; `_doc_rows` maps each docId to
+        # its [start, end) rows
+        self._removed_at = np.empty(0, dtype=np.int64)
+        self._tombstones = 0
+        self._generation = 0
+        self._doc_rows: Dict[str, Tuple[int, int]] = {}
+        # Documents known to yield no chunks (e.g. scanned PDFs), kept in
+        # snapshots so they are not extracted again on every restart
+        self._skipped: Set[str] = set()
+        # Count of changes to what a snapshot holds; `_saved_changes` is
+        # its value as of the last snapshot saved or loaded
+        self._changes += 1
+        self._saved_changes = None
+        self._layout_epoch += 1
+        # Content version: the XOR of a digest of every indexed document, so
+        # it follows each add and remove, and instances (or restarts) holding
+        # the same documents agree on it
+        self._doc_digests: Dict[str, int] = {}
+        self._content_digest = 0
+        if self.ann is not None:
+            self.ann = copy.copy(self.ann)
+            self.ann.reset()
+        self._publish()
+
+    def _document_digest(self, doc_id: str, doc_name: str, chunks: List[str]) -> int:
+        """128-bit digest of one document's indexed content (its embeddings follow from the model)"""
+        digest = hashlib.sha256(f"{self.model_name}\0{doc_id}\0{doc_name}".encode('utf-8'))
+        for chunk in chunks:
+            digest.update(b'\0' + chunk.encode('utf-8'))
+        return int.from_bytes(digest.digest()[:16], 'big')
+
+    def _rebuild_doc_digests(self):
+        """Recompute the per-document digests from the stored chunks (write lock held)"""
+        self._doc_digests = {
+            doc_id: self._document_digest(doc_id, self.metadata[start]['docName'], self.chunks[start:end])
+            for doc_id, (start, end) in self._doc_rows.items()
+        }
+        self._content_digest = 0
+        for digest in self._doc_digests.values():
+            self._content_digest ^= digest
+
+    def _publish(self):
+        """Make the writer-side storage visible to readers (write lock held)"""
+        self._state = _IndexState(
+            matrix=self._matrix,
+            size=self._size,
+            chunks=self.chunks,
+            metadata=self.metadata,
+            removed_at=self._removed_at,
+            tombstones=self._tombstones,
+            generation=self._generation,
+            ann=self.ann,
+            version=f'{self._content_digest:032x}',
+            scales=self._scales,
+            full=self._full
+        )
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Normalized float32 embeddings of all stored rows, including tombstoned ones"""
+        state = self._state
+        return self._exact_rows(state, slice(0, state.size))
+
+    @property
+    def index_version(self) -> str:
+        """
+        Version of the indexed content; it changes whenever a document is
+        added or removed and is derived from the documents themselves, so it
+        survives restarts and is shared by instances indexing the same
+        documents. Results stored with it can be checked for staleness (read
+        it before searching)
+        """
+        return self._state.version
+
+    @property
+    def live_count(self) -> int:
+        """Number of chunks that are not tombstoned"""
+        state = self._state
+        return state.size - state.tombstones
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """L2-normalize rows as float32 (zero vectors are left as zeros)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Convert normalized float32 rows to the storage precision; returns (rows, per-row scales or None)"""
+        if self.precision == 'int8':
+            # Symmetric per-row scale: the largest component maps to +-127
+            scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.empty(0, dtype=np.float32)
+            scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+            return np.rint(vectors / scales[:, None]).astype(np.int8), scales
+        return np.asarray(vectors, dtype=self.STORAGE_DTYPES[self.precision]), None
+
+    @staticmethod
+    def _rows_float32(state: _IndexState, rows) -> np.ndarray:
+        """Stored rows of a published state (slice or index array) as float32"""
+        return _dequantize(state.matrix[rows], None if state.scales is None else state.scales[rows])
+
+    @staticmethod
+    def _exact_rows(state: _IndexState, rows) -> np.ndarray:
+        """Full-precision rows of a published state (slice or index array)"""
+        if state.full is not None:
+            return np.asarray(state.full[rows])
+        return np.asarray(state.matrix[rows], dtype=np.float32)
+
+    def _new_full_store(self, capacity: int) -> np.ndarray:
+        """Disk-backed float32 row matrix in an unlinked file under rescore_dir (freed with its last reference)"""
+        with tempfile.TemporaryFile(dir=self.rescore_dir) as f:
+            return np.memmap(f, dtype=np.float32, mode='w+', shape=(max(capacity, 1), self.dim))
+
+    def _copy_full_rows(self, store: np.ndarray, rows: np.ndarray):
+        """Fill the start of a new full-precision store with rows of the current one, a block at a time"""
+        for start in range(0, len(rows), self.SCAN_BLOCK_ROWS):
+            block = rows[start:start + self.SCAN_BLOCK_ROWS]
+            store[start:start + len(block)] = self._full[block]
+
+    def _append_embeddings(self, vectors):
+        """
+        Append normalized rows to the embedding matrix, growing its
+        capacity geometrically so appends are amortized O(1) per row
+        (write lock held; rows stay invisible to readers until _publish)
+
+        Args:
+            vectors: Row matrix, or a list of row batches copied in order
+        """
+        batches = vectors if isinstance(vectors, list) else [vectors]
+        needed = self._size + sum(len(batch) for batch in batches)
+        capacity = self._matrix.shape[0]
+        if needed > capacity:
+            new_capacity = max(needed, capacity * 2, 256)
+            grown = np.empty((new_capacity, self.dim), dtype=self.STORAGE_DTYPES[self.precision])
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+            if self._scales is not None:
+                scales = np.ones(new_capacity, dtype=np.float32)
+                scales[:self._size] = self._scales[:self._size]
+                self._scales = scales
+            removed_at = np.full(new_capacity, NOT_REMOVED, dtype=np.int64)
+            removed_at[:self._size] = self._removed_at[:self._size]
+            self._removed_at = removed_at
+        if self._full is not None and needed > len(self._full):
+            full = self._new_full_store(max(needed, len(self._full) * 2, self.FULL_STORE_MIN_ROWS))
+            self._copy_full_rows(full, np.arange(self._size))
+            self._full = full
+        row = self._size
+        for batch in batches:
+            rows, scales = self._quantize(batch)
+            self._matrix[row:row + len(rows)] = rows
+            if scales is not None:
+                self._scales[row:row + len(rows)] = scales
+            if self._full is not None:
+                self._full[row:row + len(rows)] = batch
+            row += len(rows)
+        self._removed_at[self._size:needed] = NOT_REMOVED
+        self._size = needed
+
+    def _encode_chunks(self, chunks: List[str]) -> np.ndarray:
+        """
+        Get normalized embeddings for chunks, encoding only those whose
+        content hash is not already in the embedding cache
+        """
+        if self.embedding_cache is None:
+            return self._normalize(self.model.encode(chunks, show_progress_bar=False))
+
+        cached = self.embedding_cache.get_many(chunks)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        embeddings = np.empty((len(chunks), self.dim), dtype=np.float32)
+
+        if missing:
+            fresh = self._normalize(self.model.encode([chunks[i] for i in missing], show_progress_bar=False))
+            embeddings[missing] = fresh
+            self.embedding_cache.put_many([chunks[i] for i in missing], fresh)
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                embeddings[i] = vector
+
+        if len(missing) < len(chunks):
+            print(f"   ♻️  Reused {len(chunks) - len(missing)} cached embeddings")
+        return embeddings
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Collapse whitespace (the tokenizer ignores it) so equivalent queries share cache entries"""
+        return ' '.join(query.split())
+
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Get normalized embeddings for normalized queries, encoding only those not in the query cache"""
+        if self.query_cache is None:
+            return self._normalize(self.model.encode(queries, show_progress_bar=False))
+
+        cached = self.query_cache.get_many(queries)
+        missing = list(dict.fromkeys(queries[i] for i, vector in enumerate(cached) if vector is None))
+        fresh = {}
+        if missing:
+            vectors = self._normalize(self.model.encode(missing, show_progress_bar=False))
+            self.query_cache.put_many(missing, vectors)
+            fresh = dict(zip(missing, vectors))
+        return np.stack([vector if vector is not None else fresh[query] for query, vector in zip(queries, cached)])
+
+    def _get_cached_results(self, key: Tuple) -> Optional[List[Dict]]:
+        """Look up a search result in the result cache (None on a miss or if disabled)"""
+        if not self.result_cache_size:
+            return None
+        with self._result_lock:
+            results = self._result_cache.get(key)
+            if results is None:
+                self._result_misses += 1
+                return None
+            self._result_cache.move_to_end(key)
+            self._result_hits += 1
+        # Callers get their own list and result dicts
+        return [dict(result) for result in results]
+
+    def _cache_results(self, key: Tuple, results: List[Dict]):
+        """Remember a search result, evicting the least recently used ones"""
+        if not self.result_cache_size:
+            return
+        with self._result_lock:
+            self._result_cache[key] = [dict(result) for result in results]
+            self._result_cache.move_to_end(key)
+            while len(self._result_cache) > self.result_cache_size:
+                self._result_cache.popitem(last=False)
+
+    def _index_new_rows(self, start: int):
+        """Add rows from `start` on to the ANN index, training it once it is large enough (write lock held)"""
+        if self.ann is None:
+            return
+        # The index is built from full-precision rows
+        rows = self._full if self._full is not None else self._matrix
+        if self.ann.is_trained:
+            # Buckets are only appended to; readers ignore rows past their size
+            self.ann.add(np.arange(start, self._size), rows[start:self._size])
+            if self._size >= self.ann.trained_rows * self.ANN_RETRAIN_GROWTH and not self._retraining:
+                self._retraining = True
+                threading.Thread(target=self._background_retrain, name='rag-ann-retrain', daemon=True).start()
+        elif self._size >= self.ann.min_train_rows:
+            # Train a private copy so readers never see a half-built index
+            ann = copy.copy(self.ann)
+            ann.train(rows[:self._size])
+            self.ann = ann
+
+    def _background_retrain(self):
+        """ANN retraining thread entry point"""
+        try:
+            self.retrain_ann()
+        except Exception as e:
+            print(f"⚠️  ANN retraining failed: {e}")
+        finally:
+            self._retraining = False
+
+    def retrain_ann(self):
+        """
+        Retrain the ANN index on all current rows, recomputing its bucket count
+        Training runs on a private copy without holding the write lock;
+        rows added meanwhile are then bucketed into it and the new index is
+        published atomically. If the rows were renumbered in the meantime
+        (compaction, reload, clear) the result is discarded
+        """
+        with self._write_lock:
+            if self.ann is None or not self.ann.is_trained:
+                return
+            state = self._state
+            layout_epoch = self._layout_epoch
+        rows = state.full if state.full is not None else state.matrix
+        ann = copy.copy(state.ann)
+        ann.reset()
+        ann.train(rows[:state.size])
+
+        with self._write_lock:
+            if self._layout_epoch != layout_epoch:
+                print("ℹ️  Discarding ANN retrain: the index was compacted or reloaded meanwhile")
+                return
+            rows = self._full if self._full is not None else self._matrix
+            ann.add(np.arange(state.size, self._size), rows[state.size:self._size])
+            self.ann = ann
+            self._publish()
+
+    def _search_embeddings(self, state: _IndexState, query_embeddings: np.ndarray, top_k: int,
+                           min_similarity: float) -> List[List[Dict]]:
+        """
+        Rank chunks of a published state for normalized query embeddings
+        Scans every chunk, or only the ANN candidates once the index is trained.
+        With quantized storage a larger shortlist is rescored in full precision
+
+        Returns:
+            One list of relevant chunks per query
+        """
+        if state.ann is not None and state.ann.is_trained:
+            results = []
+            for query_embedding, rows in zip(query_embeddings, state.ann.candidates(query_embeddings)):
+                rows = rows[rows < state.size]
+                if state.tombstones:
+                    rows = rows[state.removed_at[rows] > state.generation]
+                similarities = self._rows_float32(state, rows) @ query_embedding
+                results.append(self._rank(state, query_embedding, similarities, top_k, min_similarity, rows))
+            return results
+
+        # Cosine similarity with all chunks is a single matrix product
+        # because both sides are L2-normalized
+        if state.full is not None:
+            similarities = np.empty((len(query_embeddings), state.size), dtype=np.float32)
+            for start in range(0, state.size, self.SCAN_BLOCK_ROWS):
+                end = min(start + self.SCAN_BLOCK_ROWS, state.size)
+                similarities[:, start:end] = query_embeddings @ self._rows_float32(state, slice(start, end)).T
+        else:
+            similarities = query_embeddings @ state.matrix[:state.size].T
+        if state.tombstones:
+            similarities[:, ~state.alive()] = -np.inf
+        return [
+            self._rank(state, query_embedding, row, top_k, min_similarity)
+            for query_embedding, row in zip(query_embeddings, similarities)
+        ]
+
+    def _rank(self, state: _IndexState, query_embedding: np.ndarray, similarities: np.ndarray, top_k: int,
+              min_similarity: float, row_ids: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Top-k results for one query; with quantized storage a shortlist of
+        top_k * rescore_factor candidates is rescored with their float32 rows
+        """
+        if state.full is None:
+            return self._top_k(state, similarities, top_k, min_similarity, row_ids)
+
+        shortlist = self._top_indices(similarities, top_k * self.rescore_factor)
+        shortlist = shortlist[similarities[shortlist] >= min_similarity - self.RESCORE_MARGIN]
+        rows = shortlist if row_ids is None else row_ids[shortlist]
+        # Sorted rows keep the reads from the memory-mapped store sequential
+        rows = np.sort(rows)
+        return self._top_k(state, state.full[rows] @ query_embedding, top_k, min_similarity, rows)
+
+    @staticmethod
+    def _top_indices(similarities: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k largest similarities, best first"""
+        k = min(k, len(similarities))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < len(similarities):
+            top_indices = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            top_indices = np.arange(len(similarities))
+        return top_indices[np.argsort(-similarities[top_indices], kind='stable')]
+
+    def _top_k(self, state: _IndexState, similarities: np.ndarray, top_k: int, min_similarity: float,
+               row_ids: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Select the top-k entries of a similarity vector, best first
+
+        Args:
+            state: Published state the similarities were computed against
+            similarities: Similarity of the query to each candidate chunk
+            top_k: Number of results to return
+            min_similarity: Minimum similarity threshold (0-1)
+            row_ids: Chunk row of each candidate (default: candidate i is row i)
+
+        Returns:
+            List of relevant chunks with metadata
+        """
+        results = []
+        for idx in self._top_indices(similarities, top_k):
+            similarity = float(similarities[idx])
+            row = idx if row_ids is None else row_ids[idx]
+            if similarity >= min_similarity:
+                results.append({
+                    'content': state.chunks[row],
+                    'metadata': state.metadata[row],
+                    'similarity': similarity
+                })
+        return results
+
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
         """
         Split text into overlapping chunks for better context preservation
@@ -68,38 +579,160 @@ class SimpleRAG:
             doc_name: Human-readable document name
             text: Full text of the document
         """
-        if not text:
-            print(f"⚠️  Empty text for document: {doc_name}")
-            return
-        
-        print(f"📄 Processing document: {doc_name}")
-        
-        # Split into chunks
-        chunks = self.chunk_text(text)
-        
-        if not chunks:
-            print(f"⚠️  No chunks created for: {doc_name}")
-            return
-        
-        print(f"   📋 Split into {len(chunks)} chunks")
-        
-        # Generate embeddings for all chunks
-        print(f"   🔄 Generating embeddings...")
-        chunk_embeddings = self.model.encode(chunks, show_progress_bar=False)
+        self.add_documents([(doc_id, doc_name, text)])
+
+    def add_documents(self, documents: List[Tuple[str, str, str]]) -> Dict[str, int]:
+        """
+        Add several documents, embedding all their chunks in one model call
+
+        Args:
+            documents: (doc_id, doc_name, text) tuples
+
+        Returns:
+            Number of chunks added per doc_id
+        """
+        chunked = []
+        for doc_id, doc_name, text in documents:
+            if not text:
+                print(f"⚠️  Empty text for document: {doc_name}")
+                continue
+            
+            print(f"📄 Processing document: {doc_name}")
+            
+            # Split into chunks
+            chunks = self.chunk_text(text)
+            
+            if not chunks:
+                print(f"⚠️  No chunks created for: {doc_name}")
+                continue
+            
+            print(f"   📋 Split into {len(chunks)} chunks")
+            chunked.append((doc_id, doc_name, chunks))
+
+        if not chunked:
+            return {}
+
+        # Generate embeddings for all chunks (outside the write lock)
+        all_chunks = [chunk for _, _, chunks in chunked for chunk in chunks]
+        print(f"   🔄 Generating embeddings for {len(all_chunks)} chunks...")
+        all_embeddings = self._encode_chunks(all_chunks)
         
         # Store everything
-        for i, (chunk, embedding) in enumerate(zip(chunks, chunk_embeddings)):
+        added = {}
+        offset = 0
+        with self._write_lock:
+            for doc_id, doc_name, chunks in chunked:
+                self._store_document(doc_id, doc_name, chunks, all_embeddings[offset:offset + len(chunks)])
+                offset += len(chunks)
+                added[doc_id] = len(chunks)
+            self._publish()
+        
+        print(f"   ✅ Added {offset} chunks from {len(added)} documents to RAG (total: {self.live_count} chunks)")
+        return added
+    
+    def _store_document(self, doc_id: str, doc_name: str, chunks: List[str], embeddings):
+        """Append one document's chunks and embeddings (matrix or list of batches), replacing any previous version (write lock held)"""
+        # Re-adding a document replaces its previous chunks
+        if doc_id in self._doc_rows:
+            self._tombstone(doc_id)
+
+        start = self._size
+        self._append_embeddings(embeddings)
+        for i, chunk in enumerate(chunks):
             self.chunks.append(chunk)
-            self.embeddings.append(embedding)
             self.metadata.append({
                 'docId': doc_id,
                 'docName': doc_name,
                 'chunkIndex': i,
                 'totalChunks': len(chunks)
             })
-        
-        print(f"   ✅ Added {len(chunks)} chunks to RAG (total: {len(self.chunks)} chunks)")
-    
+        self._index_new_rows(start)
+        self._doc_rows[doc_id] = (start, self._size)
+        self._skipped.discard(doc_id)
+        digest = self._document_digest(doc_id, doc_name, chunks)
+        self._doc_digests[doc_id] = digest
+        self._content_digest ^= digest
+        self._changes += 1
+
+    def iter_chunks(self, pieces: Iterable[str], chunk_size: int = 1000, overlap: int = 200) -> Iterator[str]:
+        """
+        Streaming version of chunk_text
+        Yields exactly the chunks chunk_text would return for the
+        concatenation of `pieces`, while only buffering about one chunk
+
+        Args:
+            pieces: Consecutive pieces of the text (e.g. pages)
+            chunk_size: Size of each chunk in characters
+            overlap: Overlap between chunks
+
+        Yields:
+            Text chunks
+        """
+        step = chunk_size - overlap
+        buffer = ''
+        for piece in pieces:
+            buffer += piece
+            # A chunk is final once text exists past its end; a chunk that
+            # reaches the end of the buffer may still be the last one
+            start = 0
+            while len(buffer) - start > chunk_size:
+                chunk = buffer[start:start + chunk_size].strip()
+                if chunk:
+                    yield chunk
+                start += step
+            buffer = buffer[start:]
+
+        while buffer:
+            chunk = buffer[:chunk_size].strip()
+            if chunk:
+                yield chunk
+            if len(buffer) <= chunk_size:
+                break
+            buffer = buffer[step:]
+
+    def add_document_stream(self, doc_id: str, doc_name: str, pieces: Iterable[str],
+                            batch_size: int = 256) -> int:
+        """
+        Add a document from a stream of text pieces (e.g. pages)
+        Pages are chunked as they arrive and embedded in fixed-size batches,
+        so the full text and its chunk list are never held at once
+
+        Args:
+            doc_id: Unique document identifier
+            doc_name: Human-readable document name
+            pieces: Consecutive pieces of the document text
+            batch_size: Chunks embedded per model call
+
+        Returns:
+            Number of chunks added
+        """
+        print(f"📄 Streaming document: {doc_name}")
+        chunks = []
+        embedded = []
+        batch = []
+        for chunk in self.iter_chunks(pieces):
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                embedded.append(self._encode_chunks(batch))
+                chunks.extend(batch)
+                batch = []
+        if batch:
+            embedded.append(self._encode_chunks(batch))
+            chunks.extend(batch)
+
+        if not chunks:
+            print(f"⚠️  No chunks created for: {doc_name}")
+            return 0
+
+        # Rows are only published once the whole document is embedded, so
+        # readers never see a partial document and totalChunks is known
+        with self._write_lock:
+            self._store_document(doc_id, doc_name, chunks, embedded)
+            self._publish()
+
+        print(f"   ✅ Added {len(chunks)} chunks in {len(embedded)} batches to RAG (total: {self.live_count} chunks)")
+        return len(chunks)
+
     def search(self, query: str, top_k: int = 3, min_similarity: float = 0.3) -> List[Dict]:
         """
         Search for most relevant chunks using semantic similarity
@@ -112,7 +745,8 @@ class SimpleRAG:
         Returns:
             List of relevant chunks with metadata
         """
-        if not self.chunks:
+        state = self._state
+        if state.size == state.tombstones:
             print("⚠️  No documents in RAG system")
             return []
         
@@ -120,30 +754,19 @@ class SimpleRAG:
             print("⚠️  Empty query")
             return []
         
-        # Embed the query
-        query_embedding = self.model.encode([query], show_progress_bar=False)[0]
+        # Results are only reused while the indexed content is unchanged
+        query = self._normalize_query(query)
+        cache_key = (query, top_k, min_similarity, state.version)
+        results = self._get_cached_results(cache_key)
+        if results is not None:
+            return results
         
-        # Calculate cosine similarity with all chunks
-        similarities = []
-        for emb in self.embeddings:
-            # Cosine similarity
-            similarity = np.dot(query_embedding, emb) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(emb)
-            )
-            similarities.append(float(similarity))
-        
-        # Get top-k most similar chunks
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        # Embed the query
+        query_embedding = self._encode_queries([query])[0]
         
-        # Filter by minimum similarity
-        results = []
-        for idx in top_indices:
-            if similarities[idx] >= min_similarity:
-                results.append({
-                    'content': self.chunks[idx],
-                    'metadata': self.metadata[idx],
-                    'similarity': similarities[idx]
-                })
+        # Get top-k most similar chunks, filtered by minimum similarity
+        results = self._search_embeddings(state, query_embedding[None, :], top_k, min_similarity)[0]
+        self._cache_results(cache_key, results)
         
         if results:
             print(f"🔍 Found {len(results)} relevant chunks (best similarity: {results[0]['similarity']:.3f})")
@@ -151,44 +774,399 @@ class SimpleRAG:
             print(f"⚠️  No chunks above similarity threshold {min_similarity}")
         
         return results
-    
+
+    def search_many(self, queries: List[str], top_k: int = 3, min_similarity: float = 0.3) -> List[List[Dict]]:
+        """
+        Search for several queries at once
+        All queries are embedded in one model call and scored against the
+        index with a single matrix-matrix product
+
+        Args:
+            queries: Search queries
+            top_k: Number of results to return per query
+            min_similarity: Minimum similarity threshold (0-1)
+
+        Returns:
+            One list of relevant chunks per query, in the order of `queries`
+        """
+        results = [[] for _ in queries]
+        state = self._state
+        if state.size == state.tombstones:
+            print("⚠️  No documents in RAG system")
+            return results
+
+        # Empty queries get no results, cached ones are reused and the rest
+        # are embedded together
+        normalized = [self._normalize_query(query) if query else '' for query in queries]
+        positions = []
+        for i, query in enumerate(normalized):
+            if query:
+                cached = self._get_cached_results((query, top_k, min_similarity, state.version))
+                if cached is None:
+                    positions.append(i)
+                else:
+                    results[i] = cached
+
+        if positions:
+            query_embeddings = self._encode_queries([normalized[i] for i in positions])
+            for i, query_results in zip(positions, self._search_embeddings(state, query_embeddings, top_k, min_similarity)):
+                results[i] = query_results
+                self._cache_results((normalized[i], top_k, min_similarity, state.version), query_results)
+
+        found = sum(1 for r in results if r)
+        print(f"🔍 Batched search: {found}/{len(queries)} queries matched relevant chunks")
+
+        return results
+
     def remove_document(self, doc_id: str):
         """
         Remove all chunks from a specific document
+        The rows are tombstoned via the docId -> row range index; storage is
+        reclaimed in the background once tombstones exceed `compact_ratio`
+        of all rows
         
         Args:
             doc_id: Document ID to remove
         """
-        indices_to_remove = []
-        
-        # Find all indices for this document
-        for i, meta in enumerate(self.metadata):
-            if meta['docId'] == doc_id:
-                indices_to_remove.append(i)
-        
-        # Remove in reverse order to maintain indices
-        for idx in sorted(indices_to_remove, reverse=True):
-            del self.chunks[idx]
-            del self.embeddings[idx]
-            del self.metadata[idx]
+        with self._write_lock:
+            removed = self._tombstone(doc_id)
+            if doc_id in self._skipped:
+                self._skipped.discard(doc_id)
+                self._changes += 1
+            self._publish()
+            needs_compaction = self._tombstones > self.compact_ratio * self._size and not self._compacting
+            if needs_compaction:
+                self._compacting = True
+
+        print(f"🗑️  Removed {removed} chunks for document: {doc_id}")
+
+        if needs_compaction:
+            threading.Thread(target=self._background_compact, name='rag-compaction', daemon=True).start()
+
+    def _tombstone(self, doc_id: str) -> int:
+        """Mark a document's rows removed as of a new generation (write lock held)"""
+        rows = self._doc_rows.pop(doc_id, None)
+        if rows is None:
+            return 0
+        start, end = rows
+        self._generation += 1
+        self._removed_at[start:end] = self._generation
+        self._tombstones += end - start
+        self._content_digest ^= self._doc_digests.pop(doc_id)
+        self._changes += 1
+        return end - start
         
-        print(f"🗑️  Removed {len(indices_to_remove)} chunks for document: {doc_id}")
+    def _background_compact(self):
+        """Compaction thread entry point"""
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"⚠️  RAG compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """Drop tombstoned rows, rebuilding the matrix and the docId index"""
+        with self._write_lock:
+            if not self._tombstones:
+                return
+            keep = self._removed_at[:self._size] == NOT_REMOVED
+            removed = self._tombstones
+            # Build fresh containers; readers keep using the ones they hold
+            self._matrix = self._matrix[:self._size][keep]
+            if self._scales is not None:
+                self._scales = self._scales[:self._size][keep]
+            if self._full is not None:
+                full = self._new_full_store(len(self._matrix))
+                self._copy_full_rows(full, np.flatnonzero(keep))
+                self._full = full
+            self._size = len(self._matrix)
+            self._removed_at = np.full(self._size, NOT_REMOVED, dtype=np.int64)
+            self._tombstones = 0
+            self.chunks = [chunk for chunk, alive in zip(self.chunks, keep) if alive]
+            self.metadata = [meta for meta, alive in zip(self.metadata, keep) if alive]
+            if self.ann is not None:
+                self.ann = copy.copy(self.ann)
+                self.ann.remap(keep)
+            self._rebuild_doc_rows()
+            self._layout_epoch += 1
+            self._publish()
+        print(f"🧹 Compacted RAG index: dropped {removed} removed chunks ({self._size} remain)")
+
+    def _rebuild_doc_rows(self):
+        """Recompute the docId -> row range index from the metadata (write lock held)"""
+        self._doc_rows = {}
+        for row, meta in enumerate(self.metadata):
+            start, _ = self._doc_rows.get(meta['docId'], (row, row))
+            self._doc_rows[meta['docId']] = (start, row + 1)
     
+    def document_ids(self) -> Set[str]:
+        """Get the IDs of all indexed documents"""
+        with self._write_lock:
+            return set(self._doc_rows)
+
+    def mark_skipped(self, doc_id: str):
+        """
+        Record that a document yields no chunks, so callers can tell it
+        apart from one that was never indexed (remembered in snapshots)
+
+        Args:
+            doc_id: Document ID
+        """
+        with self._write_lock:
+            if doc_id not in self._skipped and doc_id not in self._doc_rows:
+                self._skipped.add(doc_id)
+                self._changes += 1
+
+    def skipped_ids(self) -> Set[str]:
+        """Get the IDs of documents recorded as yielding no chunks"""
+        with self._write_lock:
+            return set(self._skipped)
+
+    @property
+    def has_unsaved_changes(self) -> bool:
+        """Whether documents were added, removed or skipped since the last snapshot saved or loaded"""
+        return self._changes != self._saved_changes
+
+    def save_snapshot(self, directory: str):
+        """
+        Persist the index to disk so it can be reloaded without re-embedding
+        Embeddings go to a .npy file named after a new snapshot id, chunk
+        text, metadata and skipped documents to a gzipped JSON index that
+        records that id. The index is replaced atomically after the
+        embeddings are complete, so a reader always finds a matching pair;
+        embeddings files of older snapshots are deleted afterwards
+
+        Args:
+            directory: Snapshot directory (created if missing)
+        """
+        with self._snapshot_lock:
+            os.makedirs(directory, exist_ok=True)
+            self.compact()
+            index_path = os.path.join(directory, self.SNAPSHOT_INDEX_FILE)
+            snapshot_id = uuid.uuid4().hex
+            embeddings_file = f'{self.SNAPSHOT_EMBEDDINGS_PREFIX}{snapshot_id}.npy'
+            embeddings_path = os.path.join(directory, embeddings_file)
+
+            # Work from one published state so the two files agree even if
+            # writers run meanwhile (rows tombstoned since then are kept)
+            with self._write_lock:
+                state = self._state
+                skipped = sorted(self._skipped)
+                changes = self._changes
+            alive = state.removed_at[:state.size] == NOT_REMOVED if state.tombstones else None
+            rows = np.arange(state.size) if alive is None else np.flatnonzero(alive)
+            chunks = state.chunks[:state.size]
+            metadata = state.metadata[:state.size]
+            if alive is not None:
+                chunks = [chunk for chunk, keep in zip(chunks, alive) if keep]
+                metadata = [meta for meta, keep in zip(metadata, alive) if keep]
+
+            # Snapshots always hold the float32 rows, whatever the storage
+            # precision, so they can be loaded at any precision; rows are
+            # written in blocks
+            if len(rows):
+                matrix = np.lib.format.open_memmap(
+                    embeddings_path + '.tmp', mode='w+', dtype=np.float32, shape=(len(rows), self.dim)
+                )
+                for start in range(0, len(rows), self.SCAN_BLOCK_ROWS):
+                    block = rows[start:start + self.SCAN_BLOCK_ROWS]
+                    matrix[start:start + len(block)] = self._exact_rows(state, block)
+                matrix.flush()
+                del matrix
+            else:
+                with open(embeddings_path + '.tmp', 'wb') as f:
+                    np.save(f, np.empty((0, self.dim), dtype=np.float32))
+            os.replace(embeddings_path + '.tmp', embeddings_path)
+
+            with gzip.open(index_path + '.tmp', 'wt', encoding='utf-8') as f:
+                json.dump({
+                    'version': self.SNAPSHOT_VERSION,
+                    'snapshotId': snapshot_id,
+                    'embeddingsFile': embeddings_file,
+                    'model': self.model_name,
+                    'dim': self.dim,
+                    'rows': len(rows),
+                    'chunks': chunks,
+                    'metadata': metadata,
+                    'skipped': skipped
+                }, f, separators=(',', ':'))
+            os.replace(index_path + '.tmp', index_path)
+            self._saved_changes = changes
+
+            for name in os.listdir(directory):
+                # Also drops leftovers of interrupted saves and the old
+                # single embeddings.npy layout
+                if (name.startswith(self.SNAPSHOT_EMBEDDINGS_PREFIX) and name != embeddings_file) or name == 'embeddings.npy':
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError:
+                        pass
+        print(f"💾 RAG snapshot saved: {len(rows)} chunks -> {directory}")
+
+    def save_snapshot_if_changed(self, directory: str) -> bool:
+        """
+        Save a snapshot unless nothing changed since the last one
+
+        Returns:
+            True if a snapshot was written
+        """
+        if not self.has_unsaved_changes:
+            return False
+        self.save_snapshot(directory)
+        return True
+
+    def load_snapshot(self, directory: str) -> bool:
+        """
+        Replace the index with a snapshot written by save_snapshot
+        Embeddings are memory-mapped read-only, so loading does not copy them;
+        the first add_document moves them into a growable in-memory matrix.
+        With quantized storage they are converted block by block instead
+
+        Args:
+            directory: Snapshot directory
+
+        Returns:
+            True if the snapshot was loaded, False if missing or incompatible
+        """
+        index_path = os.path.join(directory, self.SNAPSHOT_INDEX_FILE)
+        if not os.path.exists(index_path):
+            print(f"ℹ️  No RAG snapshot found in {directory}")
+            return False
+
+        try:
+            with gzip.open(index_path, 'rt', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') != self.SNAPSHOT_VERSION or index.get('model') != self.model_name:
+                print(f"⚠️  Ignoring RAG snapshot (version {index.get('version')}, model {index.get('model')})")
+                return False
+
+            # The embeddings file is named after the snapshot id, so it can
+            # only belong to this index
+            embeddings_file = index['embeddingsFile']
+            if embeddings_file != f"{self.SNAPSHOT_EMBEDDINGS_PREFIX}{index['snapshotId']}.npy":
+                print(f"⚠️  Ignoring inconsistent RAG snapshot in {directory}")
+                return False
+            matrix = np.load(os.path.join(directory, embeddings_file), mmap_mode='r')
+            rows = index['rows']
+            if matrix.shape != (rows, self.dim) or len(index['chunks']) != rows or len(index['metadata']) != rows:
+                print(f"⚠️  Ignoring inconsistent RAG snapshot in {directory}")
+                return False
+        except Exception as e:
+            print(f"⚠️  Could not read RAG snapshot: {e}")
+            return False
+
+        scales = None
+        full = None
+        if self.precision != 'float32':
+            stored = np.empty((rows, self.dim), dtype=self.STORAGE_DTYPES[self.precision])
+            scales = np.empty(rows, dtype=np.float32) if self.precision == 'int8' else None
+            full = self._new_full_store(rows)
+            for start in range(0, rows, self.SCAN_BLOCK_ROWS):
+                exact = np.asarray(matrix[start:start + self.SCAN_BLOCK_ROWS], dtype=np.float32)
+                block, block_scales = self._quantize(exact)
+                stored[start:start + len(block)] = block
+                full[start:start + len(block)] = exact
+                if scales is not None:
+                    scales[start:start + len(block)] = block_scales
+            matrix = stored
+
+        with self._write_lock:
+            self._matrix = matrix
+            self._scales = scales
+            self._full = full
+            self._size = rows
+            self._removed_at = np.full(rows, NOT_REMOVED, dtype=np.int64)
+            self._tombstones = 0
+            self.chunks = index['chunks']
+            self.metadata = index['metadata']
+            self._rebuild_doc_rows()
+            self._skipped = set(index.get('skipped', [])) - set(self._doc_rows)
+            self._changes += 1
+            self._saved_changes = self._changes
+            self._layout_epoch += 1
+            self._rebuild_doc_digests()
+            if self.ann is not None:
+                self.ann = copy.copy(self.ann)
+                self.ann.reset()
+                self._index_new_rows(0)
+            self._publish()
+        print(f"📂 RAG snapshot loaded: {rows} chunks from {len(self.document_ids())} documents")
+        return True
+
     def clear(self):
         """Clear all stored data"""
-        self.chunks = []
-        self.embeddings = []
-        self.metadata = []
+        with self._write_lock:
+            self._reset_storage()
         print("🧹 RAG system cleared")
     
+    def _storage_stats(self, state: _IndexState) -> Dict:
+        """
+        Bytes held for embeddings: the searched matrix (plus int8 scales),
+        the disk-backed float32 rows of quantized storage, and the float32
+        vectors in the in-memory embedding cache
+        """
+        matrix_bytes = state.matrix.nbytes + (state.scales.nbytes if state.scales is not None else 0)
+        full_bytes = state.full.nbytes if state.full is not None else 0
+        cache_bytes = 0
+        if self.embedding_cache is not None:
+            cache_bytes = self.embedding_cache.get_stats()['entries'] * self.dim * 4
+        return {
+            'precision': self.precision,
+            'bytesPerChunk': state.matrix.itemsize * self.dim + (4 if state.scales is not None else 0),
+            'matrixBytes': int(matrix_bytes),
+            'fullPrecisionBytes': int(full_bytes),
+            'embeddingCacheBytes': int(cache_bytes),
+            'allocatedBytes': int(matrix_bytes + full_bytes + cache_bytes)
+        }
+
     def get_stats(self) -> Dict:
         """Get statistics about the RAG system"""
-        unique_docs = len(set(meta['docId'] for meta in self.metadata))
-        return {
-            'totalChunks': len(self.chunks),
-            'uniqueDocuments': unique_docs,
-            'averageChunkLength': sum(len(c) for c in self.chunks) / len(self.chunks) if self.chunks else 0
+        state = self._state
+        live_chunks = state.size - state.tombstones
+        alive = state.alive() if state.tombstones else np.ones(state.size, dtype=bool)
+        live_length = sum(len(chunk) for chunk, keep in zip(state.chunks[:state.size], alive) if keep)
+        stats = {
+            'totalChunks': live_chunks,
+            'uniqueDocuments': len(self._doc_rows),
+            'averageChunkLength': live_length / live_chunks if live_chunks else 0,
+            'indexType': self.index_type,
+            'removedChunks': state.tombstones,
+            'indexVersion': state.version,
+            'storage': self._storage_stats(state)
         }
+        if state.ann is not None:
+            stats['ann'] = {
+                'trained': state.ann.is_trained,
+                'buckets': state.ann.num_buckets,
+                'trainedRows': state.ann.trained_rows,
+                'nprobe': state.ann.nprobe
+            }
+        if self.embedding_cache is not None:
+            stats['embeddingCache'] = self.embedding_cache.get_stats()
+        if self.query_cache is not None:
+            stats['queryCache'] = self.query_cache.get_stats()
+        if self.result_cache_size:
+            with self._result_lock:
+                lookups = self._result_hits + self._result_misses
+                stats['resultCache'] = {
+                    'hits': self._result_hits,
+                    'misses': self._result_misses,
+                    'hitRate': round(self._result_hits / lookups, 4) if lookups else 0,
+                    'entries': len(self._result_cache),
+                    'maxEntries': self.result_cache_size
+                }
+        return stats
 
 # Global RAG instance
-rag_system = SimpleRAG()
\ No newline at end of file
+rag_system = SimpleRAG(
+    cache_size=int(os.getenv('EMBEDDING_CACHE_SIZE', '50000')),
+    cache_path=os.getenv('EMBEDDING_CACHE_PATH') or None,
+    index_type=os.getenv('RAG_INDEX_TYPE', 'flat'),
+    ann_nprobe=int(os.getenv('RAG_ANN_NPROBE', '8')),
+    query_cache_size=int(os.getenv('RAG_QUERY_CACHE_SIZE', '2048')),
+    result_cache_size=int(os.getenv('RAG_RESULT_CACHE_SIZE', '0')),
+    precision=os.getenv('RAG_STORAGE_PRECISION', 'float32'),
+    rescore_factor=int(os.getenv('RAG_RESCORE_FACTOR', '4')),
+    rescore_dir=os.getenv('RAG_RESCORE_DIR') or None
+)
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+# Tests import the backend modules directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class StubSentenceTransformer:
+    """
+    Stand-in for the embedding model so tests run without
+    sentence-transformers or model downloads: texts registered in `vectors`
+    embed to their vector, any other text to a pseudo-random one derived
+    from its hash
+    """
+
+    dim = 384
+    vectors = {}
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, show_progress_bar=False, **kwargs):
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            vector = self.vectors.get(text)
+            if vector is None:
+                seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+                vector = np.random.default_rng(seed).standard_normal(self.dim)
+            out[i] = vector
+        return out
+
+# Installed before simple_rag is imported, which builds its global instance
+sys.modules['sentence_transformers'] = types.SimpleNamespace(SentenceTransformer=StubSentenceTransformer)
+
+@pytest.fixture
+def embed():
+    """Register fixed embeddings for texts; forgotten again after the test"""
+    yield StubSentenceTransformer.vectors.update
+    StubSentenceTransformer.vectors.clear()
+
+def clustered_vectors(count, clusters=100, noise=0.6, seed=0, dim=StubSentenceTransformer.dim):
+    """L2-normalized vectors scattered around random cluster centres"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, count)] + noise * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_pdf(page_texts):
+    """Minimal PDF with one line of text per page (PyPDF2 can read it back)"""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for text in page_texts:
+        stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>')
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    out += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('latin-1')
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    return out
@@ -0,0 +1,174 @@
+import copy
+import itertools
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('firebase_admin')
+import data_access
+
+class FakeReference:
+    def __init__(self, database, path):
+        self.database = database
+        self.path = path
+        self.key = path.rsplit('/', 1)[-1]
+
+    def get(self, shallow=False):
+        return self.database.read(self.path)
+
+    def push(self):
+        return FakeReference(self.database, f'{self.path}/-id{next(self.database.ids)}')
+
+    def update(self, values):
+        with self.database.lock:
+            for path, value in values.items():
+                self.database.write(f'{self.path}/{path}', value)
+
+    def delete(self):
+        with self.database.lock:
+            self.database.write(self.path, None)
+
+    def transaction(self, update):
+        with self.database.lock:
+            value = update(copy.deepcopy(self.database.lookup(self.path)))
+            self.database.write(self.path, value)
+            return value
+
+    def order_by_child(self, field):
+        return FakeQuery(self, field)
+
+class FakeQuery:
+    def __init__(self, reference, field):
+        self.reference = reference
+        self.field = field
+
+    def equal_to(self, value):
+        self.value = value
+        return self
+
+    def get(self):
+        children = self.reference.get() or {}
+        return {key: child for key, child in children.items() if child.get(self.field) == self.value}
+
+class FakeDatabase:
+    """In-memory stand-in for firebase_admin.db that counts reads and adds latency to each"""
+
+    def __init__(self, tree, latency=0.01):
+        self.tree = tree
+        self.latency = latency
+        self.reads = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.RLock()
+        self.ids = itertools.count()
+
+    def reference(self, path=''):
+        return FakeReference(self, path)
+
+    def lookup(self, path):
+        node = self.tree
+        for key in filter(None, path.split('/')):
+            node = node.get(key) if isinstance(node, dict) else None
+        return node
+
+    def write(self, path, value):
+        *parents, key = filter(None, path.split('/'))
+        node = self.tree
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        if value is None:
+            node.pop(key, None)
+        else:
+            node[key] = copy.deepcopy(value)
+
+    def read(self, path):
+        with self.lock:
+            self.reads += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+            return copy.deepcopy(self.lookup(path))
+
+@pytest.fixture
+def progress_db(monkeypatch):
+    progress = {f'a{i}': {'onlineResources': [0], 'analysisViewed': i % 2 == 0} for i in range(0, 200, 2)}
+    database = FakeDatabase({data_access.RESOURCE_PROGRESS_PATH: progress})
+    monkeypatch.setattr(data_access, 'db', database)
+    return database, progress
+
+def test_small_progress_sets_are_read_concurrently(progress_db):
+    database, progress = progress_db
+    attempt_ids = [f'a{i}' for i in range(40)]
+    loaded = data_access.get_resource_progress_many(attempt_ids + attempt_ids[:5])
+    assert loaded == {attempt_id: progress[attempt_id] for attempt_id in attempt_ids if attempt_id in progress}
+    # One read per distinct attempt, overlapping rather than sequential
+    assert database.reads == 40
+    assert database.max_in_flight > 1
+
+def test_large_progress_sets_use_one_tree_read(progress_db, monkeypatch):
+    database, progress = progress_db
+    monkeypatch.setattr(data_access, 'PROGRESS_TREE_READ_MIN', 50)
+    attempt_ids = [f'a{i}' for i in range(150)]
+    loaded = data_access.get_resource_progress_many(attempt_ids)
+    assert loaded == {attempt_id: progress[attempt_id] for attempt_id in attempt_ids if attempt_id in progress}
+    assert database.reads == 1
+
+def test_quiz_attempts_are_read_concurrently(monkeypatch):
+    index = {f'q{i}': {f'q{i}-a{j}': {'quizId': f'q{i}', 'percentage': j} for j in range(3)} for i in range(20)}
+    database = FakeDatabase({data_access.ATTEMPTS_BY_QUIZ_PATH: index})
+    monkeypatch.setattr(data_access, 'db', database)
+    attempts = data_access.get_quiz_attempts([f'q{i}' for i in range(25)])
+    assert attempts == {attempt_id: summary for quiz in index.values() for attempt_id, summary in quiz.items()}
+    assert database.reads == 25 and database.max_in_flight > 1
+
+def test_rollup_build_counts_attempts_saved_during_it(monkeypatch):
+    database = FakeDatabase({data_access.QUIZZES_PATH: {'q1': {'teacherId': 't1'}}}, latency=0)
+    monkeypatch.setattr(data_access, 'db', database)
+
+    def attempt(score):
+        return {'studentId': 's1', 'quizId': 'q1', 'teacherId': 't1', 'score': score, 'totalQuestions': 10,
+                'percentage': score * 10.0, 'completedAt': '2025-03-01T10:00:00'}
+
+    data_access.save_quiz_attempt(attempt(5))
+    # Saved before the build reads the index, recorded after it stored the rollup
+    early = attempt(6)
+    early_id = data_access.save_quiz_attempt(early)
+
+    read_index = data_access.get_quiz_attempts
+
+    def read_then_submit(quiz_ids):
+        attempts = read_index(quiz_ids)
+        # Saved after the build's read, recorded before its store (rollup not built yet)
+        late = attempt(7)
+        data_access.record_teacher_rollup(data_access.save_quiz_attempt(late), late)
+        return attempts
+
+    monkeypatch.setattr(data_access, 'get_quiz_attempts', read_then_submit)
+    rollup = data_access.get_or_build_teacher_rollup('t1')
+    assert rollup['totals']['attemptCount'] == 3
+    assert data_access.record_teacher_rollup(early_id, early)
+
+    monkeypatch.setattr(data_access, 'get_quiz_attempts', read_index)
+    stored = data_access.get_teacher_rollup('t1')
+    assert stored['totals'] == data_access.build_teacher_rollup('t1')['totals'] == {
+        'attemptCount': 3, 'percentageSum': 180.0
+    }
+    assert not stored.get('pending')
+
+def test_deleting_a_quiz_drops_its_attempts_from_the_rollup(monkeypatch):
+    quizzes = {'q1': {'teacherId': 't1'}, 'q2': {'teacherId': 't1'}}
+    database = FakeDatabase({data_access.QUIZZES_PATH: quizzes}, latency=0)
+    monkeypatch.setattr(data_access, 'db', database)
+    for quiz_id, score in (('q1', 4), ('q2', 8)):
+        data_access.save_quiz_attempt({'studentId': 's1', 'quizId': quiz_id, 'teacherId': 't1', 'score': score,
+                                       'totalQuestions': 10, 'percentage': score * 10.0})
+    assert data_access.get_or_build_teacher_rollup('t1')['totals']['attemptCount'] == 2
+
+    data_access.delete_quiz('q2')
+    data_access.remove_quiz_from_rollup('t1', 'q2')
+    rollup = data_access.get_or_build_teacher_rollup('t1')
+    assert rollup['quizCount'] == 1
+    assert rollup['totals'] == {'attemptCount': 1, 'percentageSum': 40.0}
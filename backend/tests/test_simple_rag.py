@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from conftest import clustered_vectors
+from simple_rag import SimpleRAG
+
+def add_vectors(rag, embed, vectors, prefix='chunk'):
+    """Index one single-chunk document per vector; returns the chunk texts"""
+    texts = [f'{prefix} {i}' for i in range(len(vectors))]
+    embed(dict(zip(texts, vectors)))
+    for start in range(0, len(texts), 5000):
+        rag.add_documents([(text, text, text) for text in texts[start:start + 5000]])
+    return texts
+
+def recall_at_k(rag, embed, vectors, queries, k=5):
+    """Share of the exact top-k neighbours (by float32 dot product) that a search returns"""
+    query_texts = [f'query {i}' for i in range(len(queries))]
+    embed(dict(zip(query_texts, queries)))
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    found = 0
+    for expected, results in zip(truth, rag.search_many(query_texts, top_k=k, min_similarity=-1.0)):
+        found += len({int(r['content'].split()[1]) for r in results} & set(expected.tolist()))
+    return found / truth.size
+
+@pytest.fixture(scope='module')
+def dataset():
+    vectors = clustered_vectors(12000)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(0, len(vectors), 100)] + 0.8 * rng.standard_normal((100, vectors.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+    return vectors, queries
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+@pytest.mark.parametrize('cache_size', [0, 100])
+def test_quantized_storage_rescoring_recall(embed, dataset, precision, cache_size, tmp_path):
+    # Rescoring must not depend on the embedding cache holding every vector
+    vectors, queries = dataset
+    rag = SimpleRAG(cache_size=cache_size, query_cache_size=0, precision=precision, rescore_dir=str(tmp_path))
+    add_vectors(rag, embed, vectors)
+    assert recall_at_k(rag, embed, vectors, queries) >= 0.99
+
+    storage = rag.get_stats()['storage']
+    assert storage['bytesPerChunk'] == {'float16': 2 * rag.dim, 'int8': rag.dim + 4}[precision]
+    assert storage['fullPrecisionBytes'] >= len(vectors) * rag.dim * 4
+    assert storage['allocatedBytes'] == (
+        storage['matrixBytes'] + storage['fullPrecisionBytes'] + storage['embeddingCacheBytes']
+    )
+
+def test_int8_without_rescoring_loses_recall(embed, dataset, tmp_path):
+    vectors, queries = dataset
+    exact = SimpleRAG(cache_size=0, query_cache_size=0)
+    add_vectors(exact, embed, vectors)
+    quantized = SimpleRAG(cache_size=0, query_cache_size=0, precision='int8', rescore_factor=1,
+                          rescore_dir=str(tmp_path))
+    add_vectors(quantized, embed, vectors)
+    assert recall_at_k(exact, embed, vectors, queries) == 1.0
+    assert recall_at_k(quantized, embed, vectors, queries) < 1.0
+
+def test_quantized_snapshot_keeps_exact_rows(embed, tmp_path):
+    vectors = clustered_vectors(600)
+    rag = SimpleRAG(cache_size=0, query_cache_size=0, precision='int8', rescore_dir=str(tmp_path))
+    texts = add_vectors(rag, embed, vectors)
+    rag.remove_document(texts[0])
+    rag.save_snapshot(str(tmp_path))
+
+    for precision in ('float32', 'int8'):
+        loaded = SimpleRAG(cache_size=0, query_cache_size=0, precision=precision, rescore_dir=str(tmp_path))
+        assert loaded.load_snapshot(str(tmp_path))
+        # int8 rows alone would be off by up to ~1e-2
+        np.testing.assert_allclose(loaded.embeddings, vectors[1:], atol=1e-6)
+
+def test_quantized_storage_needs_rescore_dir(embed):
+    # Without one the float32 rows would land in the system temp dir, which
+    # may be memory
+    with pytest.raises(ValueError):
+        SimpleRAG(cache_size=0, query_cache_size=0, precision='int8')
+
+def test_search_matches_brute_force(embed):
+    vectors = clustered_vectors(3000, seed=4)
+    rag = SimpleRAG(cache_size=0, query_cache_size=0)
+    texts = add_vectors(rag, embed, vectors)
+    for text in texts[::7]:
+        rag.remove_document(text)
+    alive = np.array([i % 7 != 0 for i in range(len(texts))])
+
+    queries = clustered_vectors(20, seed=5)
+    embed({f'query {i}': query for i, query in enumerate(queries)})
+    for query, results in zip(queries, rag.search_many([f'query {i}' for i in range(20)], top_k=5, min_similarity=-1.0)):
+        # Per-chunk cosine similarity, as the original search loop computed it
+        scores = np.array([vector @ query / (np.linalg.norm(vector) * np.linalg.norm(query)) for vector in vectors])
+        scores[~alive] = -np.inf
+        expected = np.argsort(-scores, kind='stable')[:5]
+        assert [result['content'] for result in results] == [texts[i] for i in expected]
+        np.testing.assert_allclose([result['similarity'] for result in results], scores[expected], atol=1e-5)
+
+def test_concurrent_writes_and_searches(embed):
+    # Uploads, deletes and searches on one index, as gunicorn threads do
+    vectors = clustered_vectors(3000, seed=6)
+    texts = [f'doc {i}' for i in range(len(vectors))]
+    embed(dict(zip(texts, vectors)))
+    queries = clustered_vectors(50, seed=7)
+    embed({f'query {i}': query for i, query in enumerate(queries)})
+    rag = SimpleRAG(cache_size=0, query_cache_size=0, compact_ratio=0.1)
+    errors = []
+    removed = set()
+    writers_done = threading.Event()
+
+    def guarded(work):
+        def run():
+            try:
+                work()
+            except Exception as e:
+                errors.append(e)
+        return threading.Thread(target=run)
+
+    def write(offset):
+        for start in range(offset * 25, len(texts), 50):
+            rag.add_documents([(text, text, text) for text in texts[start:start + 25]])
+
+    def delete():
+        while not writers_done.is_set():
+            for doc_id in sorted(rag.document_ids()):
+                if int(doc_id.split()[1]) % 3 == 0 and doc_id not in removed:
+                    rag.remove_document(doc_id)
+                    removed.add(doc_id)
+            time.sleep(0.001)
+
+    def search():
+        rng = np.random.default_rng(threading.get_ident() % 2 ** 32)
+        while not writers_done.is_set():
+            picks = rng.integers(0, len(queries), 4)
+            for pick, results in zip(picks, rag.search_many([f'query {i}' for i in picks], top_k=5, min_similarity=-1.0)):
+                similarities = [result['similarity'] for result in results]
+                assert similarities == sorted(similarities, reverse=True)
+                for result in results:
+                    # Chunk text, metadata and embedding row must belong together
+                    assert result['metadata']['docId'] == result['content']
+                    expected = vectors[int(result['content'].split()[1])] @ queries[pick]
+                    assert abs(result['similarity'] - expected) < 1e-4
+
+    writers = [guarded(lambda offset=offset: write(offset)) for offset in range(2)]
+    others = [guarded(delete)] + [guarded(search) for _ in range(4)]
+    for thread in writers + others:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    writers_done.set()
+    for thread in others:
+        thread.join()
+    assert not errors
+
+    for doc_id in sorted(rag.document_ids()):
+        if int(doc_id.split()[1]) % 3 == 0:
+            rag.remove_document(doc_id)
+            removed.add(doc_id)
+    expected_ids = set(texts) - removed
+    assert rag.document_ids() == expected_ids
+    assert rag.live_count == len(expected_ids)
+    embed({f'removed {i}': vectors[i] for i in range(0, len(vectors), 3)})
+    for results in rag.search_many([f'removed {i}' for i in range(0, 300, 3)], top_k=3, min_similarity=-1.0):
+        assert not {result['content'] for result in results} & removed
+
+def test_ivf_retrains_after_growth(embed):
+    # Train on one distribution, then grow 4x with another one: buckets
+    # learned from the first 4096 rows would split the new rows badly
+    first = clustered_vectors(4096, seed=0)
+    later = clustered_vectors(3 * 4096, seed=2)
+    vectors = np.vstack([first, later])
+    rng = np.random.default_rng(1)
+    queries = later[rng.integers(0, len(later), 100)] + 0.3 * rng.standard_normal((100, later.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    rag = SimpleRAG(cache_size=0, query_cache_size=0, index_type='ivf')
+    add_vectors(rag, embed, vectors)
+    deadline = time.monotonic() + 60
+    while rag.get_stats()['ann']['trainedRows'] < len(vectors) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    ann = rag.get_stats()['ann']
+    assert ann['trainedRows'] == len(vectors)
+    assert ann['buckets'] == 128
+    # Stale 64-bucket centroids give ~0.3 here
+    assert recall_at_k(rag, embed, vectors, queries) >= 0.85
+
+def test_snapshot_round_trip_keeps_skipped_documents(embed, tmp_path):
+    vectors = clustered_vectors(50)
+    rag = SimpleRAG(cache_size=0, query_cache_size=0)
+    texts = add_vectors(rag, embed, vectors)
+    rag.mark_skipped('scanned.pdf')
+    assert rag.has_unsaved_changes
+    rag.save_snapshot(str(tmp_path))
+    assert not rag.has_unsaved_changes and not rag.save_snapshot_if_changed(str(tmp_path))
+
+    rag.remove_document(texts[0])
+    assert rag.save_snapshot_if_changed(str(tmp_path))
+    # Only the embeddings file named by the current index is kept
+    assert len([name for name in os.listdir(tmp_path) if name.startswith('embeddings-')]) == 1
+
+    loaded = SimpleRAG(cache_size=0, query_cache_size=0)
+    assert loaded.load_snapshot(str(tmp_path))
+    assert loaded.document_ids() == set(texts[1:])
+    assert loaded.skipped_ids() == {'scanned.pdf'}
+    assert not loaded.has_unsaved_changes
+    loaded.remove_document('scanned.pdf')
+    assert loaded.skipped_ids() == set() and loaded.has_unsaved_changes
+
+def test_snapshot_without_its_embeddings_is_ignored(embed, tmp_path):
+    rag = SimpleRAG(cache_size=0, query_cache_size=0)
+    add_vectors(rag, embed, clustered_vectors(10))
+    rag.save_snapshot(str(tmp_path))
+    for name in os.listdir(tmp_path):
+        if name.startswith('embeddings-'):
+            os.remove(tmp_path / name)
+    assert not SimpleRAG(cache_size=0, query_cache_size=0).load_snapshot(str(tmp_path))
+
+def test_index_version_follows_content(embed, tmp_path):
+    vectors = clustered_vectors(40)
+    rag = SimpleRAG(cache_size=0, query_cache_size=0)
+    texts = add_vectors(rag, embed, vectors)
+    version = rag.index_version
+
+    rag.remove_document(texts[0])
+    assert rag.index_version != version
+    rag.add_documents([(texts[0], texts[0], texts[0])])
+    assert rag.index_version == version
+
+    # Another instance (or a restart) with the same documents agrees,
+    # whatever order they were added in
+    other = SimpleRAG(cache_size=0, query_cache_size=0)
+    other.add_documents([(text, text, text) for text in reversed(texts)])
+    assert other.index_version == version
+    restarted = SimpleRAG(cache_size=0, query_cache_size=0)
+    rag.save_snapshot(str(tmp_path))
+    assert restarted.load_snapshot(str(tmp_path)) and restarted.index_version == version
@@ -0,0 +1,106 @@
+import io
+import os
+import signal
+import time
+
+import docx
+import pytest
+
+from conftest import make_pdf
+import text_extraction
+from text_extraction import ExtractionEngine, extract_text_from_file
+
+def make_docx(paragraphs):
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+@pytest.fixture
+def engine():
+    engine = ExtractionEngine(workers=2, timeout=30, pages_per_task=10)
+    yield engine
+    if engine._pool is not None:
+        engine._discard_pool(engine._pool)
+
+@pytest.fixture(scope='module')
+def corpus():
+    files = [(f'doc{i}.pdf', make_pdf([f'Document {i} page {page}' for page in range(5 + 7 * i)])) for i in range(6)]
+    files.append(('notes.docx', make_docx(['First paragraph', 'Second paragraph'])))
+    files.append(('image.png', b'not a document'))
+    return files
+
+def test_parallel_extraction_matches_serial(engine, corpus):
+    serial = {name: extract_text_from_file(name, content) for name, content in corpus}
+    assert serial['doc5.pdf'].startswith('Document 5 page 0\nDocument 5 page 1\n')
+
+    assert engine.extract_many([(name, name, content) for name, content in corpus]) == serial
+    assert engine.extract('doc3.pdf', dict(corpus)['doc3.pdf']) == serial['doc3.pdf']
+
+def test_iter_text_streams_pages_in_order(engine, corpus, tmp_path):
+    name, content = corpus[-3]
+    expected = extract_text_from_file(name, content)
+    parts = list(engine.iter_text(name, content))
+    assert len(parts) == 4 and ''.join(parts) == expected
+
+    path = tmp_path / name
+    path.write_bytes(content)
+    assert ''.join(engine.iter_text(name, str(path))) == expected
+
+    with pytest.raises(RuntimeError):
+        list(engine.iter_text('broken.pdf', b'not a pdf'))
+
+def test_pool_recovers_from_killed_workers(engine, corpus):
+    name, content = corpus[0]
+    expected = extract_text_from_file(name, content)
+    assert engine.extract(name, content) == expected
+
+    for process in list(engine._pool._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+    time.sleep(0.5)
+    assert engine.extract(name, content) == expected
+
+def test_timeout_terminates_stuck_worker(engine, corpus):
+    name, content = corpus[0]
+    expected = extract_text_from_file(name, content)
+    assert engine.extract(name, content) == expected
+    pool = engine._pool
+    workers = list(pool._processes.values())
+
+    submit = engine._submit_to
+    engine._submit_to = lambda pool, file_name, source: [pool.submit(time.sleep, 60)]
+    engine.timeout = 1
+    assert engine.extract(name, content) is None
+    # Cancelling the future alone would leave a worker sleeping
+    time.sleep(0.5)
+    assert workers and not any(process.is_alive() for process in workers)
+
+    engine._submit_to = submit
+    engine.timeout = 30
+    assert engine.extract(name, content) == expected
+    assert engine._pool is not pool
+
+def test_timeout_does_not_fail_other_files(engine, corpus):
+    files = [(name, name, content) for name, content in corpus]
+    expected = {name: extract_text_from_file(name, content) for name, content in corpus}
+
+    # The stuck file occupies both workers, so every other file is still
+    # queued in the pool when its timeout replaces the pool
+    submit = engine._submit_to
+    engine._submit_to = lambda pool, file_name, source: (
+        [pool.submit(time.sleep, 60) for _ in range(engine.workers)] if file_name == 'stuck.pdf'
+        else submit(pool, file_name, source)
+    )
+    engine.timeout = 2
+    texts = engine.extract_many([('stuck.pdf', 'stuck.pdf', b'')] + files)
+    assert texts.pop('stuck.pdf') is None
+    assert texts == expected
+
+def test_single_cpu_extracts_inline(corpus, monkeypatch):
+    monkeypatch.setattr(text_extraction, 'available_cpus', lambda: 1)
+    engine = ExtractionEngine()
+    name, content = corpus[0]
+    assert engine.extract(name, content) == extract_text_from_file(name, content)
+    assert engine._pool is None
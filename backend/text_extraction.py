@@ -0,0 +1,404 @@
+import io as io_module
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import PyPDF2
+import docx
+
+def extract_text_from_pdf(file_content):
+    """Extract text from PDF file content"""
+    try:
+        pdf_reader = PyPDF2.PdfReader(io_module.BytesIO(file_content))
+        return "".join(page.extract_text() + "\n" for page in pdf_reader.pages)
+    except Exception as e:
+        print(f"Error extracting PDF: {e}")
+        return None
+
+def extract_text_from_docx(file_content):
+    """Extract text from DOCX file content"""
+    try:
+        doc = docx.Document(io_module.BytesIO(file_content))
+        return "\n".join(para.text for para in doc.paragraphs)
+    except Exception as e:
+        print(f"Error extracting DOCX: {e}")
+        return None
+
+def file_extension(file_name):
+    """Lower-case extension of a file name, or '' if it has none"""
+    return file_name.rsplit('.', 1)[1].lower() if '.' in file_name else ''
+
+def extract_text_from_file(file_name, file_content):
+    """Extract text from a PDF or DOCX file based on its extension"""
+    file_ext = file_extension(file_name)
+    if file_ext == 'pdf':
+        return extract_text_from_pdf(file_content)
+    elif file_ext in ['docx', 'doc']:
+        return extract_text_from_docx(file_content)
+    return ""
+
+def iter_pdf_pages(file_content):
+    """Yield the text of a PDF one page at a time (same text as extract_text_from_pdf)"""
+    pdf_reader = PyPDF2.PdfReader(io_module.BytesIO(file_content))
+    for page in pdf_reader.pages:
+        yield page.extract_text() + "\n"
+
+def iter_docx_paragraphs(file_content):
+    """Yield the text of a DOCX one paragraph at a time (same text as extract_text_from_docx)"""
+    doc = docx.Document(io_module.BytesIO(file_content))
+    for i, para in enumerate(doc.paragraphs):
+        yield para.text if i == 0 else "\n" + para.text
+
+def iter_text_from_file(file_name, file_content):
+    """Stream text from a PDF or DOCX file based on its extension"""
+    file_ext = file_extension(file_name)
+    if file_ext == 'pdf':
+        return iter_pdf_pages(file_content)
+    elif file_ext in ['docx', 'doc']:
+        return iter_docx_paragraphs(file_content)
+    return iter(())
+
+def read_source(source: Union[str, bytes]) -> bytes:
+    """Bytes of a file given as a filesystem path or as raw bytes"""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    return source
+
+def _open_pdf(source: Union[str, bytes]) -> PyPDF2.PdfReader:
+    # A path is opened by the reader itself, so workers never receive the bytes
+    return PyPDF2.PdfReader(source if isinstance(source, str) else io_module.BytesIO(source))
+
+def count_pdf_pages(source):
+    """Number of pages of a PDF given as a path or bytes, or None if it cannot be read (runs in a worker process)"""
+    try:
+        return len(_open_pdf(source).pages)
+    except Exception as e:
+        print(f"Error extracting PDF: {e}")
+        return None
+
+def extract_pdf_page_range(source, start, end):
+    """Extract text from pages [start, end) of a PDF given as a path or bytes (runs in a worker process)"""
+    try:
+        pdf_reader = _open_pdf(source)
+        return "".join(pdf_reader.pages[i].extract_text() + "\n" for i in range(start, end))
+    except Exception as e:
+        print(f"Error extracting PDF pages {start}-{end}: {e}")
+        return None
+
+def _cgroup_cpu_limit() -> Optional[int]:
+    """CPUs allowed by a cgroup CPU quota (v2 or v1), or None if there is none"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                quota = f.read().strip()
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+    if quota in ('max', '-1'):
+        return None
+    return max(1, math.ceil(int(quota) / int(period)))
+
+def available_cpus() -> int:
+    """
+    CPUs this process can actually use: its affinity mask, capped by a
+    container CPU quota (os.cpu_count() reports the host's CPUs)
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    return min(cpus, limit) if limit else cpus
+
+class ExtractionEngine:
+    """
+    Text extraction backed by a process pool
+    PDF/DOCX parsing is pure-Python and holds the GIL, so it runs in worker
+    processes. Large PDFs are split into page ranges across workers and
+    many materials can be extracted at once. With one worker (the default
+    on a single CPU, where a pool only adds overhead) everything runs
+    inline.
+    A pool whose workers died is replaced and its files resubmitted once.
+    After a timeout the pool is replaced too, terminating its workers: a
+    running task cannot be cancelled, and would otherwise keep a worker
+    busy. Other files whose tasks were cancelled or broken with the
+    replaced pool are resubmitted once to the new one.
+    """
+
+    def __init__(self, workers: Optional[int] = None, timeout: float = 120, pages_per_task: int = 25):
+        """
+        Args:
+            workers: Worker processes (default: available_cpus(); 1 runs inline)
+            timeout: Seconds to wait for one document before giving up on it
+            pages_per_task: PDF pages handed to a worker per task
+        """
+        self.workers = workers or available_cpus()
+        self.timeout = timeout
+        self.pages_per_task = pages_per_task
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Spawned (not forked) workers: the parent runs torch and request
+        # threads, which are not safe to fork
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        """Stop using a broken or stuck pool and terminate its workers"""
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        # shutdown() forgets the worker processes, so collect them first
+        processes = list((getattr(pool, '_processes', None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def _submit_to(self, pool, file_name, source) -> list:
+        # A PDF starts with its page count; parsing it here would hold this
+        # process's GIL, so it is a worker task like the page ranges
+        if file_extension(file_name) == 'pdf':
+            return [pool.submit(count_pdf_pages, source)]
+        return [pool.submit(extract_text_from_file, file_name, read_source(source))]
+
+    def _submit_task(self, fn, *args):
+        """Submit one task; returns (pool, future), replacing the pool once if it is unusable"""
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                return pool, pool.submit(fn, *args)
+            except RuntimeError as e:
+                print(f"⚠️  Extraction pool unavailable ({e}), starting a new one")
+                self._discard_pool(pool)
+        raise BrokenProcessPool("Extraction pool could not be restarted")
+
+    def _wait(self, file_name, pool, future):
+        """Result of one task within the engine timeout; a timed-out task's pool is replaced"""
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self._discard_pool(pool)
+            raise RuntimeError(f"Text extraction timed out after {self.timeout}s: {file_name}")
+
+    def _submit(self, file_name, file_content) -> Tuple[Optional[ProcessPoolExecutor], list]:
+        """Submit the first tasks of one file (see _submit_to); returns the pool and its futures"""
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                return pool, self._submit_to(pool, file_name, file_content)
+            except RuntimeError as e:
+                # Broken, or shut down by another thread after a timeout
+                print(f"⚠️  Extraction pool unavailable ({e}), starting a new one")
+                self._discard_pool(pool)
+        return None, []
+
+    def _submit_pages(self, file_name, file_content, submitted, retry: bool = True) -> Tuple[Optional[ProcessPoolExecutor], list]:
+        """Swap a PDF's page-count future for its page range futures, submitted to the same pool"""
+        pool, futures = submitted
+        if not futures or file_extension(file_name) != 'pdf':
+            return submitted
+        try:
+            page_count = futures[0].result(timeout=self.timeout)
+            if page_count is None:
+                return pool, []
+            return pool, [
+                pool.submit(extract_pdf_page_range, file_content, start, min(start + self.pages_per_task, page_count))
+                for start in range(0, page_count, self.pages_per_task)
+            ]
+        except FutureTimeoutError:
+            print(f"⚠️  Text extraction timed out after {self.timeout}s: {file_name}")
+            self._discard_pool(pool)
+            return None, []
+        except (BrokenProcessPool, CancelledError, RuntimeError) as e:
+            # The pool died, or another file's timeout replaced it
+            self._discard_pool(pool)
+            if retry:
+                print(f"⚠️  Extraction pool broke, retrying {file_name}")
+                return self._submit_pages(file_name, file_content, self._submit(file_name, file_content), retry=False)
+            print(f"⚠️  Text extraction failed for {file_name}: {e}")
+            return None, []
+        except Exception as e:
+            print(f"⚠️  Text extraction failed for {file_name}: {e}")
+            return None, []
+
+    def _collect(self, file_name, file_content, submitted, retry: bool = True) -> Optional[str]:
+        """Join the results of one file's futures, honouring the per-document timeout"""
+        pool, futures = submitted
+        if not futures:
+            return None
+        deadline = time.monotonic() + self.timeout
+        parts = []
+        try:
+            for future in futures:
+                part = future.result(timeout=max(0, deadline - time.monotonic()))
+                if part is None:
+                    return None
+                parts.append(part)
+        except FutureTimeoutError:
+            print(f"⚠️  Text extraction timed out after {self.timeout}s: {file_name}")
+            self._discard_pool(pool)
+            return None
+        except (BrokenProcessPool, CancelledError) as e:
+            # The pool died, or another file's timeout replaced it
+            self._discard_pool(pool)
+            if retry:
+                print(f"⚠️  Extraction pool broke, retrying {file_name}")
+                resubmitted = self._submit_pages(file_name, file_content, self._submit(file_name, file_content), retry=False)
+                return self._collect(file_name, file_content, resubmitted, retry=False)
+            print(f"⚠️  Text extraction failed for {file_name}: {e}")
+            return None
+        except Exception as e:
+            print(f"⚠️  Text extraction failed for {file_name}: {e}")
+            return None
+        return "".join(parts)
+
+    def extract(self, file_name, file_content) -> Optional[str]:
+        """
+        Extract text from one PDF or DOCX file
+
+        Args:
+            file_name: File name (extension selects the parser)
+            file_content: Raw file bytes, or the path of the file
+
+        Returns:
+            Extracted text, '' for unsupported types, None on failure or timeout
+        """
+        if self.workers <= 1:
+            return extract_text_from_file(file_name, read_source(file_content))
+        if file_extension(file_name) not in ['pdf', 'docx', 'doc']:
+            return ""
+        submitted = self._submit_pages(file_name, file_content, self._submit(file_name, file_content))
+        return self._collect(file_name, file_content, submitted)
+
+    def extract_many(self, files: List[Tuple[str, str, bytes]]) -> Dict[str, Optional[str]]:
+        """
+        Extract text from many files concurrently
+
+        Args:
+            files: (key, file_name, file_content) tuples; file_content may
+                also be the path of the file
+
+        Returns:
+            Extracted text per key (None where extraction failed)
+        """
+        if self.workers <= 1:
+            return {key: extract_text_from_file(file_name, read_source(content)) for key, file_name, content in files}
+
+        submitted = []
+        texts = {}
+        for key, file_name, content in files:
+            if file_extension(file_name) not in ['pdf', 'docx', 'doc']:
+                texts[key] = ""
+            else:
+                submitted.append((key, file_name, content, self._submit(file_name, content)))
+        # All page counts are queued before the first PDF's page ranges
+        submitted = [
+            (key, file_name, content, self._submit_pages(file_name, content, pending))
+            for key, file_name, content, pending in submitted
+        ]
+        for key, file_name, content, pending in submitted:
+            texts[key] = self._collect(file_name, content, pending)
+        return texts
+
+    def iter_text(self, file_name, source, window: Optional[int] = None) -> Iterator[str]:
+        """
+        Stream the text of a large file out of the pool in document order
+        PDF page ranges are extracted in parallel, with at most `window`
+        ranges in flight so finished text never piles up, and yielded as
+        soon as all earlier ranges are done. Workers open the file by path;
+        bytes are spilled to a temp file once instead of being sent with
+        every task. Each task gets the engine timeout
+
+        Args:
+            file_name: File name (extension selects the parser)
+            source: Path of the file, or its raw bytes
+            window: Page ranges in flight (default: twice the worker count)
+
+        Yields:
+            Consecutive pieces of the document text
+
+        Raises:
+            RuntimeError: If extraction fails or times out part way, so a
+                caller never indexes part of a document
+        """
+        if self.workers <= 1:
+            yield from iter_text_from_file(file_name, read_source(source))
+            return
+        if file_extension(file_name) != 'pdf':
+            text = self.extract(file_name, source)
+            if text is None:
+                raise RuntimeError(f"Text extraction failed for {file_name}")
+            if text:
+                yield text
+            return
+
+        temp_path = None
+        if not isinstance(source, str):
+            fd, temp_path = tempfile.mkstemp(suffix='.pdf')
+            with os.fdopen(fd, 'wb') as temp:
+                temp.write(source)
+            source = temp_path
+        pending = deque()
+        try:
+            page_count = None
+            for attempt in range(2):
+                pool, future = self._submit_task(count_pdf_pages, source)
+                try:
+                    page_count = self._wait(file_name, pool, future)
+                    break
+                except (BrokenProcessPool, CancelledError):
+                    self._discard_pool(pool)
+                    if attempt:
+                        raise
+            if page_count is None:
+                raise RuntimeError(f"Could not read PDF {file_name}")
+
+            ranges = deque(
+                (start, min(start + self.pages_per_task, page_count))
+                for start in range(0, page_count, self.pages_per_task)
+            )
+            window = window or 2 * self.workers
+            retried = False
+            while ranges or pending:
+                while ranges and len(pending) < window:
+                    pages = ranges.popleft()
+                    pending.append((pages, *self._submit_task(extract_pdf_page_range, source, *pages)))
+                pages, pool, future = pending[0]
+                try:
+                    part = self._wait(file_name, pool, future)
+                except (BrokenProcessPool, CancelledError):
+                    self._discard_pool(pool)
+                    if retried:
+                        raise
+                    retried = True
+                    print(f"⚠️  Extraction pool broke, retrying {file_name}")
+                    ranges.extendleft(reversed([pages for pages, _, _ in pending]))
+                    pending.clear()
+                    continue
+                if part is None:
+                    raise RuntimeError(f"Text extraction failed for {file_name} pages {pages[0]}-{pages[1]}")
+                pending.popleft()
+                yield part
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+            if temp_path:
+                os.unlink(temp_path)
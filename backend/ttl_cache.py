@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+class TTLCache:
+    """
+    Thread-safe in-process cache with a time-to-live and LRU eviction
+    Entries expire `ttl` seconds after they are set; once `max_entries` is
+    reached the least recently used entry is dropped. Values can optionally
+    be kept in a local JSON file so the cache survives a restart.
+    """
+
+    def __init__(self, name: str, max_entries: int = 256, ttl: float = 3600, path: Optional[str] = None):
+        """
+        Args:
+            name: Cache name, used for log lines
+            max_entries: Max entries kept before evicting the least recently used
+            ttl: Seconds an entry stays valid
+            path: Optional JSON file the entries are persisted to
+                (values must then be JSON-serializable)
+        """
+        self.name = name
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        if path:
+            self._load()
+
+    def _load(self):
+        """Load unexpired entries from the persistence file"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"⚠️  {self.name}: could not load {self.path}: {e}")
+            return
+        now = time.time()
+        for key, (expires_at, value) in stored.items():
+            if expires_at > now:
+                self._entries[key] = (expires_at, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if self._entries:
+            print(f"🔁 {self.name}: loaded {len(self._entries)} cached entries")
+
+    def _save(self):
+        """Write all entries to the persistence file (lock held)"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as tmp:
+                json.dump({key: list(entry) for key, entry in self._entries.items()}, tmp)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            os.unlink(tmp_path)
+            print(f"⚠️  {self.name}: could not save {self.path}: {e}")
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a cached value
+
+        Returns:
+            The value, or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any):
+        """Cache a value, evicting the least recently used entry if full"""
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path:
+                self._save()
+
+    def delete(self, key: str):
+        """Drop a cached value if present"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None and self.path:
+                self._save()
+
+    def get_stats(self) -> Dict:
+        """Get entry count and hit/miss counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'persistent': self.path is not None
+            }
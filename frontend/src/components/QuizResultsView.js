@@ -67,6 +67,26 @@ const QuizResultsView = ({ attemptId, showBackButton = false, onBack }) => {
     fetchAttempt();
   }, [fetchAttempt]);
 
+  // Recommendations generated in the background arrive after the score
+  useEffect(() => {
+    if (!attemptId || attempt?.recommendationsStatus !== 'pending') return undefined;
+    const timer = setInterval(async () => {
+      try {
+        const response = await axios.get(`${API_URL}/quiz-results/attempt/${attemptId}/recommendations`);
+        if (response.data.success && response.data.recommendationsStatus !== 'pending') {
+          setAttempt(prev => ({
+            ...prev,
+            recommendationsStatus: response.data.recommendationsStatus,
+            resourceRecommendations: response.data.resourceRecommendations
+          }));
+        }
+      } catch (err) {
+        console.error(err);
+      }
+    }, 3000);
+    return () => clearInterval(timer);
+  }, [attemptId, attempt?.recommendationsStatus]);
+
   const handleMarkComplete = async (resourceType, resourceIndex) => {
     try {
       const response = await axios.post(`${API_URL}/quiz-results/${attemptId}/mark-complete`, {
@@ -148,6 +168,7 @@ const QuizResultsView = ({ attemptId, showBackButton = false, onBack }) => {
     percentage,
     detailedResults,
     resourceRecommendations,
+    recommendationsStatus,
   } = attempt;
 
   const progressPercentage = calculateProgress();
@@ -193,6 +214,13 @@ const QuizResultsView = ({ attemptId, showBackButton = false, onBack }) => {
         ))}
       </div>
 
+      {recommendationsStatus === 'pending' && (
+        <div className="resource-recommendations">
+          <h2>Resources to Help You Improve</h2>
+          <p>Finding videos and articles for the topics you missed...</p>
+        </div>
+      )}
+
       {hasResources && (
         <div className="resource-recommendations">
           <div className="progress-header">
@@ -82,6 +82,26 @@ const QuizResults = () => {
     }
   }, [studentId, attemptId, fetchStudentResults, fetchAttempt]);
 
+  // Recommendations generated in the background arrive after the score
+  useEffect(() => {
+    if (!attemptId || attempt?.recommendationsStatus !== 'pending') return undefined;
+    const timer = setInterval(async () => {
+      try {
+        const response = await axios.get(`${API_URL}/quiz-results/attempt/${attemptId}/recommendations`);
+        if (response.data.success && response.data.recommendationsStatus !== 'pending') {
+          setAttempt(prev => ({
+            ...prev,
+            recommendationsStatus: response.data.recommendationsStatus,
+            resourceRecommendations: response.data.resourceRecommendations
+          }));
+        }
+      } catch (err) {
+        console.error(err);
+      }
+    }, 3000);
+    return () => clearInterval(timer);
+  }, [attemptId, attempt?.recommendationsStatus]);
+
   useEffect(() => {
     const userData = localStorage.getItem('user');
     if (userData) {
@@ -198,6 +218,7 @@ const QuizResults = () => {
     percentage,
     detailedResults,
     resourceRecommendations,
+    recommendationsStatus,
   } = attempt;
 
   const progressPercentage = calculateProgress();
@@ -251,6 +272,13 @@ const QuizResults = () => {
         ))}
       </div>
 
+      {recommendationsStatus === 'pending' && (
+        <div className="resource-recommendations">
+          <h2>Resources to Help You Improve</h2>
+          <p>Finding videos and articles for the topics you missed...</p>
+        </div>
+      )}
+
       {hasResources && (
         <div className="resource-recommendations">
           <div className="progress-header">